@@ -19,18 +19,30 @@
 """
 
 import os
+import hashlib
 import logging
 import pickle
 import timeit
 from scipy import sparse
-from multiprocessing import Process, Queue
-import queue  # For the exception queue.Empty which is not in the multiprocessing package
+from multiprocessing import Queue
 
+import checkpoint
+import corpus_pack
+import features_extraction
 import features_space
+import features_values
+import metrics
+import shared_rows
+import vocabulary
+import workers_pool
 import utility
 
 
 features2int_dict = None
+vocabulary_path = None  # Vocabulary of features2int_dict, attached to by the workers
+
+QUEUE_SIZE = 1024  # Rows the workers may be ahead of the main process (backpressure)
+BATCH_SIZE = 512  # Rows per block of the matrix, assembled while the workers go on
 
 
 class Analysis:
@@ -80,177 +92,367 @@ def main_analysis(js_dirs, js_files, labels_files, labels_dirs, features2int_dic
 
     start = timeit.default_timer()
 
-    global features2int_dict
-    features2int_dict = pickle.load(open(features2int_dict_path, 'rb'))
+    load_features(features2int_dict_path)
 
     if js_dirs is None and js_files is None:
         logging.error('Please, indicate a directory or a JS file to be studied')
 
     else:
-        if js_files is not None:
-            files2do = js_files
-            if labels_files is None:
-                labels_files = ['?' for _, _ in enumerate(js_files)]
-            labels = labels_files
-        else:
-            files2do, labels = [], []
-        if js_dirs is not None:
-            i = 0
-            if labels_dirs is None:
-                labels_dirs = ['?' for _, _ in enumerate(js_dirs)]
-            for cdir in js_dirs:
-                for cfile in os.listdir(cdir):
-                    files2do.append(os.path.join(cdir, cfile))
-                    if labels_dirs is not None:
-                        labels.append(labels_dirs[i])
-                i += 1
-
-        analyses = get_features(files2do, labels)
+        files2do, labels = list_inputs(js_dirs, js_files, labels_files, labels_dirs)
+        features_repr = get_features(files2do, labels)
         logging.info('Got all features')
-        features_repr = get_features_representation(analyses)
 
         utility.micro_benchmark('Total elapsed time:', timeit.default_timer() - start)
 
         return features_repr
 
 
-def worker_get_features_vector(my_queue, out_queue, except_queue):
-    """ Worker to get the features."""
+def main_analysis_stream(js_dirs, js_files, labels_files, labels_dirs, features2int_dict_path,
+                         batch_size=BATCH_SIZE):
+    """
+        Same as main_analysis, but yields the results block by block, as the files are
+        analyzed (cf. iter_features), e.g. to classify a block while the next ones are
+        extracted.
 
-    while True:
-        try:
-            analysis = my_queue.get(timeout=2)
-            try:
-                features = features_space.features_vector(analysis.file_path,
-                                                          len(features2int_dict), features2int_dict)
-                analysis.set_features(features)
-                out_queue.put(analysis)  # To share modified analysis object between processes
-            except Exception as e:  # Handle exception occurring in the processes spawned
-                logging.error('Something went wrong with %s', analysis.file_path)
-                print(e)
-                except_queue.put([analysis.file_path, e])
-        except queue.Empty:  # Empty queue exception
-            break
+        -------
+        Parameters:
+        - js_dirs, js_files, labels_files, labels_dirs, features2int_dict_path:
+            Same as for main_analysis.
+        - batch_size: int
+            Number of files per block.
 
+        -------
+        Yields:
+        -list:
+            Same as main_analysis, for the files of a block.
+    """
 
-def get_features(files2do, labels):
+    start = timeit.default_timer()
+
+    load_features(features2int_dict_path)
+
+    if js_dirs is None and js_files is None:
+        logging.error('Please, indicate a directory or a JS file to be studied')
+        return
+
+    files2do, labels = list_inputs(js_dirs, js_files, labels_files, labels_dirs)
+    for names, features, labels_valid in iter_features(files2do, labels, batch_size):
+        yield get_features_representation(names, features, labels_valid)
+    logging.info('Got all features')
+
+    utility.micro_benchmark('Total elapsed time:', timeit.default_timer() - start)
+
+
+def load_features(features2int_dict_path):
+    """ Loads the dictionary mapping features to int, and its vocabulary. """
+
+    global features2int_dict, vocabulary_path
+    features2int_dict = pickle.load(open(features2int_dict_path, 'rb'))
+    vocabulary_path = vocabulary.get_vocabulary_path(features2int_dict_path, features2int_dict)
+
+
+def main_analysis_models(js_dirs, js_files, labels_files, labels_dirs, features2int_dict_paths):
     """
-        Returns an analysis object with its features attribute filled
+        Same as main_analysis, for several models: the features of each file are extracted
+        once, and mapped to the vector space of each model. The models whose features (and
+        values policy) are the same share their matrix.
+
+        -------
+        Parameters:
+        - js_dirs, js_files, labels_files, labels_dirs:
+            Same as for main_analysis.
+        - features2int_dict_paths: list of strings
+            Paths of the dictionaries mapping features to int, one per model.
+
+        -------
+        Returns:
+        -list:
+            * 1st element: list containing valid files' name;
+            * 2nd element: list of sparse matrices containing the features results, one per
+            model (the same object for the models sharing their features);
+            * 3rd element: list containing the true labels of the valid JS files.
     """
 
-    my_queue = Queue()
-    out_queue = Queue()
-    except_queue = Queue()
-    workers = list()
+    if js_dirs is None and js_files is None:
+        logging.error('Please, indicate a directory or a JS file to be studied')
+        return None
+
+    spaces = list()  # (features2int_dict_path, policy) of the distinct vector spaces
+    space_ids = list()  # Space of each model
+    digests = list()
+    for features2int_dict_path in features2int_dict_paths:
+        policy = features_values.read_policy(os.path.dirname(features2int_dict_path))
+        with open(features2int_dict_path, 'rb') as features_file:
+            digest = (hashlib.blake2b(features_file.read()).digest(), sorted(policy.items()))
+        if digest not in digests:
+            digests.append(digest)
+            spaces.append((features2int_dict_path, policy))
+        space_ids.append(digests.index(digest))
+
+    if len(spaces) == 1:  # One extraction, as for one model
+        features_values.configure(spaces[0][1]['values'], spaces[0][1]['max_length'],
+                                  spaces[0][1]['number_buckets'])
+        names, features, labels = main_analysis(js_dirs, js_files, labels_files, labels_dirs,
+                                                spaces[0][0])
+        return [names, [features for _ in space_ids], labels]
 
-    logging.info('Preparing processes to get all features')
+    start = timeit.default_timer()
+    files2do, labels = list_inputs(js_dirs, js_files, labels_files, labels_dirs)
+    names, matrices, labels_valid = get_features_models(files2do, labels, spaces)
+    logging.info('Got all features')
+    utility.micro_benchmark('Total elapsed time:', timeit.default_timer() - start)
 
-    for i, _ in enumerate(files2do):
-        analysis = Analysis(file_path=files2do[i], label=labels[i])
-        my_queue.put(analysis)
+    return [names, [matrices[space_id] for space_id in space_ids], labels_valid]
 
-    for i in range(utility.NUM_WORKERS):
-        p = Process(target=worker_get_features_vector, args=(my_queue, out_queue, except_queue))
-        p.start()
-        workers.append(p)
 
-    analyses = list()
+def list_inputs(js_dirs, js_files, labels_files, labels_dirs):
+    """ Returns the files to analyze (js_files and the ones of js_dirs) and their labels. """
 
-    while True:
-        try:
-            analysis = out_queue.get(timeout=0.01)
-            analyses.append(analysis)
-        except queue.Empty:
-            pass
-        all_exited = True
-        for w in workers:
-            if w.exitcode is None:
-                all_exited = False
-                break
-        if all_exited & out_queue.empty():
-            break
-
-    return analyses
-
-
-def worker_features_representation(my_queue, out_queue):
-    """ Worker to represent the features in the corresponding form (list or CSR). """
-
-    analyses = list()
-    tab_res0 = list()
-    tab_res2 = list()
-    concat_features = None
-
-    while True:
+    if js_files is not None:
+        files2do = js_files
+        if labels_files is None:
+            labels_files = ['?' for _, _ in enumerate(js_files)]
+        labels = labels_files
+    else:
+        files2do, labels = [], []
+    if js_dirs is not None:
+        i = 0
+        if labels_dirs is None:
+            labels_dirs = ['?' for _, _ in enumerate(js_dirs)]
+        for cdir in js_dirs:
+            cfiles, clabels = corpus_pack.list_files(cdir, labels_dirs[i])  # Folder or pack
+            files2do.extend(cfiles)
+            labels.extend(clabels)
+            i += 1
+    return files2do, labels
+
+
+def worker_get_features_vector(my_queue, out_queue, except_queue, chunk_dir):
+    """ Worker to get the features, with the vocabulary attached to by its initializer. The
+    features vectors are written to the worker's chunk, cf. shared_rows.py; only their
+    descriptors are put in out_queue. """
+
+    features_vocabulary = vocabulary.get_vocabulary()
+    row_writer = shared_rows.RowWriter(chunk_dir)
+    for file_id, file_path in workers_pool.iter_tasks(my_queue):
         try:
-            analysis = my_queue.get(timeout=2)
-            analyses.append(analysis)
-        except queue.Empty:  # Empty queue exception
-            break
+            with metrics.timer('file_seconds'):
+                features = features_space.features_vector(file_path,
+                                                          len(features_vocabulary),
+                                                          features_vocabulary)
+            if features is not None:
+                out_queue.put(row_writer.write(file_id, features))
+            else:
+                out_queue.put((file_id, None, 0, 0))
+        except Exception as e:  # Handle exception occurring in the processes spawned
+            logging.error('Something went wrong with %s', file_path)
+            print(e)
+            except_queue.put([file_path, e])
+            metrics.increment('files_failed')
+    row_writer.close()
+
 
-    for analysis in analyses:
-        features = analysis.features
-        if features is not None:
-            tab_res0.append(analysis.file_path)
-            concat_features = sparse.vstack((concat_features, features), format='csr')
-            if concat_features is None or concat_features.nnz == 0:
-                logging.error('Something strange occurred for %s with the features ',
-                              analysis.file_path)
-                logging.error(concat_features)
-            tab_res2.append(analysis.label)
+def get_features(files2do, labels):
+    """
+        Returns the features representation of the files (cf. get_features_representation)
+    """
 
-    logging.info('Merged features in subprocess')
+    names, blocks, labels_valid = list(), list(), list()
+    for block_names, block, block_labels in iter_features(files2do, labels):
+        names.extend(block_names)
+        blocks.append(block)
+        labels_valid.extend(block_labels)
+    if blocks:
+        features = sparse.vstack(blocks, format='csr') if len(blocks) > 1 else blocks[0]
+    else:
+        features = sparse.csr_matrix((0, len(features2int_dict) + 1))
 
-    out_queue.put([tab_res0, tab_res2, concat_features])
+    return get_features_representation(names, features, labels_valid)
 
 
-def get_features_representation(analyses):
+def iter_features(files2do, labels, batch_size=BATCH_SIZE):
     """
-        Returns the features representation used in the ML modules.
+        Features of the files, as a stream: the rows of the workers are assembled into blocks
+        of batch_size rows as they arrive (cf. shared_rows.MatrixBuilder), while the workers
+        go on with the next files. The queue of the rows is bounded, so that the workers wait
+        if the blocks are not consumed (e.g. classified) as fast as they are produced.
+
+        -------
+        Parameters:
+        - files2do: list
+            Paths of the files to analyze.
+        - labels: list
+            Labels of the files.
+        - batch_size: int
+            Number of rows per block.
+
+        -------
+        Yields:
+        - list
+            Names of the valid files of a block.
+        - csr_matrix
+            Features of the block.
+        - list
+            Labels of the valid files of the block.
     """
 
     my_queue = Queue()
-    out_queue = Queue()
-    workers = list()
-
-    tab_res = [[], [], []]
-    concat_features = None
+    out_queue = Queue(QUEUE_SIZE)
+    except_queue = Queue()
+    nb_columns = len(features2int_dict) + 1
 
-    logging.info('Preparing processes to merge all features efficiently')
+    logging.info('Preparing processes to get all features')
 
-    for i, _ in enumerate(analyses):
-        analysis = analyses[i]
-        my_queue.put(analysis)
+    log = checkpoint.open_log('analysis', files2do, labels,
+                              sorted(features2int_dict.items(), key=str))
+    if log is not None:  # Files analyzed in a previous run
+        records = [analysis for analysis in log.records.values() if analysis.features is not None]
+        if records:
+            yield [analysis.file_path for analysis in records],\
+                sparse.vstack([analysis.features for analysis in records], format='csr'),\
+                [analysis.label for analysis in records]
+
+    tasks = [(i, files2do[i]) for i, _ in enumerate(files2do)
+             if log is None or log.todo(files2do[i])]
+    workers_pool.put_tasks(my_queue, tasks, [file_path for _, file_path in tasks])  # Largest first
+
+    chunk_dir = shared_rows.create_chunk_dir()
+    builder = shared_rows.MatrixBuilder(chunk_dir, nb_columns)
+    pool = None
+    try:
+        pool = workers_pool.start_workers(worker_get_features_vector,
+                                          (my_queue, out_queue, except_queue, chunk_dir),
+                                          initializer=vocabulary.attach,
+                                          initargs=(vocabulary_path, ))
+        for descriptor in workers_pool.iter_results(pool, out_queue):
+            file_id, chunk, _, _ = descriptor
+            if log is not None:  # The chunks do not outlive the run
+                analysis = Analysis(file_path=files2do[file_id], label=labels[file_id])
+                if chunk is not None:
+                    analysis.set_features(shared_rows.read_row(chunk_dir, descriptor,
+                                                               nb_columns))
+                log.append(analysis)
+            if chunk is not None and builder.add(descriptor) >= batch_size:
+                yield block_features(builder, files2do, labels)
+        if builder.descriptors:
+            yield block_features(builder, files2do, labels)
+    finally:
+        if pool is not None:
+            workers_pool.stop_workers(pool)  # If the blocks were not all read
+        shared_rows.remove_chunk_dir(chunk_dir)
+
+    if log is not None:
+        log.close(complete=True)
+
+
+def block_features(builder, files2do, labels):
+    """ Names, features and labels of the rows added to builder since its previous block. """
+
+    file_ids, features = builder.flush()
+    return [files2do[file_id] for file_id in file_ids], features,\
+        [labels[file_id] for file_id in file_ids]
+
+
+def worker_get_features_vectors(my_queue, out_queue, except_queue, chunk_dirs, policies):
+    """ Same as worker_get_features_vector, with the vocabularies attached to by
+    vocabulary.attach_all: the features of a file are extracted once with full values, and
+    mapped to each vector space under its values policy; one row is written per space, in the
+    chunk folder of the space. """
+
+    vocabularies = vocabulary.get_vocabularies()
+    row_writers = [shared_rows.RowWriter(chunk_dir) for chunk_dir in chunk_dirs]
+    for file_id, file_path in workers_pool.iter_tasks(my_queue):
+        try:
+            with metrics.timer('file_seconds'):
+                features_dict, total_features = features_extraction.get_features(file_path)
+                rows = None
+                if features_dict is not None:
+                    with metrics.timer('features_vector_seconds'):
+                        rows = list()
+                        for features_vocabulary, policy in zip(vocabularies, policies):
+                            space_dict = features_values.bound_features(features_dict, **policy)\
+                                if features_values.enabled(policy) else features_dict
+                            rows.append(features_space.vocabulary_vector(
+                                space_dict, total_features, len(features_vocabulary),
+                                features_vocabulary))
+            if rows is not None:
+                out_queue.put((file_id, [row_writer.write(file_id, row)
+                                         for row_writer, row in zip(row_writers, rows)]))
+            else:
+                out_queue.put((file_id, None))
+        except Exception as e:  # Handle exception occurring in the processes spawned
+            logging.error('Something went wrong with %s', file_path)
+            print(e)
+            except_queue.put([file_path, e])
+            metrics.increment('files_failed')
+    for row_writer in row_writers:
+        row_writer.close()
+
+
+def get_features_models(files2do, labels, spaces):
+    """
+        Returns the features representation of the files in several vector spaces (list of
+        (features2int_dict_path, values policy)): the names and labels of the valid files, and
+        one matrix per space.
+    """
 
-    for i in range(utility.NUM_WORKERS):
-        p = Process(target=worker_features_representation, args=(my_queue, out_queue))
-        p.start()
-        workers.append(p)
+    my_queue = Queue()
+    out_queue = Queue()
+    except_queue = Queue()
+    vocabulary_paths, nb_columns = list(), list()
+    for features2int_dict_path, _ in spaces:
+        space_dict = pickle.load(open(features2int_dict_path, 'rb'))
+        vocabulary_paths.append(vocabulary.get_vocabulary_path(features2int_dict_path,
+                                                               space_dict))
+        nb_columns.append(len(space_dict) + 1)
+    policies = [policy for _, policy in spaces]
+
+    workers_pool.put_tasks(my_queue, list(enumerate(files2do)), files2do)  # Largest first
+
+    previous_policy = features_values.get_policy()
+    features_values.configure('full')  # Raw features, bounded per space by the workers
+    chunk_dirs = [shared_rows.create_chunk_dir() for _ in spaces]
+    pool = None
+    try:
+        pool = workers_pool.start_workers(worker_get_features_vectors,
+                                          (my_queue, out_queue, except_queue, chunk_dirs,
+                                           policies),
+                                          initializer=vocabulary.attach_all,
+                                          initargs=(vocabulary_paths, ))
+        descriptors = [list() for _ in spaces]
+        for file_id, space_descriptors in workers_pool.iter_results(pool, out_queue):
+            if space_descriptors is not None:
+                for space, descriptor in enumerate(space_descriptors):
+                    descriptors[space].append(descriptor)
+        assembled = [shared_rows.assemble(chunk_dir, space_descriptors, space_columns)
+                     for chunk_dir, space_descriptors, space_columns
+                     in zip(chunk_dirs, descriptors, nb_columns)]
+    finally:
+        if pool is not None:
+            workers_pool.stop_workers(pool)  # If the results were not all read
+        features_values.configure(previous_policy['values'], previous_policy['max_length'],
+                                  previous_policy['number_buckets'])
+        for chunk_dir in chunk_dirs:
+            shared_rows.remove_chunk_dir(chunk_dir)
+
+    # Same rows order in each space: the rows of a file are written in the same order by the
+    # same worker, but its chunks may be rotated at different rows, cf. shared_rows.chunk_order
+    file_ids = assembled[0][0]
+    for space, (space_file_ids, _) in enumerate(assembled[1:], 1):
+        if space_file_ids != file_ids:
+            raise ValueError('The rows of the vector space %s are not in the same order as the '
+                             'ones of the first space' % spaces[space][0])
+    names = [files2do[file_id] for file_id in file_ids]
+    labels_valid = [labels[file_id] for file_id in file_ids]
+    return names, [features for _, features in assembled], labels_valid
+
+
+def get_features_representation(names, features, labels):
+    """
+        Returns the features representation used in the ML modules.
+    """
 
-    while True:
-        try:
-            # Get modified analysis objects
-            [tab_res0, tab_res2, features] = out_queue.get(timeout=0.01)
-            if features is not None and features.nnz > 0:
-                tab_res[0].extend(tab_res0)
-                tab_res[2].extend(tab_res2)
-                try:
-                    concat_features = sparse.vstack((concat_features, features), format='csr')
-                except ValueError:
-                    logging.error('Problem to merge %s with %s', concat_features, features)
-            logging.info('Merged features in main process')
-        except queue.Empty:
-            pass
-        all_exited = True
-        for w in workers:
-            if w.exitcode is None:
-                all_exited = False
-                break
-        if all_exited & out_queue.empty():
-            break
-
-    tab_res[1].append(concat_features)
-    tab_res[1] = tab_res[1][0]
+    tab_res = [names, features, labels]
 
     if len(tab_res[0]) != tab_res[1].shape[0] or len(tab_res[0]) != len(tab_res[2])\
             or tab_res[1].shape[0] != len(tab_res[2]):
@@ -0,0 +1,348 @@
+# Copyright (C) 2019 Aurore Fass
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+    Columnar binary encoding of the Esprima AST (js_ast.js FILE - columnar), instead of JSON:
+    the nodes, in the order of the Node objects of ast_generation.py, are given as typed
+    arrays, loaded with numpy.frombuffer, and the features are computed with array operations,
+    without building Node objects. Running this module checks that the features are the same
+    as with the JSON AST, and compares the time spent on both.
+
+    Layout (little-endian): 'JSDCOL01', number of nodes N, of strings S and of UTF-16 code units
+    of the strings (uint32); then the type (string index), parent index, end of the subtree
+    (exclusive) and value (string index, or -1) of the nodes (int32 x N each); the offsets of
+    the strings (uint32 x S + 1, in code units); the kinds of the values (uint8 x N); the
+    strings (UTF-16).
+"""
+
+import os
+import json
+import logging
+import argparse
+import timeit
+import numpy as np
+
+import ast_generation
+import ast_units
+import corpus_pack
+import features_extraction
+import features_memo
+import features_values
+import metrics
+import parser_backends
+import utility
+
+
+AST_FORMAT = 'json'  # Encoding of the ASTs produced by Node.js: 'json' or 'columnar'
+
+MAGIC = b'JSDCOL01'
+HEADER_SIZE = 20
+NO_VALUE, STRING, NUMBER, TRUE, FALSE, NULL = range(6)  # Kinds of the values, cf. js_ast.js
+
+UNITS_DICT = ast_units.AST_UNITS_DICT
+LITERAL_CONTEXTS = {TRUE: 'Int', FALSE: 'Int', NULL: 'Null'}  # bool is an int in Python
+LITERAL_VALUES = {TRUE: True, FALSE: False, NULL: None}
+
+
+def configure(ast_format):
+    global AST_FORMAT
+    AST_FORMAT = ast_format
+
+
+def enabled():
+    """ Whether the features are built from the columnar ASTs. The memoization, cf.
+    features_memo.py, needs the Node objects, hence takes precedence. """
+
+    return AST_FORMAT == 'columnar' and parser_backends.BACKEND == 'node'\
+        and features_memo.MEMO is None
+
+
+class ColumnarAst:
+    """
+    Class ColumnarAst: nodes of an AST, as numpy arrays, and its strings.
+    """
+
+    def __init__(self, buffer):
+        if buffer[:len(MAGIC)] != MAGIC:
+            raise ValueError('Not a columnar AST')
+        self.nb_nodes, nb_strings, nb_units = np.frombuffer(buffer, dtype='<u4', count=3,
+                                                            offset=len(MAGIC)).tolist()
+        offset = HEADER_SIZE
+        columns = np.frombuffer(buffer, dtype='<i4', count=4 * self.nb_nodes, offset=offset)
+        self.types, self.parents, self.ends, self.values = columns.reshape(4, self.nb_nodes)
+        offset += 16 * self.nb_nodes
+        offsets = np.frombuffer(buffer, dtype='<u4', count=nb_strings + 1, offset=offset)
+        offset += 4 * (nb_strings + 1)
+        self.kinds = np.frombuffer(buffer, dtype=np.uint8, count=self.nb_nodes, offset=offset)
+        offset += self.nb_nodes
+        self.strings = decode_strings(buffer[offset:offset + 2 * nb_units], offsets.tolist())
+
+
+def decode_strings(table, offsets):
+    """ Strings of the UTF-16 table, as json.loads gets them: the surrogate pairs are combined,
+    the lone surrogates kept. """
+
+    text = table.decode('utf-16-le', errors='surrogatepass')
+    if len(text) == offsets[-1]:  # No surrogate pairs: the offsets are those of text
+        return [text[start:end] for start, end in zip(offsets, offsets[1:])]
+    return [table[2 * start:2 * end].decode('utf-16-le', errors='surrogatepass')
+            for start, end in zip(offsets, offsets[1:])]
+
+
+def number(text):
+    """ int or float of a JSON number, as json.loads. """
+
+    if '.' in text or 'e' in text or 'E' in text:
+        return float(text)
+    return int(text)
+
+
+def get_columnar_ast(input_file):
+    """
+        Runs Esprima (through Node.js) on input_file, the AST being encoded in columns.
+
+        -------
+        Returns:
+        - ColumnarAst
+        - or None if an error occurred.
+    """
+
+    source = corpus_pack.read_input(input_file) if corpus_pack.is_pack_entry(input_file) \
+        else None
+    metrics.observe('bytes_read', len(source) if source is not None
+                    else os.path.getsize(input_file))
+    with metrics.timer('node_parse_seconds'):
+        produce_ast = ast_generation.produce_esprima_ast(input_file, '-', source,
+                                                         ast_format='columnar')
+    if produce_ast.returncode == 0:
+        with metrics.timer('columnar_decode_seconds'):
+            return ColumnarAst(produce_ast.stdout)
+    logging.error('Esprima could not produce an AST for %s', input_file)
+    metrics.increment('parse_errors')
+    return None
+
+
+def count_features(columnar_ast):
+    """
+        Features of a columnar AST, as features_extraction.build_features on its Node objects:
+        the nodes of an AST unit give a feature (unit, first Identifier of their subtree), the
+        Literal ones (literal type, value), and the ExpressionStatement ones are skipped if
+        their first child is an AST unit.
+
+        -------
+        Returns:
+        - dict
+            Features (before the values policy) and their number of occurrences, in the order
+            of their first occurrence.
+        - int
+            Total number of features.
+    """
+
+    strings = columnar_ast.strings
+    types, ends, values = columnar_ast.types, columnar_ast.ends, columnar_ast.values
+    nb_nodes = columnar_ast.nb_nodes
+
+    # Codes of the types: 0 for the non-units, 1 for Literal, then one per context
+    contexts = [None, None]
+    type_codes = np.zeros(len(strings), dtype=np.int64)
+    for string_index in np.unique(types[1:]).tolist():
+        unit = UNITS_DICT[strings[string_index]]  # KeyError for an unknown node, as Node objects
+        if unit == 'Literal':
+            type_codes[string_index] = 1
+        elif unit != 0:
+            if unit not in contexts:
+                contexts.append(unit)
+            type_codes[string_index] = contexts.index(unit)
+    codes = type_codes[types]
+    codes[0] = 0  # The root gives no feature
+
+    indexes = np.arange(nb_nodes)
+    first_children = np.minimum(indexes + 1, nb_nodes - 1)
+    has_children = ends > indexes + 1
+
+    # Literals with a value (not the regular expressions)
+    literals = (codes == 1) & (columnar_ast.kinds != NO_VALUE)
+
+    # Units, with the first Identifier of their subtree
+    units = codes > 1
+    if 'ExpressionStatement' in contexts:
+        units &= ~((codes == contexts.index('ExpressionStatement')) & has_children
+                   & (codes[first_children] != 0))
+    identifiers = np.append(np.flatnonzero(types == type_index(strings, 'Identifier')), nb_nodes)
+    first_identifiers = identifiers[np.searchsorted(identifiers, indexes + 1)]  # Or nb_nodes
+    units &= first_identifiers < ends
+
+    # This: MemberExpression whose first child is a ThisExpression
+    if 'Object' in contexts:
+        this_members = (types == type_index(strings, 'MemberExpression')) & has_children\
+            & (types[first_children] == type_index(strings, 'ThisExpression'))
+        codes = np.where(units & this_members, len(contexts), codes)
+        contexts.append('This')
+
+    # Features (context code, kind, string index) in the order of the nodes
+    emitters = np.flatnonzero(units | literals)
+    feature_codes = codes[emitters]
+    is_literal = feature_codes == 1
+    feature_values = np.where(is_literal, values[emitters],
+                              values[np.minimum(first_identifiers[emitters], nb_nodes - 1)])
+    feature_kinds = np.where(is_literal, columnar_ast.kinds[emitters], STRING)
+    keys = (feature_codes << 40) | (feature_kinds.astype(np.int64) << 32)\
+        | (feature_values.astype(np.int64) & 0xFFFFFFFF)
+    distinct, first_occurrences, occurrences = np.unique(keys, return_index=True,
+                                                         return_counts=True)
+    order = np.argsort(first_occurrences, kind='stable')
+
+    features_dict = dict()
+    for key, count in zip(distinct[order].tolist(), occurrences[order].tolist()):
+        code, kind, value = key >> 40, (key >> 32) & 0xFF, key & 0xFFFFFFFF
+        if code != 1:
+            feature = (contexts[code], strings[value])
+        elif kind == NUMBER:
+            value = number(strings[value])
+            feature = ('Int' if isinstance(value, int) else 'Numeric', value)
+        elif kind == STRING:
+            feature = ('String', strings[value])
+        else:
+            feature = (LITERAL_CONTEXTS[kind], LITERAL_VALUES[kind])
+        # Equal features as dict keys (e.g. 1 and true) are merged, the first one being kept
+        features_dict[feature] = features_dict.get(feature, 0) + count
+    return features_dict, len(emitters)
+
+
+def type_index(strings, node_type):
+    """ Index of node_type in the strings of an AST, or -1 if it has no such node. """
+
+    try:
+        return strings.index(node_type)
+    except ValueError:
+        return -1
+
+
+def get_features(input_file):
+    """ Features of input_file from its columnar AST, with the values policy applied, cf.
+    features_extraction.count_features; or None, None if it could not be parsed. """
+
+    columnar_ast = get_columnar_ast(input_file)
+    if columnar_ast is None:
+        return None, None
+    metrics.observe('ast_nodes', columnar_ast.nb_nodes)
+    with metrics.timer('build_features_seconds'):
+        features_dict, total_features = count_features(columnar_ast)
+    if features_values.enabled():
+        features_dict = features_values.bound_features(features_dict)
+    metrics.observe('features_emitted', total_features)
+    return features_dict, total_features
+
+
+def check(files):
+    """
+        Checks that the features of the files are the same from their JSON and columnar ASTs,
+        and compares the time spent on both, in Node.js and in Python, and the size of the ASTs.
+
+        -------
+        Parameters:
+        - files: list
+            Paths of the JS files.
+
+        -------
+        Returns:
+        - list
+            Files whose features differ.
+    """
+
+    mismatches = list()
+    times = {'json': [0, 0], 'columnar': [0, 0]}  # Node.js, Python
+    sizes = {'json': 0, 'columnar': 0}
+    for input_file in files:
+        source = corpus_pack.read_input(input_file) if corpus_pack.is_pack_entry(input_file)\
+            else None
+
+        start = timeit.default_timer()
+        produce_ast = ast_generation.produce_esprima_ast(input_file, '-', source)
+        middle = timeit.default_timer()
+        if produce_ast.returncode != 0:
+            logging.error('Esprima could not produce an AST for %s', input_file)
+            continue
+        extended_ast = ast_generation.esprima_to_extended_ast(json.loads(produce_ast.stdout))
+        ast = ast_generation.ast_to_ast_nodes(extended_ast.get_ast(),
+                                              ast_nodes=ast_generation.Node('Program'))
+        features_list = list()
+        features_extraction.build_features(ast, features_list)
+        expected = dict()
+        for feature in features_list:
+            expected[feature] = expected.get(feature, 0) + 1
+        end = timeit.default_timer()
+        times['json'][0] += middle - start
+        times['json'][1] += end - middle
+        sizes['json'] += len(produce_ast.stdout)
+
+        start = timeit.default_timer()
+        produce_ast = ast_generation.produce_esprima_ast(input_file, '-', source,
+                                                         ast_format='columnar')
+        middle = timeit.default_timer()
+        features_dict, total_features = count_features(ColumnarAst(produce_ast.stdout))
+        end = timeit.default_timer()
+        times['columnar'][0] += middle - start
+        times['columnar'][1] += end - middle
+        sizes['columnar'] += len(produce_ast.stdout)
+
+        if total_features != len(features_list)\
+                or [(feature, type(feature[1]), count) for feature, count in features_dict.items()]\
+                != [(feature, type(feature[1]), count) for feature, count in expected.items()]:
+            logging.error('Different features from the columnar AST for %s', input_file)
+            mismatches.append(input_file)
+
+    print('Columnar AST: ' + str(len(mismatches)) + ' file(s) with different features')
+    for ast_format in ('json', 'columnar'):
+        print(ast_format + ': Node.js ' + str(round(times[ast_format][0], 2)) + 's, Python '
+              + str(round(times[ast_format][1], 2)) + 's, '
+              + str(round(sizes[ast_format] / (1 << 20), 1)) + ' MiB of AST')
+    return mismatches
+
+
+def parsing_commands():
+    """
+        Creation of an ArgumentParser object, holding all the information necessary to parse
+        the command line into Python data types.
+    """
+
+    parser = argparse.ArgumentParser(description='Checks that the features are the same from '
+                                                 + 'the JSON and the columnar ASTs.')
+
+    parser.add_argument('--d', metavar='DIR', type=str, nargs='+',
+                        help='directories containing the JS files to check')
+    parser.add_argument('--f', metavar='FILE', type=str, nargs='+', help='JS files to check')
+    utility.parsing_commands(parser)
+
+    return vars(parser.parse_args())
+
+
+def main_check():
+    """ Main function, checks the columnar ASTs. """
+
+    args = parsing_commands()
+    utility.control_logger(args['v'][0])
+    utility.configure_extraction(args)
+
+    files = list(args['f'] or [])
+    for js_dir in args['d'] or []:
+        files.extend(corpus_pack.list_files(js_dir)[0])
+    if not files:
+        logging.error('Please, indicate the JS directories or files to check')
+        return
+    check(files)
+
+
+if __name__ == "__main__":  # Executed only if run as a script
+    main_check()
@@ -22,6 +22,10 @@ import json
 import os
 from subprocess import run, PIPE
 
+import cpu_budget
+import metrics
+import parser_backends
+
 
 SRC_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__)))
 
@@ -122,7 +126,79 @@ class Node:
         return None
 
 
-def get_extended_ast(input_file, json_path='1', remove_json=True):
+def produce_esprima_ast(input_file, json_path='1', source=None, ast_format='json'):
+    """
+        Runs Esprima (through Node.js) on input_file.
+
+        -------
+        Parameters:
+        - input_file: str
+            Path of the file to produce an AST from.
+        - json_path: str
+            Path of the JSON file to store the AST in, or '-' to get it on stdout.
+        - source: bytes
+            Content of input_file, given to Node.js on stdin (e.g. for packed corpora).
+            Default: None, input_file is read by Node.js.
+        - ast_format: str
+            Encoding of the AST on stdout, for json_path '-': 'json', or 'columnar' (cf.
+            ast_columnar.py).
+
+        -------
+        Returns:
+        - CompletedProcess
+            Result of the Node.js process.
+    """
+
+    node = ['node'] + cpu_budget.node_arguments()
+    options = [json_path] + (['columnar'] if ast_format == 'columnar' else [])
+    if source is not None:
+        return run(node + [os.path.join(SRC_PATH, 'js_ast.js'), '-'] + options, input=source,
+                   stdout=PIPE)
+    return run(node + [os.path.join(SRC_PATH, 'js_ast.js'), input_file] + options, stdout=PIPE)
+
+
+def load_extended_ast(json_path, remove_json=True):
+    """
+        Builds an ExtendedAst object from the Esprima AST stored in json_path.
+
+        -------
+        Parameters:
+        - json_path: str
+            Path of the JSON file containing the Esprima AST.
+        - remove_json: bool
+            Indicates whether to remove or not the JSON file containing the Esprima AST.
+            Default: True.
+
+        -------
+        Returns:
+        - ExtendedAst
+    """
+
+    with open(json_path) as json_data:
+        esprima_ast = json.loads(json_data.read())
+    if remove_json:
+        os.remove(json_path)
+
+    return esprima_to_extended_ast(esprima_ast)
+
+
+def esprima_to_extended_ast(esprima_ast):
+    """ Builds an ExtendedAst object from an Esprima AST (dict). """
+
+    extended_ast = ExtendedAst()
+    extended_ast.set_type(esprima_ast['type'])
+    extended_ast.set_body(esprima_ast['body'])
+    extended_ast.set_source_type(esprima_ast['sourceType'])
+    extended_ast.set_range(esprima_ast['range'])
+    extended_ast.set_tokens(esprima_ast['tokens'])
+    extended_ast.set_comments(esprima_ast['comments'])
+    if 'leadingComments' in esprima_ast:
+        extended_ast.set_leading_comments(esprima_ast['leadingComments'])
+
+    return extended_ast
+
+
+def get_extended_ast(input_file, json_path='1', remove_json=True, source=None):
     """
         JavaScript AST production.
 
@@ -131,10 +207,15 @@ def get_extended_ast(input_file, json_path='1', remove_json=True):
         - input_file: str
             Path of the file to produce an AST from.
         - json_path: str
-            Path of the JSON file to temporary store the AST in.
+            Path of the JSON file to temporary store the AST in, or '-' to get it on stdout
+            (no temporary file).
         - remove_json: bool
             Indicates whether to remove or not the JSON file containing the Esprima AST.
             Default: True.
+        - source: bytes
+            Content of input_file, if it should not be read from the disk. Default: None.
+        The AST is produced by the parser backend selected in parser_backends.py; json_path
+        and remove_json only apply to the node backend.
 
         -------
         Returns:
@@ -144,30 +225,28 @@ def get_extended_ast(input_file, json_path='1', remove_json=True):
         - None if an error occurred.
     """
 
-    produce_ast = run(['node', os.path.join(SRC_PATH, 'js_ast.js'), input_file, json_path],
-                      stdout=PIPE)
+    if parser_backends.BACKEND != 'node' and json_path != '1':  # In-process parser
+        with metrics.timer(parser_backends.BACKEND + '_parse_seconds'):
+            esprima_ast = parser_backends.parse(input_file, source)
+        if esprima_ast is not None:
+            return esprima_to_extended_ast(esprima_ast)
+        logging.error('Esprima could not produce an AST for %s', input_file)
+        metrics.increment('parse_errors')
+        return None
+
+    with metrics.timer('node_parse_seconds'):
+        produce_ast = produce_esprima_ast(input_file, json_path, source)
     if produce_ast.returncode == 0:
         if json_path == '1':
             ast = produce_ast.stdout.decode('utf-8').replace('\n', '')
             return ast.split('##!!**##')
-        else:
-            with open(json_path) as json_data:
-                esprima_ast = json.loads(json_data.read())
-            if remove_json:
-                os.remove(json_path)
-
-            extended_ast = ExtendedAst()
-            extended_ast.set_type(esprima_ast['type'])
-            extended_ast.set_body(esprima_ast['body'])
-            extended_ast.set_source_type(esprima_ast['sourceType'])
-            extended_ast.set_range(esprima_ast['range'])
-            extended_ast.set_tokens(esprima_ast['tokens'])
-            extended_ast.set_comments(esprima_ast['comments'])
-            if 'leadingComments' in esprima_ast:
-                extended_ast.set_leading_comments(esprima_ast['leadingComments'])
-
-            return extended_ast
+        if json_path == '-':
+            with metrics.timer('json_decode_seconds'):
+                return esprima_to_extended_ast(json.loads(produce_ast.stdout))
+        with metrics.timer('json_decode_seconds'):
+            return load_extended_ast(json_path, remove_json)
     logging.error('Esprima could not produce an AST for %s', input_file)
+    metrics.increment('parse_errors')
     return None
 
 
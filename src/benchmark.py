@@ -0,0 +1,385 @@
+# Copyright (C) 2019 Aurore Fass
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+    Per-stage benchmark of the detection pipeline on synthetic JS corpora.
+    Results are stored in a JSON file, so that two commits can be compared.
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import argparse
+import platform
+import tempfile
+import itertools
+import timeit
+from subprocess import run, PIPE
+
+import ast_generation
+import cpu_budget
+import features_extraction
+import features_selection
+import features_space
+import machine_learning
+import shared_rows
+import corpus_generator
+import utility
+
+
+STAGES = ['node_parse', 'json_decode', 'ast_to_ast_nodes', 'build_features', 'features_vector',
+          'csr_assembly', 'chi2_selection', 'fit', 'predict']
+
+
+def stage_statistics(timings):
+    """ Summary of the timings (in seconds) of one stage. """
+
+    timings = sorted(timings)
+    nb = len(timings)
+    if nb == 0:
+        return {'n': 0}
+    return {'n': nb, 'total': sum(timings), 'mean': sum(timings) / nb,
+            'median': timings[nb // 2], 'p95': timings[min(nb - 1, int(nb * 0.95))],
+            'min': timings[0], 'max': timings[-1]}
+
+
+def extract_features_timed(input_file, json_dir, timings):
+    """ features_extraction.get_features, with each stage being timed separately. """
+
+    json_path = os.path.join(json_dir, os.path.basename(input_file) + '.json')
+
+    start = timeit.default_timer()
+    produce_ast = ast_generation.produce_esprima_ast(input_file, json_path)
+    timings['node_parse'].append(timeit.default_timer() - start)
+    if produce_ast.returncode != 0:
+        logging.error('Esprima could not produce an AST for %s', input_file)
+        return None, None
+
+    start = timeit.default_timer()
+    extended_ast = ast_generation.load_extended_ast(json_path)
+    timings['json_decode'].append(timeit.default_timer() - start)
+
+    start = timeit.default_timer()
+    ast = ast_generation.ast_to_ast_nodes(extended_ast.get_ast(),
+                                          ast_nodes=ast_generation.Node('Program'))
+    timings['ast_to_ast_nodes'].append(timeit.default_timer() - start)
+
+    start = timeit.default_timer()
+    features = features_extraction.count_features(ast)
+    timings['build_features'].append(timeit.default_timer() - start)
+
+    return features
+
+
+def benchmark_corpus(files, labels, clf_choice='MNB', confidence=99.9):
+    """
+        Times each stage of the pipeline on the given files.
+
+        -------
+        Parameters:
+        - files: list of str
+            Paths of the JS files.
+        - labels: list of str
+            Labels of the JS files: 'benign' or 'malicious'.
+        - clf_choice: str
+            Classifier to fit and predict with.
+        - confidence: float
+            Confidence of the chi2 test, in percent.
+
+        -------
+        Returns:
+        - dict
+            Per-stage statistics, plus general information on the corpus.
+    """
+
+    timings = dict((stage, list()) for stage in STAGES)
+    json_dir = tempfile.mkdtemp(prefix='jsdetector-bench-')
+    extracted = list()
+
+    try:
+        for i, input_file in enumerate(files):
+            features_dict, total_features = extract_features_timed(input_file, json_dir, timings)
+            if features_dict is not None:
+                extracted.append((features_dict, total_features, labels[i]))
+    finally:
+        shutil.rmtree(json_dir, ignore_errors=True)
+
+    all_features_dict = dict()
+    for features_dict, _, _ in extracted:
+        for feature in features_dict:
+            all_features_dict[feature] = all_features_dict.get(feature, 0) + 1
+
+    start = timeit.default_timer()
+    analyzed_features_dict = features_selection.initialize_analyzed_features_dict(
+        all_features_dict, dict())
+    for features_dict, _, label in extracted:
+        features_selection.analyze_features(analyzed_features_dict, features_dict, label)
+    features2int_dict = features_selection.select_features(analyzed_features_dict, confidence)
+    timings['chi2_selection'].append(timeit.default_timer() - start)
+
+    rows = list()
+    for features_dict, total_features, _ in extracted:
+        start = timeit.default_timer()
+        rows.append(features_space.features_dict_vector(features_dict, total_features,
+                                                        len(features2int_dict),
+                                                        features2int_dict))
+        timings['features_vector'].append(timeit.default_timer() - start)
+
+    start = timeit.default_timer()
+    concat_features = None
+    if rows:  # Same transfer and assembly as analysis.get_features
+        chunk_dir = shared_rows.create_chunk_dir()
+        row_writer = shared_rows.RowWriter(chunk_dir)
+        descriptors = [row_writer.write(i, row) for i, row in enumerate(rows)]
+        row_writer.close()
+        concat_features = shared_rows.assemble(chunk_dir, descriptors,
+                                               len(features2int_dict) + 1)[1]
+        shared_rows.remove_chunk_dir(chunk_dir)
+    timings['csr_assembly'].append(timeit.default_timer() - start)
+
+    labels_valid = [label for _, _, label in extracted]
+    if concat_features is not None and len(set(labels_valid)) > 1:
+        clf = machine_learning.classifier_choice(clf_choice=clf_choice)
+        start = timeit.default_timer()
+        clf.fit(concat_features, labels_valid)
+        timings['fit'].append(timeit.default_timer() - start)
+
+        start = timeit.default_timer()
+        clf.predict(concat_features)
+        timings['predict'].append(timeit.default_timer() - start)
+
+    return {'files': len(files), 'parsed_files': len(extracted),
+            'bytes': sum(os.path.getsize(input_file) for input_file in files),
+            'distinct_features': len(all_features_dict),
+            'selected_features': len(features2int_dict),
+            'stages': dict((stage, stage_statistics(timings[stage])) for stage in STAGES)}
+
+
+def benchmark_budgets(corpus_dir, budgets, clf_choice='RF', confidence=99.9):
+    """
+        Throughput of the features extraction and time of the fit and predict at several CPU
+        budgets (cf. cpu_budget.py).
+
+        -------
+        Parameters:
+        - corpus_dir: str
+            Folder of the corpus, with a benign and a malicious sub-folder.
+        - budgets: list of int
+            Numbers of CPUs.
+        - clf_choice: str
+            Classifier to fit and predict with (RF uses the budget for its n_jobs).
+        - confidence: float
+            Confidence of the chi2 test, in percent.
+
+        -------
+        Returns:
+        - list
+            Results per budget.
+    """
+
+    labels_dirs = ['benign', 'malicious']
+    results = list()
+    for cpus in budgets:
+        cpu_budget.configure(cpus)
+        start = timeit.default_timer()
+        analyses = features_selection.get_features_all_files_multiproc(
+            [os.path.join(corpus_dir, label) for label in labels_dirs], labels_dirs)
+        extraction_time = timeit.default_timer() - start
+        nb_files = len(analyses)
+        analyses = [analysis for analysis in analyses if analysis.features is not None]
+
+        all_features_dicts = {'benign': dict(), 'malicious': dict()}
+        for analysis in analyses:
+            for feature in analysis.features:
+                all_features_dict = all_features_dicts[analysis.label]
+                all_features_dict[feature] = all_features_dict.get(feature, 0) + 1
+        analyzed_features_dict = features_selection.initialize_analyzed_features_dict(
+            all_features_dicts['benign'], all_features_dicts['malicious'])
+        for analysis in analyses:
+            features_selection.analyze_features(analyzed_features_dict, analysis.features,
+                                                analysis.label)
+        features2int_dict = features_selection.select_features(analyzed_features_dict,
+                                                               confidence)
+        attributes = features_space.features_matrix([analysis.features for analysis in analyses],
+                                                    features2int_dict)
+        labels = [analysis.label for analysis in analyses]
+
+        result = {'cpus': cpus, 'files': nb_files, 'extraction': extraction_time,
+                  'files_per_second': nb_files / extraction_time if extraction_time else 0,
+                  'fit': None, 'predict': None}
+        if len(set(labels)) > 1:
+            clf = machine_learning.classifier_choice(clf_choice=clf_choice)
+            start = timeit.default_timer()
+            clf.fit(attributes, labels)
+            result['fit'] = timeit.default_timer() - start
+            start = timeit.default_timer()
+            clf.predict(attributes)
+            result['predict'] = timeit.default_timer() - start
+        results.append(result)
+
+    print('%6s %12s %10s %10s' % ('cpus', 'files/s', 'fit (s)', 'predict (s)'))
+    for result in results:
+        print('%6d %12.2f %10s %10s' % (result['cpus'], result['files_per_second'],
+                                        '-' if result['fit'] is None
+                                        else '%.3f' % result['fit'],
+                                        '-' if result['predict'] is None
+                                        else '%.3f' % result['predict']))
+    return results
+
+
+def git_commit():
+    """ Commit the benchmark is run on, if available. """
+
+    try:
+        rev = run(['git', 'rev-parse', 'HEAD'], stdout=PIPE, stderr=PIPE, cwd=utility.SRC_PATH)
+        if rev.returncode == 0:
+            return rev.stdout.decode('utf-8').strip()
+    except OSError:
+        pass
+    return None
+
+
+def run_benchmark(nb_files, sizes, depths, literal_densities, styles, clf_choice, seed,
+                  corpus_dir=None, budgets=None):
+    """ Generates a benign and a malicious corpus for each combination of parameters and
+    benchmarks the pipeline on them (and, if given, its throughput at each CPU budget). """
+
+    results = {'commit': git_commit(), 'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+               'python': sys.version.split()[0], 'platform': platform.platform(),
+               'classifier': clf_choice, 'corpora': list()}
+
+    tmp_dir = corpus_dir or tempfile.mkdtemp(prefix='jsdetector-corpus-')
+    try:
+        for size, depth, literal_density, style in itertools.product(sizes, depths,
+                                                                     literal_densities, styles):
+            name = style + '_s' + str(size) + '_d' + str(depth) + '_ld' + str(literal_density)
+            print('Currently benchmarking ' + name)
+            files, labels = list(), list()
+            for label in ['benign', 'malicious']:
+                files_label = corpus_generator.generate_corpus(
+                    os.path.join(tmp_dir, name, label), nb_files, size=size, depth=depth,
+                    literal_density=literal_density, style=style,
+                    malicious=label == 'malicious', seed=seed)
+                files.extend(files_label)
+                labels.extend([label] * len(files_label))
+
+            corpus_results = benchmark_corpus(files, labels, clf_choice=clf_choice)
+            if budgets:
+                corpus_results['budgets'] = benchmark_budgets(os.path.join(tmp_dir, name),
+                                                              budgets, clf_choice=clf_choice)
+            corpus_results['corpus'] = {'name': name, 'size': size, 'depth': depth,
+                                        'literal_density': literal_density, 'style': style,
+                                        'files_per_label': nb_files, 'seed': seed}
+            results['corpora'].append(corpus_results)
+    finally:
+        if corpus_dir is None:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    return results
+
+
+def compare_results(old_path, new_path):
+    """ Prints, for each corpus and stage, the total time of 2 benchmark results and their
+    ratio (new / old). """
+
+    with open(old_path) as json_file:
+        old = json.load(json_file)
+    with open(new_path) as json_file:
+        new = json.load(json_file)
+
+    print('Old: ' + str(old.get('commit')) + ', new: ' + str(new.get('commit')))
+    old_corpora = dict((corpus['corpus']['name'], corpus) for corpus in old['corpora'])
+    for corpus in new['corpora']:
+        name = corpus['corpus']['name']
+        if name not in old_corpora:
+            continue
+        print('> ' + name)
+        for stage in STAGES:
+            old_stage = old_corpora[name]['stages'].get(stage, {})
+            new_stage = corpus['stages'].get(stage, {})
+            if 'total' not in old_stage or 'total' not in new_stage:
+                continue
+            ratio = new_stage['total'] / old_stage['total'] if old_stage['total'] else 0
+            print('%-18s %10.4fs %10.4fs %8.2fx' % (stage, old_stage['total'],
+                                                    new_stage['total'], ratio))
+
+
+def parsing_commands():
+    """
+        Creation of an ArgumentParser object, holding all the information necessary to parse
+        the command line into Python data types.
+    """
+
+    parser = argparse.ArgumentParser(description='Benchmarks each stage of the pipeline on '
+                                                 + 'synthetic JS corpora.')
+
+    parser.add_argument('--o', metavar='FILE', type=str, nargs=1,
+                        default=[os.path.join(utility.SRC_PATH, 'Analysis', 'benchmark.json')],
+                        help='JSON file to store the benchmark results in')
+    parser.add_argument('--n', metavar='INT', type=int, nargs=1, default=[50],
+                        help='number of files per label and corpus')
+    parser.add_argument('--size', metavar='BYTES', type=int, nargs='+', default=[5000],
+                        help='approximate sizes of the files')
+    parser.add_argument('--depth', metavar='INT', type=int, nargs='+', default=[3],
+                        help='maximum nesting depths')
+    parser.add_argument('--ld', metavar='FLOAT', type=float, nargs='+', default=[0.3],
+                        help='literal densities, between 0 and 1')
+    parser.add_argument('--style', metavar='STYLE', type=str, nargs='+',
+                        default=corpus_generator.STYLES, choices=corpus_generator.STYLES,
+                        help='coding styles')
+    parser.add_argument('--clf', metavar='CLASSIFIER', type=str, nargs=1, default=['MNB'],
+                        choices=['RF', 'BNB', 'MNB'], help='classifier choice')
+    parser.add_argument('--seed', metavar='INT', type=int, nargs=1, default=[0],
+                        help='seed of the corpus generator')
+    parser.add_argument('--corpus_dir', metavar='DIR', type=str, nargs=1, default=[None],
+                        help='directory to keep the generated corpora in (default: temporary)')
+    parser.add_argument('--budgets', metavar='CPUS', type=int, nargs='+',
+                        help='also measures the throughput of the features extraction and the '
+                             + 'fit and predict times at each of these CPU budgets')
+    parser.add_argument('--compare', metavar='FILE', type=str, nargs=2,
+                        help='compares 2 benchmark results (old, new) instead of running one')
+    utility.parsing_commands(parser)
+
+    return vars(parser.parse_args())
+
+
+def main_benchmark():
+    """ Main function, runs or compares benchmarks. """
+
+    args = parsing_commands()
+    utility.control_logger(args['v'][0])
+    cpu_budget.configure(args['cpus'][0])
+    utility.configure_extraction(args)
+
+    if args['compare'] is not None:
+        compare_results(args['compare'][0], args['compare'][1])
+        return
+
+    results = run_benchmark(args['n'][0], args['size'], args['depth'], args['ld'],
+                            args['style'], args['clf'][0], args['seed'][0],
+                            corpus_dir=args['corpus_dir'][0], budgets=args['budgets'])
+
+    out_dir = os.path.dirname(os.path.abspath(args['o'][0]))
+    if not os.path.exists(out_dir):
+        os.makedirs(out_dir)
+    with open(args['o'][0], 'w') as json_file:
+        json.dump(results, json_file, indent=2)
+    logging.info('The benchmark results have been stored in %s', args['o'][0])
+
+
+if __name__ == "__main__":  # Executed only if run as a script
+    main_benchmark()
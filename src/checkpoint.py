@@ -0,0 +1,127 @@
+# Copyright (C) 2019 Aurore Fass
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+    Checkpoints of the per-file results of the worker pools, in append-only logs, so that an
+    interrupted run can be resumed (--resume) without analyzing the completed files again.
+"""
+
+import os
+import pickle
+import hashlib
+import logging
+import timeit
+
+import features_values
+
+
+CHECKPOINT_PATH = None  # Folder to store the logs in, or None (no checkpoint)
+RESUME = False  # Reuse the results stored in the logs
+SYNC_INTERVAL = 30  # Seconds between 2 writes of the log to the disk
+
+_COMPLETE = None  # Key of the record marking a stage as complete
+
+
+def configure(checkpoint_path, resume, analysis_path):
+    """ Enables the checkpoints, in checkpoint_path (default with resume:
+    analysis_path/Checkpoint). """
+
+    global CHECKPOINT_PATH, RESUME
+    if checkpoint_path is None and resume:
+        checkpoint_path = os.path.join(analysis_path, 'Checkpoint')
+    CHECKPOINT_PATH = checkpoint_path
+    RESUME = resume
+    if checkpoint_path is not None and not os.path.exists(checkpoint_path):
+        os.makedirs(checkpoint_path)
+
+
+class Checkpoint:
+    """
+    Class Checkpoint: append-only log of the results (with a file_path attribute) of a stage.
+    """
+
+    def __init__(self, log_path):
+        self.log_path = log_path
+        self.records = dict()  # file_path: result, loaded from the log
+        self.complete = False
+        if RESUME and os.path.isfile(log_path):
+            self.load()
+        self.log_file = open(log_path, 'ab' if RESUME else 'wb')
+        self.last_sync = timeit.default_timer()
+
+    def load(self):
+        """ Loads the records of the log, up to the last complete one. """
+
+        with open(self.log_path, 'rb') as log_file:
+            while True:
+                offset = log_file.tell()
+                try:
+                    key, record = pickle.load(log_file)
+                except (EOFError, pickle.UnpicklingError, ValueError, AttributeError):
+                    break  # End of the log, possibly truncated by the interruption
+                if key is _COMPLETE:
+                    self.complete = True
+                else:
+                    self.records[key] = record
+        os.truncate(self.log_path, offset)  # Removes a truncated last record
+        logging.info('Resuming from %s: %s files already done', self.log_path,
+                     str(len(self.records)))
+
+    def append(self, result):
+        pickle.dump((result.file_path, result), self.log_file)
+        if timeit.default_timer() - self.last_sync > SYNC_INTERVAL:
+            self.sync()
+
+    def sync(self):
+        self.log_file.flush()
+        os.fsync(self.log_file.fileno())
+        self.last_sync = timeit.default_timer()
+
+    def todo(self, file_path):
+        """ Indicates whether file_path still has to be analyzed. """
+
+        return file_path not in self.records
+
+    def close(self, complete=False):
+        """ Closes the log; complete marks the stage as done. """
+
+        if complete:
+            pickle.dump((_COMPLETE, None), self.log_file)
+        self.sync()
+        self.log_file.close()
+
+
+def open_log(stage, *inputs):
+    """
+        Log of a stage, or None if the checkpoints are disabled.
+
+        -------
+        Parameters:
+        - stage: str
+            Name of the stage.
+        - inputs:
+            Inputs of the stage (e.g. folders and labels); a run with different inputs gets
+            another log.
+
+        -------
+        Returns:
+        - Checkpoint
+        - or None.
+    """
+
+    if CHECKPOINT_PATH is None:
+        return None
+    inputs += (features_values.get_policy(), )  # Other values, other features
+    digest = hashlib.sha1(repr(inputs).encode('utf-8')).hexdigest()[:16]
+    return Checkpoint(os.path.join(CHECKPOINT_PATH, stage + '-' + digest + '.log'))
@@ -20,10 +20,17 @@ import os
 import pickle
 import argparse
 import logging
+import timeit
+import numpy as np
 
+import checkpoint
+import content_index
+import cpu_budget
 import machine_learning
+import features_values
 import utility
 import analysis
+import matrix_store
 
 
 def test_model(names, labels, attributes, model, print_res=True, print_score=True):
@@ -54,6 +61,7 @@ def test_model(names, labels, attributes, model, print_res=True, print_score=Tru
 
     if isinstance(model, str):
         model = pickle.load(open(model, 'rb'))
+    cpu_budget.limit_model(model)
 
     labels_predicted_test = model.predict(attributes)
 
@@ -66,6 +74,114 @@ def test_model(names, labels, attributes, model, print_res=True, print_score=Tru
     return labels_predicted_test
 
 
+def test_models(names, labels, attributes_list, models, print_res=True, print_score=True):
+    """
+        Classifies the same JS inputs with several models.
+
+        -------
+        Parameters:
+        - names, labels, print_res, print_score:
+            Same as for test_model.
+        - attributes_list: list of csr_matrix
+            Features of the data, in the vector space of each model.
+        - models: list
+            Paths of the models.
+
+        -------
+        Returns:
+        - list:
+            List of labels predicted, per model.
+    """
+
+    predictions, times = list(), list()
+    for model_path, attributes in zip(models, attributes_list):
+        model = cpu_budget.limit_model(pickle.load(open(model_path, 'rb')))
+        start = timeit.default_timer()
+        predictions.append(model.predict(attributes))
+        times.append(timeit.default_timer() - start)
+
+    if print_res:
+        machine_learning.get_models_results(names, models, predictions)
+
+    for model_path, labels_predicted, predict_time in zip(models, predictions, times):
+        print('Model ' + model_path + ': ' + str(len(names)) + ' samples predicted, '
+              + str(round(predict_time, 3)) + 's')
+        if print_score:
+            machine_learning.get_score(labels, labels_predicted)
+
+    return predictions
+
+
+def cascade_model(names, labels, attributes, model, expensive_model, band=(0.1, 0.9),
+                  print_res=True, print_score=True):
+    """
+        Cascaded classification: the JS inputs are classified with a cheap model first, and only
+        the uncertain ones are classified again with an expensive model.
+
+        -------
+        Parameters:
+        - names, labels, attributes, print_res, print_score:
+            Same as for test_model.
+        - model
+            Cheap model (e.g. MNB), supporting predict_proba.
+        - expensive_model
+            Expensive model (e.g. RF), used for the samples whose probability of being malicious
+            according to the cheap model is within band.
+        - band: tuple of float
+            Uncertainty band [low, high] on the cheap model's probability of being malicious.
+
+        -------
+        Returns:
+        - list:
+            List of labels predicted.
+    """
+
+    if isinstance(model, str):
+        model = pickle.load(open(model, 'rb'))
+    if isinstance(expensive_model, str):
+        expensive_model = pickle.load(open(expensive_model, 'rb'))
+    cpu_budget.limit_model(model)
+    cpu_budget.limit_model(expensive_model)
+
+    start = timeit.default_timer()
+    proba = model.predict_proba(attributes)
+    labels_predicted_test = model.classes_[np.argmax(proba, axis=1)].astype(object)
+    cheap_time = timeit.default_timer() - start
+    proba_malicious = proba[:, list(model.classes_).index('malicious')]
+
+    escalated = np.where((proba_malicious >= band[0]) & (proba_malicious <= band[1]))[0]
+    expensive_time = 0
+    if escalated.size:
+        start = timeit.default_timer()
+        labels_predicted_test[escalated] = expensive_model.predict(attributes[escalated])
+        expensive_time = timeit.default_timer() - start
+
+    # Time of the expensive model alone, extrapolated from its time per sample
+    nb_samples = attributes.shape[0]
+    if escalated.size:
+        expensive_only_time = expensive_time * nb_samples / escalated.size
+    else:  # Nothing escalated: times the expensive model on a few samples
+        nb_timed = min(nb_samples, 100)
+        start = timeit.default_timer()
+        expensive_model.predict(attributes[:nb_timed])
+        expensive_only_time = (timeit.default_timer() - start) * nb_samples / nb_timed
+
+    if print_res:
+        machine_learning.get_classification_results(names, labels_predicted_test)
+
+    if print_score:
+        machine_learning.get_score(labels, labels_predicted_test)
+
+    print('Cheap model: ' + str(nb_samples - escalated.size) + ' samples decided, '
+          + str(round(cheap_time, 3)) + 's')
+    print('Expensive model: ' + str(escalated.size) + ' samples escalated, '
+          + str(round(expensive_time, 3)) + 's')
+    print('Estimated speed-up versus the expensive model only: '
+          + str(round(expensive_only_time / (cheap_time + expensive_time), 2)) + 'x')
+
+    return labels_predicted_test
+
+
 def parsing_commands():
     """
         Creation of an ArgumentParser object, holding all the information necessary to parse
@@ -84,8 +200,32 @@ def parsing_commands():
     parser.add_argument('--lf', metavar='LABEL', type=str, nargs='+',
                         choices=['benign', 'malicious', '?'],
                         help='labels of the JS files to evaluate the model from')
-    parser.add_argument('--m', metavar='MODEL', type=str, nargs=1,
-                        help='path of the model used to classify the new JS inputs')
+    parser.add_argument('--m', metavar='MODEL', type=str, nargs='+',
+                        help='path of the model(s) used to classify the new JS inputs; the '
+                             + 'features of the inputs are extracted once for all the models')
+    parser.add_argument('--analysis_paths', metavar='DIR', type=str, nargs='+', default=None,
+                        help='analysis path of each model --m, whose selected features it was '
+                             + 'learned with (default: --analysis_path for all of them)')
+    parser.add_argument('--cascade', metavar='MODEL', type=str, nargs=1, default=[None],
+                        help='expensive model, to classify only the JS inputs for which the '
+                             + 'model --m is uncertain')
+    parser.add_argument('--band', metavar='PROBA', type=float, nargs=2, default=[0.1, 0.9],
+                        help='uncertainty band on the probability of being malicious given by '
+                             + 'the model --m, for --cascade (default: 0.1 0.9)')
+    parser.add_argument('--save_matrix', metavar='DIR', type=str, nargs=1, default=[None],
+                        help='folder to store the features matrix, names and labels in')
+    parser.add_argument('--load_matrix', metavar='DIR', type=str, nargs=1, default=[None],
+                        help='folder to load a features matrix from, instead of analyzing JS '
+                             + 'inputs')
+    parser.add_argument('--predict_batch', metavar='ROWS', type=int, nargs=1, default=[None],
+                        help='classifies the files by blocks of ROWS, while the features of the '
+                             + 'next ones are extracted, instead of once all of them are')
+    parser.add_argument('--content_index', metavar='DB', type=str, nargs=1, default=[None],
+                        help='known-content index (SQLite): the files already classified with '
+                             + 'the same model, or pinned, are not analyzed again')
+    parser.add_argument('--normalized_hash', metavar='BOOL', type=bool, nargs=1, default=[False],
+                        help='also looks up the files in the content index by the hash of '
+                             + 'their tokens, ignoring whitespaces and comments')
     utility.parsing_commands(parser)
 
     return vars(parser.parse_args())
@@ -93,11 +233,21 @@ def parsing_commands():
 
 arg_obj = parsing_commands()
 utility.control_logger(arg_obj['v'][0])
+cpu_budget.configure(arg_obj['cpus'][0])
+utility.configure_extraction(arg_obj)
+checkpoint.configure(arg_obj['checkpoint'][0], arg_obj['resume'][0], arg_obj['analysis_path'][0])
 
 
 def main_classification(js_dirs=arg_obj['d'], js_files=arg_obj['f'], labels_f=arg_obj['lf'],
                         labels_d=arg_obj['l'], model=arg_obj['m'],
-                        analysis_path=arg_obj['analysis_path'][0]):
+                        analysis_path=arg_obj['analysis_path'][0],
+                        save_matrix=arg_obj['save_matrix'][0],
+                        load_matrix=arg_obj['load_matrix'][0],
+                        cascade=arg_obj['cascade'][0], band=arg_obj['band'],
+                        content_index_path=arg_obj['content_index'][0],
+                        normalized_hash=arg_obj['normalized_hash'][0],
+                        analysis_paths=arg_obj['analysis_paths'],
+                        predict_batch=arg_obj['predict_batch'][0]):
     """
         Main function, performs a static analysis (syntactic) of JavaScript files given as input
         before predicting if the executables are benign or malicious.
@@ -116,6 +266,24 @@ def main_classification(js_dirs=arg_obj['d'], js_files=arg_obj['f'], labels_f=ar
             Path to the model used to classify the new files
         - analysis_path: str
             Folder to store the features' analysis results in.
+        - save_matrix: str
+            Folder to store the features matrix in, or None.
+        - load_matrix: str
+            Folder to load a features matrix from (instead of analyzing JS inputs), or None.
+        - cascade: str
+            Path to an expensive model, for the inputs the model is uncertain about, or None.
+        - band: list of float
+            Uncertainty band of the model, for cascade.
+        - content_index_path: str
+            Known-content index to look the files up in before analyzing them, and to store
+            their verdicts in, or None.
+        - normalized_hash: bool
+            Also looks the files up by the hash of their tokens.
+        - analysis_paths: list of strings
+            Analysis path of each model, or None (analysis_path for all of them).
+        - predict_batch: int
+            Number of files per block, to classify the files block by block while the next
+            ones are analyzed, or None.
         Default values are the ones given in the command lines or in the
         ArgumentParser object (function parsingCommands()).
 
@@ -125,7 +293,7 @@ def main_classification(js_dirs=arg_obj['d'], js_files=arg_obj['f'], labels_f=ar
         either benign or malicious
     """
 
-    if js_dirs is None and js_files is None:
+    if js_dirs is None and js_files is None and load_matrix is None:
         logging.error('Please, indicate a directory or a JS file to be analyzed')
 
     elif js_dirs is not None and labels_d is not None and len(js_dirs) != len(labels_d):
@@ -140,20 +308,163 @@ def main_classification(js_dirs=arg_obj['d'], js_files=arg_obj['f'], labels_f=ar
         logging.error('Please, indicate a model to be used to classify new files.\n'
                       + '(see >$ python3 <path-of-learner.py> -help) to build a model)')
 
-    else:
-        features2int_dict_path = os.path.join(analysis_path, 'Features', '_selected_features_')
+    elif cascade is not None and not 0 <= band[0] <= band[1] <= 1:
+        logging.error('Please, indicate an uncertainty band [low, high] within [0, 1]')
 
-        names, attributes, labels =\
-            analysis.main_analysis(js_dirs=js_dirs, labels_dirs=labels_d,
-                                   js_files=js_files, labels_files=labels_f,
-                                   features2int_dict_path=features2int_dict_path)
+    elif analysis_paths is not None and len(analysis_paths) != len(model):
+        logging.error('Please, indicate as many analysis paths as the number %s of models',
+                      str(len(model)))
 
-        if names:
-            test_model(names, labels, attributes, model=model[0])
+    elif len(model) > 1 and (cascade is not None or content_index_path is not None):
+        logging.error('Please, indicate one model --m to use --cascade or --content_index')
+
+    elif predict_batch is not None and (predict_batch < 1 or len(model) > 1
+                                        or analysis_paths is not None or cascade is not None
+                                        or content_index_path is not None
+                                        or save_matrix is not None or load_matrix is not None):
+        logging.error('Please, indicate a positive number of files per block, and one model --m '
+                      + 'without --cascade, --content_index, --save_matrix or --load_matrix, '
+                      + 'to use --predict_batch')
+
+    elif predict_batch is not None:
+        stream_model(js_dirs, js_files, labels_f, labels_d, model[0], analysis_path,
+                     predict_batch)
+
+    elif len(model) > 1 or analysis_paths is not None:
+        classify_models(js_dirs, js_files, labels_f, labels_d, model,
+                        analysis_paths or [analysis_path for _ in model], save_matrix,
+                        load_matrix)
+
+    else:
+        index, known = None, list()
+        if load_matrix is not None:
+            names, attributes, labels = matrix_store.load_features_matrix(
+                load_matrix, os.path.join(analysis_path, 'Features'))
 
         else:
+            features2int_dict_path = os.path.join(analysis_path, 'Features',
+                                                  '_selected_features_')
+            features_values.load_policy(os.path.join(analysis_path, 'Features'))
+
+            if content_index_path is not None:  # The known files are not analyzed
+                fingerprint = content_index.model_fingerprint(
+                    model + ([cascade] if cascade is not None else []),
+                    os.path.join(analysis_path, 'Features'),
+                    extra=str(band) if cascade is not None else '')
+                index = content_index.ContentIndex(content_index_path, fingerprint,
+                                                   normalized_hash)
+                js_files, labels_f = analysis.list_inputs(js_dirs, js_files, labels_f, labels_d)
+                js_dirs, labels_d = None, None
+                known, js_files, labels_f = index.split_known(js_files, labels_f)
+                print('Known contents: ' + str(len(known)) + ' file(s) not analyzed again')
+
+            if js_dirs is None and not js_files:
+                names, attributes, labels = list(), None, list()
+            else:
+                names, attributes, labels =\
+                    analysis.main_analysis(js_dirs=js_dirs, labels_dirs=labels_d,
+                                           js_files=js_files, labels_files=labels_f,
+                                           features2int_dict_path=features2int_dict_path)
+
+            if names and save_matrix is not None:
+                matrix_store.save_features_matrix(save_matrix, names, attributes, labels,
+                                                  os.path.join(analysis_path, 'Features'))
+
+        labels_predicted = list()
+        if names and cascade is not None:
+            labels_predicted = cascade_model(names, labels, attributes, model=model[0],
+                                             expensive_model=cascade, band=band,
+                                             print_res=index is None,
+                                             print_score=index is None)
+
+        elif names:
+            labels_predicted = test_model(names, labels, attributes, model=model[0],
+                                          print_res=index is None, print_score=index is None)
+
+        elif not known:
             logging.warning('No file found for the analysis.')
 
+        if index is not None:
+            index.record(names, labels_predicted)
+            index.close()
+            if names or known:  # Results of the known and of the analyzed files
+                names = [file_path for file_path, _, _ in known] + list(names)
+                labels = [label for _, label, _ in known] + list(labels)
+                labels_predicted = [verdict for _, _, verdict in known] + list(labels_predicted)
+                machine_learning.get_classification_results(names, labels_predicted)
+                machine_learning.get_score(labels, labels_predicted)
+
+
+def stream_model(js_dirs, js_files, labels_f, labels_d, model_path, analysis_path,
+                 predict_batch):
+    """ Classification with one model, cf. main_classification: the files are classified by
+    blocks of predict_batch files as soon as their features are extracted, while the workers
+    analyze the next ones (cf. analysis.main_analysis_stream). """
+
+    features_values.load_policy(os.path.join(analysis_path, 'Features'))
+    model = cpu_budget.limit_model(pickle.load(open(model_path, 'rb')))
+
+    names, labels, labels_predicted = list(), list(), list()
+    nb_blocks, predict_time = 0, 0
+    for block_names, attributes, block_labels in\
+            analysis.main_analysis_stream(js_dirs=js_dirs, labels_dirs=labels_d,
+                                          js_files=js_files, labels_files=labels_f,
+                                          features2int_dict_path=os.path.join(
+                                              analysis_path, 'Features', '_selected_features_'),
+                                          batch_size=predict_batch):
+        if not block_names:
+            continue
+        start = timeit.default_timer()
+        block_predicted = model.predict(attributes)
+        predict_time += timeit.default_timer() - start
+        for file_path, label_predicted in zip(block_names, block_predicted):  # As they come
+            print(str(file_path) + ': ' + str(label_predicted))
+        names.extend(block_names)
+        labels.extend(block_labels)
+        labels_predicted.extend(block_predicted)
+        nb_blocks += 1
+
+    if names:
+        print('> Name: labelPredicted')
+        print('Model ' + model_path + ': ' + str(len(names)) + ' samples predicted in '
+              + str(nb_blocks) + ' block(s), ' + str(round(predict_time, 3)) + 's')
+        machine_learning.get_score(labels, labels_predicted)
+    else:
+        logging.warning('No file found for the analysis.')
+
+
+def classify_models(js_dirs, js_files, labels_f, labels_d, models, analysis_paths, save_matrix,
+                    load_matrix):
+    """ Classification with several models, cf. main_classification: the features of the files
+    are extracted once for all of them (cf. analysis.main_analysis_models). """
+
+    if load_matrix is not None:  # Same matrix for all the models, hence the same features
+        names, attributes, labels = matrix_store.load_features_matrix(
+            load_matrix, os.path.join(analysis_paths[0], 'Features'))
+        for path in analysis_paths[1:]:
+            matrix_store.check_features_matrix(load_matrix, os.path.join(path, 'Features'))
+        attributes_list = [attributes for _ in models]
+
+    else:
+        features2int_dict_paths = [os.path.join(path, 'Features', '_selected_features_')
+                                   for path in analysis_paths]
+        names, attributes_list, labels =\
+            analysis.main_analysis_models(js_dirs=js_dirs, labels_dirs=labels_d,
+                                          js_files=js_files, labels_files=labels_f,
+                                          features2int_dict_paths=features2int_dict_paths)
+
+        if names and save_matrix is not None:  # SAVE_MATRIX-i for the i-th model, if distinct
+            for i, attributes in enumerate(attributes_list):
+                if all(attributes is not other for other in attributes_list[:i]):
+                    matrix_store.save_features_matrix(
+                        save_matrix if i == 0 else save_matrix.rstrip(os.sep) + '-' + str(i),
+                        names, attributes, labels, os.path.join(analysis_paths[i], 'Features'))
+
+    if names:
+        test_models(names, labels, attributes_list, models)
+    else:
+        logging.warning('No file found for the analysis.')
+
 
 if __name__ == "__main__":  # Executed only if run as a script
     main_classification()
@@ -0,0 +1,264 @@
+# Copyright (C) 2019 Aurore Fass
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+    Index of the known contents (SQLite): the hash of a file, or optionally of its tokens
+    (i.e. ignoring whitespaces and comments), is mapped to the verdict stored when it was
+    classified with a given model (model fingerprint), or to a pinned entry (allowlist) valid
+    whatever the model. The files found in the index are neither parsed nor classified again.
+    Running this module pins or unpins files, or prints the content of the index.
+"""
+
+import io
+import os
+import time
+import sqlite3
+import hashlib
+import logging
+import argparse
+
+import corpus_pack
+import features_lexer
+import features_values
+import parser_backends
+import utility
+
+
+PINNED = ''  # Model fingerprint of the pinned entries, valid whatever the model
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS verdicts (
+    digest BLOB NOT NULL,
+    kind TEXT NOT NULL,
+    model TEXT NOT NULL,
+    verdict TEXT NOT NULL,
+    name TEXT,
+    time REAL,
+    PRIMARY KEY (digest, kind, model)
+)
+'''
+
+
+def content_digest(content):
+    """ Digest of the bytes of a file. """
+
+    return hashlib.blake2b(content, digest_size=16).digest()
+
+
+def normalized_digest(content):
+    """ Digest of the tokens of a file, i.e. ignoring whitespaces (including line breaks) and
+    comments, cf. features_lexer.tokenize; None if a token is too long to be kept whole. """
+
+    digest = hashlib.blake2b(digest_size=16)
+    js_file = io.TextIOWrapper(io.BytesIO(content), encoding='utf-8', errors='surrogateescape')
+    for kind, text in features_lexer.tokenize(js_file):
+        if len(text) >= features_lexer.MAX_TOKEN:  # Truncated
+            return None
+        digest.update((kind + '\0' + text + '\0').encode('utf-8', 'surrogateescape'))
+    return digest.digest()
+
+
+def model_fingerprint(model_paths, features_path, extra=''):
+    """
+        Fingerprint of a classification setting: the verdicts stored with another one are not
+        used. Besides the models, the features selected and their values policy, it covers the
+        options changing the features of some files: the parser backend and the lexer
+        fallback, cf. extraction_settings.
+
+        -------
+        Parameters:
+        - model_paths: list
+            Model(s) used to classify the files.
+        - features_path: str
+            Folder of the features selected (ANALYSIS_PATH/Features).
+        - extra: str
+            Other parameters of the classification, e.g. the uncertainty band of a cascade.
+
+        -------
+        Returns:
+        - str
+            Hex digest.
+    """
+
+    digest = hashlib.blake2b(digest_size=16)
+    for path in list(model_paths) + [os.path.join(features_path, '_selected_features_')]:
+        with open(path, 'rb') as model_file:
+            for block in iter(lambda: model_file.read(1 << 20), b''):
+                digest.update(block)
+    digest.update(repr((features_values.get_policy(), extraction_settings(), extra))
+                  .encode('utf-8'))
+    return digest.hexdigest()
+
+
+def extraction_settings():
+    """ Current options changing the features extracted from some files (e.g. the ones only
+    one parser backend accepts). The other ones (memoization, vocabulary walk, columnar ASTs)
+    give the same features. """
+
+    return {'parser': parser_backends.BACKEND, 'lexer_fallback': features_lexer.FALLBACK,
+            'lexer_threshold': features_lexer.SIZE_THRESHOLD}
+
+
+class ContentIndex:
+    """
+    Class ContentIndex: known contents of an SQLite database, for a model fingerprint.
+    """
+
+    def __init__(self, db_path, model=PINNED, normalized=False):
+        self.connection = sqlite3.connect(db_path)
+        self.connection.execute('PRAGMA journal_mode=WAL')  # Readers do not block the writer
+        self.connection.execute(SCHEMA)
+        self.model = model
+        self.normalized = normalized
+        self.digests = dict()  # File path: (exact digest, normalized digest or None)
+
+    def get_digests(self, file_path):
+        content = corpus_pack.read_input(file_path)
+        return content_digest(content), normalized_digest(content) if self.normalized else None
+
+    def lookup(self, file_path):
+        """ Verdict of file_path (pinned first, then stored with the model), or None. Its
+        digests are kept until its verdict is recorded. """
+
+        self.digests[file_path] = self.get_digests(file_path)
+        for kind, digest in zip(('exact', 'normalized'), self.digests[file_path]):
+            if digest is None:
+                continue
+            row = self.connection.execute(
+                'SELECT verdict FROM verdicts WHERE digest = ? AND kind = ? AND model IN (?, ?) '
+                + 'ORDER BY model = ? DESC LIMIT 1',
+                (digest, kind, PINNED, self.model, PINNED)).fetchone()
+            if row is not None:
+                del self.digests[file_path]
+                return row[0]
+        return None
+
+    def split_known(self, files, labels):
+        """
+            Separates the known files from the ones to analyze.
+
+            -------
+            Returns:
+            - list
+                (file path, label, verdict) of the known files.
+            - list
+                Paths of the other files.
+            - list
+                Labels of the other files.
+        """
+
+        known, files2do, labels2do = list(), list(), list()
+        for file_path, label in zip(files, labels):
+            verdict = self.lookup(file_path)
+            if verdict is not None:
+                known.append((file_path, label, verdict))
+            else:
+                files2do.append(file_path)
+                labels2do.append(label)
+        return known, files2do, labels2do
+
+    def record(self, files, verdicts, model=None):
+        """ Stores the verdicts of the files (not the None ones), for the model fingerprint
+        (default: the one of the index; PINNED to pin them). """
+
+        model = self.model if model is None else model
+        now = time.time()
+        rows = list()
+        for file_path, verdict in zip(files, verdicts):
+            digests = self.digests.pop(file_path, None)
+            if verdict is None:
+                continue
+            digests = digests or self.get_digests(file_path)
+            for kind, digest in zip(('exact', 'normalized'), digests):
+                if digest is not None:
+                    rows.append((digest, kind, model, str(verdict), file_path, now))
+        with self.connection:  # One transaction
+            self.connection.executemany(
+                'INSERT OR REPLACE INTO verdicts VALUES (?, ?, ?, ?, ?, ?)', rows)
+
+    def unpin(self, files):
+        with self.connection:
+            for file_path in files:
+                self.connection.executemany(
+                    'DELETE FROM verdicts WHERE digest = ? AND kind = ? AND model = ?',
+                    [(digest, kind, PINNED) for kind, digest
+                     in zip(('exact', 'normalized'), self.get_digests(file_path))
+                     if digest is not None])
+
+    def stats(self):
+        """ Number of entries per model fingerprint and verdict. """
+
+        return self.connection.execute('SELECT model, verdict, COUNT(*) FROM verdicts '
+                                       + 'GROUP BY model, verdict ORDER BY model').fetchall()
+
+    def close(self):
+        self.connection.close()
+
+
+def parsing_commands():
+    """
+        Creation of an ArgumentParser object, holding all the information necessary to parse
+        the command line into Python data types.
+    """
+
+    parser = argparse.ArgumentParser(description='Pins JS files in a known-content index, or '
+                                                 + 'prints its content.')
+
+    parser.add_argument('--db', metavar='FILE', type=str, nargs=1, required=True,
+                        help='SQLite database of the index')
+    parser.add_argument('--pin', metavar='FILE', type=str, nargs='+',
+                        help='files (or directories) to pin, whatever the model')
+    parser.add_argument('--unpin', metavar='FILE', type=str, nargs='+',
+                        help='files (or directories) to unpin')
+    parser.add_argument('--verdict', metavar='LABEL', type=str, nargs=1, default=['benign'],
+                        choices=['benign', 'malicious'], help='verdict of the files pinned')
+    parser.add_argument('--normalized', metavar='BOOL', type=bool, nargs=1, default=[False],
+                        help='also pins the files by the hash of their tokens, ignoring '
+                             + 'whitespaces and comments')
+    utility.parsing_commands(parser)
+
+    return vars(parser.parse_args())
+
+
+def list_inputs(paths):
+    """ Files of paths, directories (or packs) being expanded. """
+
+    files = list()
+    for path in paths:
+        if os.path.isdir(path) or corpus_pack.is_pack(path):
+            files.extend(corpus_pack.list_files(path)[0])
+        else:
+            files.append(path)
+    return files
+
+
+def main_index():
+    """ Main function, pins / unpins files or prints the index. """
+
+    args = parsing_commands()
+    utility.control_logger(args['v'][0])
+    index = ContentIndex(args['db'][0], normalized=args['normalized'][0])
+    if args['pin'] is not None:
+        files = list_inputs(args['pin'])
+        index.record(files, [args['verdict'][0]] * len(files), model=PINNED)
+        logging.info('Pinned %s files', len(files))
+    if args['unpin'] is not None:
+        index.unpin(list_inputs(args['unpin']))
+    for model, verdict, count in index.stats():
+        print((model or 'pinned') + ' ' + verdict + ': ' + str(count))
+    index.close()
+
+
+if __name__ == "__main__":  # Executed only if run as a script
+    main_index()
@@ -0,0 +1,299 @@
+# Copyright (C) 2019 Aurore Fass
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+    Generation of synthetic JavaScript corpora with controlled characteristics
+    (file size, nesting depth, literal density, coding style), for benchmarking purposes.
+"""
+
+import os
+import random
+import argparse
+
+
+STYLES = ['plain', 'minified', 'obfuscated']
+
+WORDS = ['data', 'value', 'result', 'element', 'index', 'count', 'node', 'item', 'config',
+         'options', 'callback', 'handler', 'request', 'response', 'buffer', 'target']
+API_CALLS = ['document.getElementById', 'document.createElement', 'console.log', 'JSON.parse',
+             'JSON.stringify', 'Math.floor', 'Math.random', 'window.setTimeout',
+             'Array.prototype.slice.call', 'Object.keys']
+MALICIOUS_CALLS = ['eval', 'unescape', 'document.write', 'String.fromCharCode', 'escape',
+                   'window.atob', 'setTimeout']
+
+
+class JsGenerator:
+    """
+    Class JsGenerator: produces random JS code in a given style.
+    """
+
+    def __init__(self, style='plain', depth=3, literal_density=0.3, malicious=False, seed=None):
+        if style not in STYLES:
+            raise ValueError('Unknown style ' + str(style) + ', expected one of ' + str(STYLES))
+        self.style = style
+        self.depth = depth
+        self.literal_density = literal_density
+        self.malicious = malicious
+        self.random = random.Random(seed)
+        self.identifiers = list()
+        self.strings = list()  # String array, for the obfuscated style
+
+    def new_identifier(self):
+        """ Creates a new identifier, depending on the style. """
+
+        if self.style == 'plain':
+            name = self.random.choice(WORDS) + self.random.choice(WORDS).capitalize()\
+                + str(len(self.identifiers))
+        elif self.style == 'minified':
+            name = self.short_name(len(self.identifiers))
+        else:
+            name = '_0x' + format(self.random.getrandbits(24), 'x')
+        self.identifiers.append(name)
+        return name
+
+    @staticmethod
+    def short_name(i):
+        """ Minifier-like identifier: a, b, ..., z, aa, ab... """
+
+        letters = 'abcdefghijklmnopqrstuvwxyz'
+        name = ''
+        i += 1
+        while i > 0:
+            i, r = divmod(i - 1, 26)
+            name = letters[r] + name
+        return name + '_'  # Avoids clashes with keywords such as 'do', 'if' or 'in'
+
+    def identifier(self):
+        """ Returns an existing identifier, or a new one. """
+
+        if not self.identifiers or self.random.random() < 0.2:
+            return self.new_identifier()
+        return self.random.choice(self.identifiers)
+
+    def string_literal(self):
+        """ Random string literal, escaped in the obfuscated style. """
+
+        length = self.random.randint(3, 40)
+        text = ''.join(self.random.choice('abcdefghijklmnopqrstuvwxyz0123456789 ')
+                       for _ in range(length))
+        if self.style == 'obfuscated':
+            if self.random.random() < 0.5:
+                self.strings.append(text)
+                return '_0xstr[' + str(len(self.strings) - 1) + ']'
+            return "'" + ''.join('\\x' + format(ord(c), '02x') for c in text) + "'"
+        return "'" + text + "'"
+
+    def literal(self):
+        """ Random literal: string, int, float, boolean or null. """
+
+        choice = self.random.random()
+        if choice < 0.5:
+            return self.string_literal()
+        if choice < 0.75:
+            number = self.random.randint(0, 100000)
+            return hex(number) if self.style == 'obfuscated' else str(number)
+        if choice < 0.85:
+            return str(round(self.random.uniform(0, 1000), 3))
+        if choice < 0.95:
+            return self.random.choice(['true', 'false'])
+        return 'null'
+
+    def operand(self):
+        """ Literal or identifier, depending on the literal density. """
+
+        if self.random.random() < self.literal_density:
+            return self.literal()
+        return self.identifier()
+
+    def call(self):
+        """ Function call expression. """
+
+        if self.malicious and self.random.random() < 0.3:
+            callee = self.random.choice(MALICIOUS_CALLS)
+        elif self.random.random() < 0.5:
+            callee = self.random.choice(API_CALLS)
+        else:
+            callee = self.identifier()
+        if self.style == 'obfuscated' and '.' in callee:
+            parts = callee.split('.')
+            callee = parts[0] + ''.join("['" + part + "']" for part in parts[1:])
+        args = self.sep(',').join(self.operand() for _ in range(self.random.randint(0, 3)))
+        return callee + '(' + args + ')'
+
+    def expression(self):
+        """ Random expression. """
+
+        choice = self.random.random()
+        if choice < 0.35:
+            return self.call()
+        if choice < 0.6:
+            return self.operand() + self.sep(self.random.choice(['+', '-', '*', '==', '&&']))\
+                + self.operand()
+        if choice < 0.75:
+            return self.identifier() + '.' + self.random.choice(WORDS)
+        if choice < 0.85:
+            return 'new ' + self.random.choice(['Array', 'Date', 'Object', 'RegExp']) + '('\
+                + self.operand() + ')'
+        if choice < 0.95:
+            return '{' + self.sep(',').join(self.random.choice(WORDS) + ':' + self.operand()
+                                            for _ in range(self.random.randint(1, 3))) + '}'
+        return '[' + self.sep(',').join(self.operand()
+                                        for _ in range(self.random.randint(1, 4))) + ']'
+
+    def sep(self, token):
+        """ Token with or without surrounding whitespace, depending on the style. """
+
+        if self.style == 'plain':
+            return ' ' + token + ' ' if token != ',' else ', '
+        return token
+
+    def newline(self, level):
+        if self.style == 'plain':
+            return '\n' + '    ' * level
+        return ''
+
+    def statement(self, level, in_function=False):
+        """ Random statement, nested up to self.depth levels. """
+
+        choice = self.random.random()
+        if level < self.depth and choice < 0.3:
+            return self.block_statement(level, in_function)
+        if choice < 0.55:
+            keyword = 'var ' if self.style != 'plain' or self.random.random() < 0.5 else 'let '
+            return keyword + self.new_identifier() + self.sep('=') + self.expression() + ';'
+        if choice < 0.75:
+            return self.identifier() + self.sep('=') + self.expression() + ';'
+        if choice < 0.9:
+            return self.call() + ';'
+        return 'return ' + self.operand() + ';' if in_function else self.call() + ';'
+
+    def block_statement(self, level, in_function=False):
+        """ Function, if, for or while statement containing nested statements. """
+
+        choice = self.random.random()
+        inner = ''.join(self.newline(level + 1) + self.statement(level + 1,
+                                                                 in_function or choice < 0.4)
+                        for _ in range(self.random.randint(1, 4)))
+        end = self.newline(level) + '}'
+        if choice < 0.4:
+            params = self.sep(',').join(self.new_identifier()
+                                        for _ in range(self.random.randint(0, 3)))
+            return 'function ' + self.new_identifier() + '(' + params + '){' + inner + end
+        if choice < 0.65:
+            return 'if' + self.sep('(') + self.operand() + self.sep('==') + self.operand()\
+                + '){' + inner + end
+        if choice < 0.85:
+            i = self.new_identifier()
+            return 'for' + self.sep('(') + 'var ' + i + '=0;' + i + '<' + self.operand() + ';'\
+                + i + '++){' + inner + end
+        return 'while' + self.sep('(') + self.operand() + '){' + inner + end
+
+    def generate(self, size):
+        """ Generates approximately size bytes of JS code. """
+
+        statements = list()
+        length = 0
+        while length < size:
+            statement = self.statement(0)
+            statements.append(statement)
+            length += len(statement) + 1
+        code = ('\n' if self.style == 'plain' else '').join(statements)
+        if self.style == 'obfuscated' and self.strings:
+            code = 'var _0xstr=[' + ','.join("'" + s + "'" for s in self.strings) + '];' + code
+        return code
+
+
+def generate_corpus(out_dir, nb_files, size=5000, depth=3, literal_density=0.3, style='plain',
+                    malicious=False, seed=0):
+    """
+        Generates a synthetic JS corpus.
+
+        -------
+        Parameters:
+        - out_dir: str
+            Directory to store the generated JS files in.
+        - nb_files: int
+            Number of files to generate.
+        - size: int
+            Approximate size of each file, in bytes.
+        - depth: int
+            Maximum nesting depth of functions, ifs and loops.
+        - literal_density: float
+            Probability, between 0 and 1, for an operand to be a literal (and not an identifier).
+        - style: str
+            Coding style: 'plain', 'minified' or 'obfuscated'.
+        - malicious: bool
+            Indicates whether to add calls typical of malicious JS (eval, unescape...).
+        - seed: int
+            Seed of the random generator, for reproducible corpora.
+
+        -------
+        Returns:
+        - list
+            Paths of the generated files.
+    """
+
+    if not os.path.exists(out_dir):
+        os.makedirs(out_dir)
+
+    files = list()
+    for i in range(nb_files):
+        generator = JsGenerator(style=style, depth=depth, literal_density=literal_density,
+                                malicious=malicious, seed=str(seed) + '-' + str(i))
+        file_path = os.path.join(out_dir, style + '_' + str(i) + '.js')
+        with open(file_path, 'w') as js_file:
+            js_file.write(generator.generate(size))
+        files.append(file_path)
+    return files
+
+
+def parsing_commands():
+    """
+        Creation of an ArgumentParser object, holding all the information necessary to parse
+        the command line into Python data types.
+    """
+
+    parser = argparse.ArgumentParser(description='Generates a synthetic JS corpus.')
+
+    parser.add_argument('--o', metavar='DIR', type=str, nargs=1, required=True,
+                        help='directory to store the generated JS files in')
+    parser.add_argument('--n', metavar='INT', type=int, nargs=1, default=[100],
+                        help='number of files to generate')
+    parser.add_argument('--size', metavar='BYTES', type=int, nargs=1, default=[5000],
+                        help='approximate size of each file')
+    parser.add_argument('--depth', metavar='INT', type=int, nargs=1, default=[3],
+                        help='maximum nesting depth')
+    parser.add_argument('--ld', metavar='FLOAT', type=float, nargs=1, default=[0.3],
+                        help='literal density, between 0 and 1')
+    parser.add_argument('--style', metavar='STYLE', type=str, nargs=1, default=['plain'],
+                        choices=STYLES, help='coding style')
+    parser.add_argument('--malicious', action='store_true',
+                        help='adds calls typical of malicious JS')
+    parser.add_argument('--seed', metavar='INT', type=int, nargs=1, default=[0],
+                        help='seed of the random generator')
+
+    return vars(parser.parse_args())
+
+
+def main_generate():
+    """ Main function, generates a synthetic corpus. """
+
+    args = parsing_commands()
+    generate_corpus(args['o'][0], args['n'][0], size=args['size'][0], depth=args['depth'][0],
+                    literal_density=args['ld'][0], style=args['style'][0],
+                    malicious=args['malicious'], seed=args['seed'][0])
+
+
+if __name__ == "__main__":  # Executed only if run as a script
+    main_generate()
@@ -0,0 +1,335 @@
+# Copyright (C) 2019 Aurore Fass
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+    Packed corpora: many JS files stored in one data file (<name>.pack) plus an index
+    (<name>.pack.idx) with the offset, length, label and name of each file.
+    The data file is read through mmap, and the files of a pack are referred to as
+    <name>.pack::<file name>.
+"""
+
+import io
+import os
+import json
+import mmap
+import logging
+import tarfile
+import zipfile
+import argparse
+
+import utility
+
+
+PACK_EXTENSION = '.pack'
+INDEX_EXTENSION = '.idx'
+PACK_SEPARATOR = '::'
+PACK_HEADER = '#jsdetector-pack 1'
+
+_packs = dict()  # Packs opened in the current process
+
+
+class Pack:
+    """
+    Class Pack: read access to a packed corpus.
+    """
+
+    def __init__(self, pack_path):
+        self.pack_path = pack_path
+        self.names = list()
+        self.labels = list()
+        self.offsets = list()
+        self.lengths = list()
+        self.positions = dict()
+        self.data = None
+
+        with open(pack_path + INDEX_EXTENSION, encoding='utf-8') as index:
+            if index.readline().rstrip('\n') != PACK_HEADER:
+                raise ValueError('%s is not a valid pack index' % (pack_path + INDEX_EXTENSION))
+            for line in index:
+                offset, length, label, name = line.rstrip('\n').split('\t', 3)
+                self.positions[json.loads(name)] = len(self.names)
+                self.names.append(json.loads(name))
+                self.labels.append(label)
+                self.offsets.append(int(offset))
+                self.lengths.append(int(length))
+
+    def open(self):
+        if self.data is None:
+            with open(self.pack_path, 'rb') as pack_file:
+                if os.fstat(pack_file.fileno()).st_size == 0:
+                    self.data = b''  # mmap cannot map an empty file
+                else:
+                    self.data = mmap.mmap(pack_file.fileno(), 0, access=mmap.ACCESS_READ)
+        return self.data
+
+    def read(self, name):
+        """ Content (bytes) of the file name. """
+
+        i = self.positions[name]
+        return self.open()[self.offsets[i]:self.offsets[i] + self.lengths[i]]
+
+    def size(self, name):
+        return self.lengths[self.positions[name]]
+
+    def open_entry(self, name):
+        """ Binary file object reading the file name from the mmap, without copying it. """
+
+        i = self.positions[name]
+        return io.BufferedReader(EntryReader(self.open(), self.offsets[i], self.lengths[i]))
+
+
+class EntryReader(io.RawIOBase):
+    """
+    Class EntryReader: raw stream over one file of a pack.
+    """
+
+    def __init__(self, data, offset, length):
+        super(EntryReader, self).__init__()
+        self.data = data
+        self.position = offset
+        self.end = offset + length
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        nb_bytes = min(len(buffer), self.end - self.position)
+        buffer[:nb_bytes] = self.data[self.position:self.position + nb_bytes]
+        self.position += nb_bytes
+        return nb_bytes
+
+
+def is_pack(path):
+    return path.endswith(PACK_EXTENSION) and os.path.isfile(path + INDEX_EXTENSION)
+
+
+def is_pack_entry(file_path):
+    return PACK_SEPARATOR in file_path and is_pack(file_path.split(PACK_SEPARATOR, 1)[0])
+
+
+def get_pack(pack_path):
+    if pack_path not in _packs:
+        _packs[pack_path] = Pack(pack_path)
+    return _packs[pack_path]
+
+
+def split_entry(file_path):
+    pack_path, name = file_path.split(PACK_SEPARATOR, 1)
+    return get_pack(pack_path), name
+
+
+def read_input(file_path):
+    """ Content (bytes) of a JS file, packed or not. """
+
+    if is_pack_entry(file_path):
+        pack, name = split_entry(file_path)
+        return pack.read(name)
+    with open(file_path, 'rb') as js_file:
+        return js_file.read()
+
+
+def open_input(file_path):
+    """ Binary file object to stream a JS file, packed or not. """
+
+    if is_pack_entry(file_path):
+        pack, name = split_entry(file_path)
+        return pack.open_entry(name)
+    return open(file_path, 'rb')
+
+
+def get_size(file_path):
+    """ Size in bytes of a JS file, packed or not. """
+
+    if is_pack_entry(file_path):
+        pack, name = split_entry(file_path)
+        return pack.size(name)
+    return os.path.getsize(file_path)
+
+
+def list_files(js_dir, label=None):
+    """
+        Lists the JS files of a directory or of a pack.
+
+        -------
+        Parameters:
+        - js_dir: str
+            Directory or pack.
+        - label: str
+            Label of the files. If None or '?', for a pack: label stored in its index.
+
+        -------
+        Returns:
+        - list
+            Paths of the files.
+        - list
+            Labels of the files.
+    """
+
+    if is_pack(js_dir):
+        pack = get_pack(js_dir)
+        files = [js_dir + PACK_SEPARATOR + name for name in pack.names]
+        if label is None or label == '?':
+            return files, list(pack.labels)
+        return files, [label] * len(files)
+
+    files = [os.path.join(js_dir, cfile) for cfile in os.listdir(js_dir)]
+    return files, [label] * len(files)
+
+
+class PackWriter:
+    """
+    Class PackWriter: builds a pack, one file at a time.
+    """
+
+    def __init__(self, pack_path):
+        self.pack_path = pack_path
+        self.pack_file = open(pack_path + '.tmp', 'wb')
+        self.index = open(pack_path + INDEX_EXTENSION + '.tmp', 'w', encoding='utf-8')
+        self.index.write(PACK_HEADER + '\n')
+        self.offset = 0
+        self.names = set()
+
+    def add(self, name, content, label='?'):
+        if name in self.names:
+            logging.warning('%s is already in %s, skipped', name, self.pack_path)
+            return
+        self.names.add(name)
+        self.pack_file.write(content)
+        self.index.write(str(self.offset) + '\t' + str(len(content)) + '\t' + label + '\t'
+                         + json.dumps(name) + '\n')
+        self.offset += len(content)
+
+    def close(self):
+        self.pack_file.close()
+        self.index.close()
+        os.replace(self.pack_path + '.tmp', self.pack_path)
+        os.replace(self.pack_path + INDEX_EXTENSION + '.tmp', self.pack_path + INDEX_EXTENSION)
+        logging.info('Packed %s files in %s', str(len(self.names)), self.pack_path)
+
+    def abort(self):
+        """ Removes the pack being built, e.g. after an error, instead of completing it. """
+
+        self.pack_file.close()
+        self.index.close()
+        for tmp_path in [self.pack_path + '.tmp', self.pack_path + INDEX_EXTENSION + '.tmp']:
+            if os.path.isfile(tmp_path):
+                os.remove(tmp_path)
+
+
+def input_prefixes(inputs):
+    """ Prefix of the names of the files of each input: its name (followed by its position if
+    several inputs have the same name), so that the files with the same name in several inputs
+    are all packed. """
+
+    names = [os.path.basename(os.path.normpath(input_path)) for input_path in inputs]
+    return [(name if names.count(name) == 1 else name + '-' + str(i)) + '/'
+            for i, name in enumerate(names)]
+
+
+def pack_directory(writer, js_dir, label, prefix=''):
+    for cfile in sorted(os.listdir(js_dir)):
+        file_path = os.path.join(js_dir, cfile)
+        if os.path.isfile(file_path):
+            with open(file_path, 'rb') as js_file:
+                writer.add(prefix + cfile, js_file.read(), label)
+
+
+def pack_archive(writer, archive_path, label, prefix=''):
+    """ Adds the files of a tar (possibly compressed) or zip archive, streamed member by
+    member. """
+
+    if zipfile.is_zipfile(archive_path):
+        with zipfile.ZipFile(archive_path) as archive:
+            for member in archive.infolist():
+                if not member.is_dir():
+                    writer.add(prefix + member.filename, archive.read(member), label)
+    else:
+        with tarfile.open(archive_path, mode='r:*') as archive:
+            for member in archive:
+                if member.isfile():
+                    writer.add(prefix + member.name, archive.extractfile(member).read(), label)
+
+
+def build_pack(pack_path, inputs, labels):
+    """
+        Builds a pack from directories and/or tar/zip archives.
+
+        -------
+        Parameters:
+        - pack_path: str
+            Path of the pack to build, ending with .pack.
+        - inputs: list of str
+            Directories or archives containing the JS files.
+        - labels: list of str
+            Labels of the inputs.
+
+        -------
+        Returns:
+        - str
+            Path of the pack. The files are named after their input and their path in it
+            (cf. input_prefixes), e.g. BENIGN-DIR/a.js. If an input cannot be read, no pack is
+            built.
+    """
+
+    if not pack_path.endswith(PACK_EXTENSION):
+        pack_path += PACK_EXTENSION
+    writer = PackWriter(pack_path)
+    try:
+        for i, prefix in enumerate(input_prefixes(inputs)):
+            if os.path.isdir(inputs[i]):
+                pack_directory(writer, inputs[i], labels[i], prefix)
+            else:
+                pack_archive(writer, inputs[i], labels[i], prefix)
+    except BaseException:
+        writer.abort()
+        raise
+    writer.close()
+    return pack_path
+
+
+def parsing_commands():
+    """
+        Creation of an ArgumentParser object, holding all the information necessary to parse
+        the command line into Python data types.
+    """
+
+    parser = argparse.ArgumentParser(description='Builds a packed corpus from directories or '
+                                                 + 'tar/zip archives of JS files.')
+
+    parser.add_argument('--o', metavar='PACK', type=str, nargs=1, required=True,
+                        help='pack to build (<name>.pack)')
+    parser.add_argument('--d', metavar='DIR-OR-ARCHIVE', type=str, nargs='+', required=True,
+                        help='directories or tar/zip archives containing the JS files')
+    parser.add_argument('--l', metavar='LABEL', type=str, nargs='+',
+                        choices=['benign', 'malicious', '?'],
+                        help='labels of the directories or archives (default: ?)')
+    utility.parsing_commands(parser)
+
+    return vars(parser.parse_args())
+
+
+def main_pack():
+    """ Main function, builds a pack. """
+
+    args = parsing_commands()
+    utility.control_logger(args['v'][0])
+    if args['l'] is not None and len(args['l']) != len(args['d']):
+        logging.error('Please, indicate as many labels as the number %s of directories or '
+                      + 'archives', str(len(args['d'])))
+        return
+    build_pack(args['o'][0], args['d'], args['l'] or ['?'] * len(args['d']))
+
+
+if __name__ == "__main__":  # Executed only if run as a script
+    main_pack()
@@ -0,0 +1,92 @@
+# Copyright (C) 2019 Aurore Fass
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+    CPU budget (--cpus) shared by the stages, so that they do not oversubscribe a shared
+    machine. The features extraction runs CPUS worker processes, each one running one Node.js
+    child at a time (with a single V8 platform thread) and single-threaded BLAS; the learning
+    and the classification, in the main process, run scikit-learn with n_jobs=CPUS and CPUS
+    BLAS threads. Without a budget, the former defaults are kept: utility.NUM_WORKERS workers,
+    n_jobs=-1 and the BLAS libraries' own number of threads.
+"""
+
+import os
+
+import utility
+
+try:
+    import threadpoolctl  # Installed with scikit-learn >= 0.23
+except ImportError:  # Only the environment variables, read by the processes started later
+    threadpoolctl = None
+
+
+CPUS = None  # None: no budget
+
+BLAS_VARIABLES = ('OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS',
+                  'BLIS_NUM_THREADS', 'VECLIB_MAXIMUM_THREADS', 'NUMEXPR_NUM_THREADS')
+
+_limits = None  # threadpoolctl limits applied to the current process
+
+
+def configure(cpus):
+    """ Sets the CPU budget, and the number of threads of the current (main) process. """
+
+    global CPUS
+    CPUS = cpus
+    if cpus is None:
+        return
+    utility.NUM_WORKERS = cpus
+    # Inherited by the processes started from now on: the Node.js children (libuv threads) and
+    # the workers started with spawn or forkserver, before they load their BLAS library
+    os.environ['UV_THREADPOOL_SIZE'] = '1'
+    for variable in BLAS_VARIABLES:
+        os.environ[variable] = '1'
+    limit_threads(cpus)
+
+
+def limit_threads(nb_threads):
+    """ Limits the BLAS / OpenMP thread pools already loaded in the current process. """
+
+    global _limits
+    if CPUS is not None and threadpoolctl is not None:
+        _limits = threadpoolctl.threadpool_limits(limits=nb_threads)
+
+
+def limit_worker():
+    """ In a worker: single-threaded BLAS (the workers use the whole budget together). """
+
+    limit_threads(1)
+
+
+def n_jobs():
+    """ Number of jobs of the scikit-learn estimators. """
+
+    return CPUS if CPUS is not None else -1
+
+
+def limit_model(model, nb_jobs=None):
+    """ Sets the number of jobs of a model loaded from the disk (stored with the one it was
+    learned with), to n_jobs() or nb_jobs. """
+
+    if CPUS is not None and 'n_jobs' in model.get_params():
+        model.set_params(n_jobs=nb_jobs or n_jobs())
+    return model
+
+
+def node_arguments():
+    """ Options of the Node.js children. """
+
+    if CPUS is not None:
+        return ['--v8-pool-size=1']
+    return []
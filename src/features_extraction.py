@@ -16,10 +16,19 @@
     Production of (AST-based + variables' name info) features for malicious JS detection.
 """
 
+import os
 import sys
+import logging
 
+import ast_columnar
 import ast_generation
 import ast_units
+import corpus_pack
+import features_lexer
+import features_memo
+import features_values
+import metrics
+import profiling
 
 UNITS_DICT = ast_units.AST_UNITS_DICT
 sys.setrecursionlimit(400000)
@@ -41,14 +50,24 @@ def get_the_ast(input_file):
         - or None.
     """
 
-    if input_file.endswith('.js'):
-        esprima_json = input_file.replace('.js', '.json')
+    if corpus_pack.is_pack_entry(input_file):  # Streamed to Node.js, no temporary file
+        source = corpus_pack.read_input(input_file)
+        metrics.observe('bytes_read', len(source))
+        extended_ast = ast_generation.get_extended_ast(input_file, '-', source=source)
     else:
-        esprima_json = input_file + '.json'
-    extended_ast = ast_generation.get_extended_ast(input_file, esprima_json)
+        if input_file.endswith('.js'):
+            esprima_json = input_file.replace('.js', '.json')
+        else:
+            esprima_json = input_file + '.json'
+        metrics.observe('bytes_read', os.path.getsize(input_file))
+        extended_ast = ast_generation.get_extended_ast(input_file, esprima_json)
     if extended_ast is not None:
         ast = extended_ast.get_ast()
-        ast_nodes = ast_generation.ast_to_ast_nodes(ast, ast_nodes=ast_generation.Node('Program'))
+        first_id = ast_generation.Node.id
+        with metrics.timer('ast_to_ast_nodes_seconds'):
+            ast_nodes = ast_generation.ast_to_ast_nodes(ast,
+                                                        ast_nodes=ast_generation.Node('Program'))
+        metrics.observe('ast_nodes', ast_generation.Node.id - first_id)
         return ast_nodes
     return None
 
@@ -66,51 +85,105 @@ def search_identifier(node, tab_id):
     return None
 
 
+def node_feature(node):
+    """ Feature (context, value) of a node, or None. """
+
+    if UNITS_DICT[node.name] == 'Literal':  # Case Literal (String, Int, Regex etc.)
+        context = node.literal_type()
+        if 'value' in node.attributes:
+            value = node.attributes['value']
+            return context, value
+        elif 'value' in node.attributes:
+            value = node.attributes['regex']
+            return context, value
+
+    elif UNITS_DICT[node.name] != 0:  # Case Statements or Expressions, cf ast_units.py
+        if not (node.name == 'ExpressionStatement' and node.children
+                and UNITS_DICT[node.children[0].name] != 0):
+            # To avoid duplicates as ExpressionStatement is not informative, and it may have a
+            # more informative child
+
+            context = UNITS_DICT[node.name]
+            identifier_node = search_identifier(node, [])
+            if identifier_node is not None:
+                value = identifier_node.attributes['name']
+                if node.name == 'MemberExpression' and node.children:
+                    if node.children[0].name == 'ThisExpression':
+                        context = 'This'  # To differentiate This and Object
+                return context, value
+    return None
+
+
 def build_features(ast, features_list):
     """ Build features with a context and the associated value. The features list is
     in features_list. """
 
     for child in ast.children:
-        if UNITS_DICT[child.name] == 'Literal':  # Case Literal (String, Int, Regex etc.)
-            context = child.literal_type()
-            if 'value' in child.attributes:
-                value = child.attributes['value']
-                features_list.append((context, value))
-            elif 'value' in child.attributes:
-                value = child.attributes['regex']
-                features_list.append((context, value))
-
-        elif UNITS_DICT[child.name] != 0:  # Case Statements or Expressions, cf ast_units.py
-            if not (child.name == 'ExpressionStatement' and child.children
-                    and UNITS_DICT[child.children[0].name] != 0):
-                # To avoid duplicates as ExpressionStatement is not informative, and it may have a
-                # more informative child
-
-                context = UNITS_DICT[child.name]
-                identifier_node = search_identifier(child, [])
-                if identifier_node is not None:
-                    value = identifier_node.attributes['name']
-                    if child.name == 'MemberExpression' and child.children:
-                        if child.children[0].name == 'ThisExpression':
-                            context = 'This'  # To differentiate This and Object
-                    features_list.append((context, value))
-
+        feature = node_feature(child)
+        if feature is not None:
+            features_list.append(feature)
         build_features(child, features_list)
 
 
 def get_features(input_file):
-    """ Returns (AST-based + variables' name info) features + the total number of features. """
+    """ Returns (AST-based + variables' name info) features + the total number of features.
+    The features of the files too big or (if enabled) that Esprima cannot parse are
+    approximated with the streaming lexer, cf. features_lexer.py. """
+
+    if features_lexer.use_lexer(input_file):
+        logging.info('%s is too big, analyzed with the lexer', input_file)
+        return lexer_features(input_file)
+    if ast_columnar.enabled():  # Without Node objects, cf. ast_columnar.py
+        features_dict, total_features = ast_columnar.get_features(input_file)
+        if features_dict is not None:
+            return features_dict, total_features
+    else:
+        ast = get_the_ast(input_file)
+        if ast is not None:
+            return count_features(ast, features_memo.get_source(input_file))
+    if features_lexer.FALLBACK:
+        logging.info('%s analyzed with the lexer', input_file)
+        return lexer_features(input_file)
+    return None, None
+
 
-    ast = get_the_ast(input_file)
-    if ast is not None:
-        features_list = list()
-        unique_features_dict = dict()
+def lexer_features(input_file):
+    """ Features approximated by the streaming lexer, with the values policy applied. """
+
+    features_dict, total_features = features_lexer.get_features(input_file)
+    if features_dict is not None and features_values.enabled():
+        features_dict = features_values.bound_features(features_dict)
+    return features_dict, total_features
+
+
+def count_features(ast, source=None):
+    """ Returns the features of an AST (dict feature: number of occurrences) + the total number
+    of features. With memoization enabled, the features of the subtrees already seen are taken
+    from the cache (source: content of the file, cf. features_memo.py). """
+
+    if features_memo.MEMO is not None:
+        with metrics.timer('build_features_seconds'):
+            unique_features_dict = features_memo.count_features(ast, source)
+        profiling.sample()
+        if features_values.enabled():
+            unique_features_dict = features_values.bound_features(unique_features_dict)
+        nb_features = sum(unique_features_dict.values())
+        metrics.observe('features_emitted', nb_features)
+        return unique_features_dict, nb_features
+
+    features_list = list()
+    unique_features_dict = dict()
+    with metrics.timer('build_features_seconds'):
         build_features(ast, features_list)
-        for feature in features_list:
-            if feature not in unique_features_dict:
-                unique_features_dict[feature] = 1
-            else:
-                unique_features_dict[feature] += 1
-        # print(features_list)
-        return unique_features_dict, len(features_list)
-    return None, None
+    profiling.sample()  # The AST and all the features are in memory
+    if features_values.enabled():  # Bounded values, cf. features_values.py
+        features_list = [(context, features_values.bound_value(value))
+                         for context, value in features_list]
+    for feature in features_list:
+        if feature not in unique_features_dict:
+            unique_features_dict[feature] = 1
+        else:
+            unique_features_dict[feature] += 1
+    # print(features_list)
+    metrics.observe('features_emitted', len(features_list))
+    return unique_features_dict, len(features_list)
@@ -0,0 +1,311 @@
+# Copyright (C) 2019 Aurore Fass
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+    Vocabulary walk: with the vocabulary of the selected features, the features of a file are
+    mapped to int ids while walking its AST (in an int array instead of the list of all the
+    features). The Bloom filter of the vocabulary is applied to each distinct feature the first
+    time it is found: the occurrences of most unknown features are dropped during the walk, and
+    the other distinct features are looked up in the vocabulary at once at the end. It pays off
+    when most of the distinct features of the files are unknown (small vocabularies). Running
+    this module checks that the vectors are the same with and without the vocabulary walk.
+"""
+
+import os
+import array
+import logging
+import argparse
+import pickle
+import timeit
+import tracemalloc
+import numpy as np
+
+import ast_columnar
+import corpus_pack
+import features_extraction
+import features_lexer
+import features_memo
+import features_values
+import metrics
+import profiling
+import utility
+import vocabulary
+
+
+WALK = None  # None (disabled), 'bloom' (Bloom filter prefilter) or 'exact' (lookups only)
+
+
+def configure(walk):
+    """ Sets the mode of the vocabulary walk, for the vectors built with a
+    vocabulary.Vocabulary. """
+
+    global WALK
+    WALK = walk
+
+
+def enabled(features2int_dict):
+    """ Whether the vectors built with features2int_dict come from the vocabulary walk. The
+    memoization, cf. features_memo.py, counts dicts of features, hence takes precedence. """
+
+    return WALK is not None and features_memo.MEMO is None\
+        and isinstance(features2int_dict, vocabulary.Vocabulary)
+
+
+class Walker:
+    """
+    Class Walker: features of a file mapped to the vector space. Each distinct feature is
+    tested against the Bloom filter of the vocabulary the first time it is found in the AST:
+    the occurrences of the rejected ones are dropped during the walk, the other ones are kept
+    as int ids, and looked up in the vocabulary at once at the end.
+    """
+
+    def __init__(self, features_vocabulary):
+        self.vocabulary = features_vocabulary
+        self.bloom = features_vocabulary.bloom if WALK == 'bloom' else None
+        self.bound = features_values.enabled()
+        self.ids = array.array('i')  # One per occurrence of the candidates
+        self.distinct = dict()  # Feature (before the values policy): candidate id, or -1
+        self.candidates = list()  # Features (under the values policy) to look up
+        self.nb_features = 0  # Occurrences, candidates or not
+        self.rejected = 0  # Distinct features rejected by the Bloom filter
+
+    def candidate_id(self, feature):
+        """ Id of a new distinct feature, or -1 if the Bloom filter rejects it. """
+
+        context, value = feature
+        if self.bound:
+            value = features_values.bound_value(value)
+        if self.bloom is not None and vocabulary.feature_key(context, value) not in self.bloom:
+            self.rejected += 1
+            return -1
+        self.candidates.append((context, value))
+        return len(self.candidates) - 1
+
+    def build_features(self, ast):
+        """ As features_extraction.build_features. """
+
+        for child in ast.children:
+            feature = features_extraction.node_feature(child)
+            if feature is not None:
+                self.nb_features += 1
+                feature_id = self.distinct.get(feature)
+                if feature_id is None:
+                    feature_id = self.distinct[feature] = self.candidate_id(feature)
+                if feature_id >= 0:
+                    self.ids.append(feature_id)
+            self.build_features(child)
+
+    def get_positions(self):
+        """ Positions of the known features, once per occurrence (int32). """
+
+        table = self.vocabulary.lookup(self.candidates)
+        positions = table[np.frombuffer(self.ids, dtype=np.int32)]
+        return positions[positions >= 0]
+
+
+def get_positions(input_file, features_vocabulary):
+    """
+        Features of a file, mapped to the vector space.
+
+        -------
+        Parameters:
+        - input_file: str
+            Path of the file to analyze.
+        - features_vocabulary: vocabulary.Vocabulary
+            Vocabulary of the selected features.
+
+        -------
+        Returns:
+        - numpy array
+            Positions of the known features, once per occurrence (int32); or None if the file
+            could not be analyzed.
+        - int
+            Total number of features of the file; or None.
+    """
+
+    if features_lexer.use_lexer(input_file) or ast_columnar.enabled():
+        # Features counted in a dict by the lexer or from the columnar AST
+        features_dict, total_features = features_extraction.get_features(input_file)
+        return dict_positions(features_dict, total_features, features_vocabulary)
+    ast = features_extraction.get_the_ast(input_file)
+    if ast is None:
+        if features_lexer.FALLBACK:
+            logging.info('%s analyzed with the lexer', input_file)
+            features_dict, total_features = features_extraction.lexer_features(input_file)
+            return dict_positions(features_dict, total_features, features_vocabulary)
+        return None, None
+
+    walker = Walker(features_vocabulary)
+    with metrics.timer('build_features_seconds'):
+        walker.build_features(ast)
+    profiling.sample()  # The AST and the features positions are in memory
+    metrics.observe('features_emitted', walker.nb_features)
+    metrics.increment('bloom_rejected', walker.rejected)
+    metrics.increment('vocabulary_lookups', len(walker.distinct) - walker.rejected)
+    return walker.get_positions(), walker.nb_features
+
+
+def dict_positions(features_dict, total_features, features_vocabulary):
+    """ get_positions for the files whose features are counted in a dict: analyzed with the
+    streaming lexer, or from their columnar AST (cf. ast_columnar.py). """
+
+    if features_dict is None:
+        return None, None
+    positions = features_vocabulary.lookup(list(features_dict))
+    occurrences = np.fromiter(features_dict.values(), dtype=np.int64, count=len(features_dict))
+    known = positions >= 0
+    return np.repeat(positions[known], occurrences[known]).astype(np.int32), total_features
+
+
+def dict_counts(ast, features_vocabulary):
+    """ Occurrences of the known features of an AST by position, and total number of features,
+    from the features dict (without the vocabulary walk). """
+
+    features_dict, total_features = features_extraction.count_features(ast)
+    counts = dict()
+    for feature, position in zip(features_dict, features_vocabulary.lookup(list(features_dict))):
+        if position >= 0:
+            counts[int(position)] = counts.get(int(position), 0) + features_dict[feature]
+    return counts, total_features
+
+
+def walk_counts(ast, features_vocabulary):
+    """ dict_counts with the vocabulary walk. """
+
+    walker = Walker(features_vocabulary)
+    walker.build_features(ast)
+    counts = dict()
+    for position in walker.get_positions().tolist():
+        counts[position] = counts.get(position, 0) + 1
+    return counts, walker.nb_features, len(walker.distinct), walker.rejected
+
+
+def measure(function, *args):
+    """ Result of function(*args), its time, and its memory peak in a second run. """
+
+    start = timeit.default_timer()
+    result = function(*args)
+    elapsed = timeit.default_timer() - start
+    tracemalloc.start()  # Slows down the allocations, hence not timed
+    function(*args)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def check(files, features_vocabulary, walk='bloom'):
+    """
+        Checks that the features of the files are the same with and without the vocabulary
+        walk, and compares their time and memory.
+
+        -------
+        Parameters:
+        - files: list
+            Paths of the JS files.
+        - features_vocabulary: vocabulary.Vocabulary
+            Vocabulary of the selected features.
+        - walk: str
+            Mode of the vocabulary walk.
+
+        -------
+        Returns:
+        - list
+            Files whose features differ.
+    """
+
+    previous_walk = WALK
+    configure(walk)
+    mismatches = list()
+    times = {'dict': 0, 'walk': 0}
+    peaks = {'dict': list(), 'walk': list()}
+    distinct = rejected = 0
+    try:
+        for input_file in files:
+            ast = features_extraction.get_the_ast(input_file)
+            if ast is None:
+                continue
+            expected, elapsed, peak = measure(dict_counts, ast, features_vocabulary)
+            times['dict'] += elapsed
+            peaks['dict'].append(peak)
+            (counts, nb_features, nb_distinct, nb_rejected), elapsed, peak = measure(
+                walk_counts, ast, features_vocabulary)
+            times['walk'] += elapsed
+            peaks['walk'].append(peak)
+            distinct += nb_distinct
+            rejected += nb_rejected
+
+            if (counts, nb_features) != expected:
+                logging.error('Different features with the vocabulary walk for %s', input_file)
+                mismatches.append(input_file)
+    finally:
+        configure(previous_walk)
+
+    print('Vocabulary walk (' + walk + '): ' + str(len(mismatches)) + ' file(s) with different '
+          + 'features; ' + ('Bloom filter rejections ' + str(round(100 * rejected / distinct, 1))
+                            + '% of the distinct features; ' if walk == 'bloom' and distinct
+                            else '')
+          + 'features mapped in ' + str(round(times['walk'], 2)) + 's vs '
+          + str(round(times['dict'], 2)) + 's')
+    if peaks['walk']:
+        print('Peak memory per file: mean ' + str(int(np.mean(peaks['walk'])) >> 10) + ' KiB vs '
+              + str(int(np.mean(peaks['dict'])) >> 10) + ' KiB, max '
+              + str(max(peaks['walk']) >> 10) + ' KiB vs ' + str(max(peaks['dict']) >> 10)
+              + ' KiB')
+    return mismatches
+
+
+def parsing_commands():
+    """
+        Creation of an ArgumentParser object, holding all the information necessary to parse
+        the command line into Python data types.
+    """
+
+    parser = argparse.ArgumentParser(description='Checks that the features are the same with '
+                                                 + 'and without the vocabulary walk.')
+
+    parser.add_argument('--d', metavar='DIR', type=str, nargs='+',
+                        help='directories containing the JS files to check')
+    parser.add_argument('--f', metavar='FILE', type=str, nargs='+', help='JS files to check')
+    parser.add_argument('--features', metavar='FILE', type=str, nargs=1, required=True,
+                        help='selected features (ANALYSIS_PATH/Features/_selected_features_)')
+    parser.add_argument('--mode', metavar='MODE', type=str, nargs=1, default=['bloom'],
+                        choices=['bloom', 'exact'], help='mode of the vocabulary walk')
+    utility.parsing_commands(parser)
+
+    return vars(parser.parse_args())
+
+
+def main_check():
+    """ Main function, checks the vocabulary walk. """
+
+    args = parsing_commands()
+    utility.control_logger(args['v'][0])
+    utility.configure_extraction(args)
+
+    files = list(args['f'] or [])
+    for js_dir in args['d'] or []:
+        files.extend(corpus_pack.list_files(js_dir)[0])
+    if not files:
+        logging.error('Please, indicate the JS directories or files to check')
+        return
+    features_path = args['features'][0]
+    features_values.load_policy(os.path.dirname(features_path))
+    features_dict = pickle.load(open(features_path, 'rb'))
+    check(files, vocabulary.Vocabulary(vocabulary.get_vocabulary_path(features_path,
+                                                                       features_dict)),
+          args['mode'][0])
+
+
+if __name__ == "__main__":  # Executed only if run as a script
+    main_check()
@@ -0,0 +1,656 @@
+# Copyright (C) 2019 Aurore Fass
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+    Fallback features extraction with a streaming tokenizer, for the files Esprima cannot parse
+    or which are too big to be parsed. The file is read chunk by chunk and the (context, value)
+    features of features_extraction.build_features are approximated from token patterns, in
+    constant memory.
+"""
+
+import io
+import os
+import re
+import pickle
+import logging
+import argparse
+import timeit
+from multiprocessing import Queue
+import numpy as np
+from scipy import sparse
+
+import corpus_pack
+import cpu_budget
+import features_extraction
+import features_space
+import features_values
+import metrics
+import workers_pool
+import utility
+
+
+FALLBACK = False  # Use the lexer for the files Esprima cannot parse
+SIZE_THRESHOLD = None  # Use the lexer directly for the files bigger than SIZE_THRESHOLD bytes
+
+CHUNK_SIZE = 1 << 16  # Characters read at once
+MAX_TOKEN = 1 << 16  # Longer tokens are truncated (their end is skipped)
+MAX_DEPTH = 1024  # Brackets nesting tracked
+MAX_PENDING = 64  # Contexts waiting for an identifier
+
+TOKEN_RE = re.compile(r'''
+    (?P<ws>\s+)
+    |(?P<comment>//[^\n]*|/\*(?:[^*]|\*(?!/))*(?:\*/)?)
+    |(?P<string>"(?:[^"\\\n]|\\[\s\S])*"?|'(?:[^'\\\n]|\\[\s\S])*'?)
+    |(?P<template>`(?:[^`\\]|\\[\s\S])*`?)
+    |(?P<number>0[xXoObB][0-9a-fA-F_]+n?|(?:\d[\d_]*\.?[\d_]*|\.\d[\d_]*)(?:[eE][+-]?\d+)?n?)
+    |(?P<name>[A-Za-z_$\u0080-\uffff][\w$\u0080-\uffff]*)
+    |(?P<punct>>>>=|\.\.\.|===|!==|\*\*=|<<=|>>=|>>>|\?\?=|&&=|\|\|=|=>|==|!=|<=|>=|&&|\|\||\?\?
+        |\?\.|\+\+|--|\+=|-=|\*=|/=|%=|&=|\|=|\^=|<<|>>|\*\*|[\s\S])
+''', re.VERBOSE)
+REGEX_RE = re.compile(r'/(?:[^/\\\n\[]|\\.|\[(?:[^\]\\\n]|\\.)*\])+/[\w$]*')
+
+# To skip the end of the tokens longer than MAX_TOKEN
+CONTINUATION_RE = {
+    'ws': re.compile(r'\s*'),
+    'line_comment': re.compile(r'[^\n]*'),
+    'block_comment': re.compile(r'(?:[^*]|\*(?=[^/]))*(?P<end>\*/)?'),
+    '"': re.compile(r'(?:[^"\\\n]|\\[\s\S])*(?P<end>")?'),
+    "'": re.compile(r"(?:[^'\\\n]|\\[\s\S])*(?P<end>')?"),
+    'template': re.compile(r'(?:[^`\\]|\\[\s\S])*(?P<end>`)?'),
+    'number': re.compile(r'[\w.]*'),
+    'name': re.compile(r'[\w$\u0080-\uffff]*'),
+    'regex': re.compile(r'(?:[^/\\\n\[]|\\.|\[(?:[^\]\\\n]|\\.)*\])*(?P<end>/[\w$]*)?'),
+}
+
+ESCAPE_RE = re.compile(r'\\(u\{[0-9a-fA-F]+\}|u[0-9a-fA-F]{4}|x[0-9a-fA-F]{2}|[0-7]{1,3}|\r\n'
+                       + r'|[\s\S])')
+ESCAPES = {'n': '\n', 't': '\t', 'r': '\r', 'b': '\b', 'f': '\f', 'v': '\v', '\n': '',
+           '\r\n': '', '\r': '', '\u2028': '', '\u2029': ''}
+
+# Keywords whose statement / expression context is resolved by the next identifier, as
+# features_extraction.search_identifier returns the first Identifier of the node
+KEYWORD_CONTEXTS = {
+    'if': 'If', 'for': 'For', 'while': 'While', 'do': 'While', 'return': 'Return',
+    'var': 'Variable', 'let': 'Variable', 'const': 'Variable', 'function': 'Function',
+    'new': 'New', 'switch': 'Switch', 'case': 'SwitchCase', 'try': 'Try', 'catch': 'Catch',
+    'throw': 'Throw', 'class': 'Class', 'import': 'Import', 'with': 'With', 'yield': 'Yield',
+    'await': 'Await', 'typeof': 'Expression', 'delete': 'Expression', 'void': 'Expression'
+}
+KEYWORDS = set(KEYWORD_CONTEXTS) | {
+    'break', 'continue', 'debugger', 'default', 'else', 'export', 'extends', 'finally', 'in',
+    'instanceof', 'super', 'this', 'true', 'false', 'null'
+}
+BINARY_OPERATORS = {
+    '+', '-', '*', '/', '%', '**', '==', '!=', '===', '!==', '<', '>', '<=', '>=', '<<', '>>',
+    '>>>', '&', '|', '^', '&&', '||', '??', 'in', 'instanceof'
+}
+ASSIGN_OPERATORS = {
+    '=', '+=', '-=', '*=', '/=', '%=', '**=', '<<=', '>>=', '>>>=', '&=', '|=', '^=', '&&=',
+    '||=', '??='
+}
+UNARY_OPERATORS = {'!', '~', '+', '-'}
+# After these tokens, a '{' opens an object literal and not a block
+OBJECT_PREV = (BINARY_OPERATORS | ASSIGN_OPERATORS | UNARY_OPERATORS
+               | {'(', '[', ',', '?', 'return', 'typeof', 'case', 'yield', 'await', '...'})
+
+
+def configure(fallback, size_threshold):
+    """ Enables the lexer for the files Esprima cannot parse (fallback) and/or for the files
+    bigger than size_threshold bytes. """
+
+    global FALLBACK, SIZE_THRESHOLD
+    FALLBACK = fallback
+    SIZE_THRESHOLD = size_threshold
+
+
+def use_lexer(input_file):
+    """ Indicates whether input_file is too big to be parsed. """
+
+    return SIZE_THRESHOLD is not None and corpus_pack.get_size(input_file) > SIZE_THRESHOLD
+
+
+def tokenize(js_file):
+    """
+        Streaming tokenizer.
+
+        -------
+        Parameter:
+        - js_file: text file object
+            JS file, read CHUNK_SIZE characters at a time.
+
+        -------
+        Returns:
+        - generator
+            (kind, text) of the tokens (without whitespaces and comments), kind being 'string',
+            'template', 'number', 'name', 'regex' or 'punct'. Tokens longer than MAX_TOKEN are
+            truncated.
+    """
+
+    buffer, position, eof = '', 0, False
+    regex_allowed = True  # A '/' starts a regex and not a division
+
+    while True:
+        if not eof and len(buffer) - position < MAX_TOKEN:
+            buffer = buffer[position:]
+            position = 0
+            while not eof and len(buffer) < MAX_TOKEN:
+                chunk = js_file.read(CHUNK_SIZE)
+                eof = not chunk
+                buffer += chunk
+        if position >= len(buffer):
+            return
+
+        match = TOKEN_RE.match(buffer, position)
+        kind = match.lastgroup
+        if kind == 'punct' and match.group() in ('/', '/=') and regex_allowed:
+            regex_match = REGEX_RE.match(buffer, position)
+            if regex_match is not None:
+                match, kind = regex_match, 'regex'
+
+        if not eof and match.end() >= len(buffer) - 1 and not is_complete(kind, match.group()):
+            # The token may go on after the buffer: longer than MAX_TOKEN, truncated
+            text = match.group()[:MAX_TOKEN]
+            buffer, eof = skip_token(js_file, kind, text, buffer[match.end():])
+            position = 0
+        else:
+            text = match.group()
+            position = match.end()
+
+        if kind not in ('ws', 'comment'):
+            yield kind, text
+            regex_allowed = not (kind in ('string', 'template', 'number', 'regex')
+                                 or (kind == 'name' and text not in KEYWORDS)
+                                 or text in (')', ']', '}', 'this', 'super'))
+
+
+def is_complete(kind, text):
+    """ Indicates whether a token reaching the end of the buffer is complete. """
+
+    if kind in ('string', 'template'):
+        escapes = len(text) - 1 - len(text[:-1].rstrip('\\'))
+        return len(text) > 1 and text[-1] == text[0] and escapes % 2 == 0
+    if kind == 'comment':
+        return text.startswith('/*') and len(text) >= 4 and text.endswith('*/')
+    return kind in ('regex', 'punct')
+
+
+def skip_token(js_file, kind, text, rest):
+    """ Skips the end of a truncated token. Returns the buffer following the token and whether
+    the end of the file was reached. """
+
+    if kind == 'comment':
+        kind = 'line_comment' if text.startswith('//') else 'block_comment'
+        if kind == 'block_comment' and text.endswith('*'):
+            rest = '*' + rest  # The '*' may be the beginning of '*/'
+    elif kind == 'string':
+        kind = text[0]
+    continuation = CONTINUATION_RE[kind]
+
+    while True:
+        chunk = js_file.read(CHUNK_SIZE)
+        buffer = rest + chunk
+        match = continuation.match(buffer)
+        if not chunk or match.groupdict().get('end') or match.end() < len(buffer) - 1:
+            return buffer[match.end():], not chunk
+        rest = buffer[match.end():]
+
+
+def string_value(text):
+    """ Value of a string literal, as Esprima would give it. """
+
+    quote = text[0]
+    body = text[1:-1] if len(text) > 1 and text.endswith(quote) else text[1:]
+
+    def unescape(match):
+        escape = match.group(1)
+        if escape[0] == 'u' and len(escape) > 1:
+            code = int(escape.strip('u{}'), 16)
+            return chr(code) if code < 0x110000 else escape
+        if escape[0] == 'x' and len(escape) == 3:
+            return chr(int(escape[1:], 16))
+        if escape[0] in '01234567':
+            return chr(int(escape, 8))
+        return ESCAPES.get(escape, escape)
+
+    value = ESCAPE_RE.sub(unescape, body)
+    try:  # Surrogate pairs, as decoded by json
+        value = value.encode('utf-16', 'surrogatepass').decode('utf-16')
+    except UnicodeError:
+        pass
+    return value
+
+
+def number_value(text):
+    """ Value of a numeric literal, as Esprima (through JSON) would give it, or None. """
+
+    text = text.replace('_', '')
+    try:
+        if text.endswith('n'):  # BigInt, not supported by Esprima
+            return None
+        if text[:2].lower() in ('0x', '0o', '0b'):
+            value = int(text[2:], {'x': 16, 'o': 8, 'b': 2}[text[1].lower()])
+        elif len(text) > 1 and text[0] == '0' and text.isdigit() and '8' not in text\
+                and '9' not in text:
+            value = int(text, 8)  # Legacy octal
+        else:
+            value = float(text)
+    except ValueError:
+        return None
+    if isinstance(value, float) and value.is_integer() and abs(value) < 1e21:
+        return int(value)  # JSON.stringify writes integers without decimal point
+    if isinstance(value, int) and abs(value) >= 1e21:
+        return float(value)
+    return value
+
+
+def literal_context(value):
+    """ Same as Node.literal_type, for a Python value (bool being an int). """
+
+    if isinstance(value, str):
+        return 'String'
+    if isinstance(value, int):
+        return 'Int'
+    if isinstance(value, float):
+        return 'Numeric'
+    return 'Null'
+
+
+class LexerFeatures:
+    """
+    Class LexerFeatures: approximates the (context, value) features from the tokens.
+    """
+
+    def __init__(self):
+        self.features = dict()
+        self.total = 0
+        self.pending = list()  # Contexts waiting for the next identifier
+        self.stack = list()  # (opener, chain, call or member, object literal)
+        self.overflow = 0  # Brackets beyond MAX_DEPTH
+        self.chain = None  # First identifier of the current member / call chain, or 'this'
+        self.operand = False  # The previous token ends an operand
+        self.prev = None  # Previous token
+        self.after_new = False  # The current chain follows 'new'
+        self.declaration = False  # The current identifier is declared (var, function...)
+        self.declaration_depth = None  # Depth of the current var / let / const
+        self.property = None  # Candidate property name, in an object literal
+
+    def add(self, context, value):
+        feature = (context, value)
+        self.features[feature] = self.features.get(feature, 0) + 1
+        self.total += 1
+
+    def resolve(self, value):
+        for context in self.pending:
+            self.add(context, value)
+        del self.pending[:]
+
+    def wait(self, context):
+        if len(self.pending) < MAX_PENDING:
+            self.pending.append(context)
+
+    def chain_context(self, context):
+        """ context whose first identifier is the one of the current chain. """
+
+        if self.operand and self.chain not in (None, 'this'):
+            self.add(context, self.chain)
+        else:
+            self.wait(context)
+
+    def in_object(self):
+        return bool(self.stack) and self.stack[-1][3] and not self.overflow
+
+    def push(self, opener, chain, accessor, is_object):
+        if len(self.stack) < MAX_DEPTH:
+            self.stack.append((opener, chain, accessor, is_object))
+        else:
+            self.overflow += 1
+
+    def pop(self):
+        if self.overflow:
+            self.overflow -= 1
+            return None
+        if self.stack:
+            return self.stack.pop()
+        return None
+
+    def feed(self, kind, text):
+        """ Handles the next token. """
+
+        operand, chain = self.operand, self.chain
+        self.operand, self.chain = False, None
+
+        if kind == 'name' and text not in KEYWORDS:
+            self.handle_identifier(text, chain)
+
+        elif kind in ('string', 'number') or text in ('true', 'false', 'null'):
+            if kind == 'string':
+                value = string_value(text)
+            elif kind == 'number':
+                value = number_value(text)
+            else:
+                value = {'true': True, 'false': False, 'null': None}[text]
+            if kind != 'number' or value is not None:
+                self.add(literal_context(value), value)
+            self.operand = True
+
+        elif kind in ('regex', 'template'):  # No features, as in build_features
+            self.operand = True
+
+        elif text in ('this', 'super'):
+            self.operand, self.chain = True, 'this'
+
+        elif kind == 'name':
+            self.handle_keyword(text, operand, chain)
+
+        else:
+            self.handle_punctuator(text, operand, chain)
+
+        if kind != 'name':
+            self.declaration = False
+        self.prev = text
+
+    def handle_identifier(self, name, chain):
+        self.resolve(name)  # Also for properties, which are Identifier nodes
+        if self.prev in ('.', '?.'):
+            self.chain = name if chain in (None, 'this') else chain
+        else:
+            self.chain = name
+            self.after_new = self.prev == 'new'
+            self.declaration = self.prev in ('var', 'let', 'const', 'function', 'class')\
+                or (self.prev == ',' and self.declaration_depth == len(self.stack))
+            self.property = name if self.in_object() and self.prev in ('{', ',') else None
+        self.operand = self.prev not in ('function', 'class')  # Declared name, not a callee
+
+    def handle_keyword(self, keyword, operand, chain):
+        if keyword in ('in', 'instanceof'):
+            self.handle_punctuator(keyword, operand, chain)
+            return
+        if keyword in KEYWORD_CONTEXTS:
+            self.wait(KEYWORD_CONTEXTS[keyword])
+        if keyword in ('var', 'let', 'const'):
+            self.declaration_depth = len(self.stack)
+
+    def handle_punctuator(self, punctuator, operand, chain):
+        if punctuator in ('.', '?.'):
+            self.operand, self.chain = operand, chain
+            if chain == 'this':
+                self.wait('This')
+            else:
+                self.chain_context('Object')
+            self.operand = False
+
+        elif punctuator == '(':
+            if operand and self.prev not in ('function', 'class'):
+                if self.after_new:  # Arguments of new, no CallExpression
+                    self.after_new = False
+                else:
+                    self.operand, self.chain = True, chain
+                    self.chain_context('Call')
+                    self.operand, self.chain = False, None
+                self.push('(', chain, True, False)
+            else:
+                self.push('(', None, False, False)
+
+        elif punctuator == '[':
+            if operand:
+                self.operand, self.chain = True, chain
+                self.chain_context('Object')
+                self.operand, self.chain = False, None
+                self.push('[', chain, True, False)
+            else:
+                self.wait('Array')
+                self.push('[', None, False, False)
+
+        elif punctuator in (')', ']'):
+            opened = self.pop()
+            self.operand = True
+            if opened is not None and opened[2]:
+                self.chain = opened[1]
+
+        elif punctuator == '{':
+            is_object = self.prev in OBJECT_PREV or (self.prev == ':' and self.in_object())
+            if is_object:
+                self.wait('Object')
+            self.push('{', None, False, is_object)
+
+        elif punctuator == '}':
+            opened = self.pop()
+            self.operand = opened is not None and opened[3]
+            if self.declaration_depth is not None and self.declaration_depth > len(self.stack):
+                self.declaration_depth = None
+
+        elif punctuator == ':':
+            if self.in_object() and self.property is not None and operand:
+                self.add('Property', self.property)
+            self.property = None
+
+        elif punctuator == ';':
+            del self.pending[:]
+            if self.declaration_depth == len(self.stack):
+                self.declaration_depth = None
+
+        elif punctuator in ASSIGN_OPERATORS:
+            if not (operand and self.declaration):  # var a = ...: no AssignmentExpression
+                self.operand, self.chain = operand, chain
+                self.chain_context('Assign')
+                self.operand, self.chain = False, None
+
+        elif punctuator in ('++', '--'):
+            if operand:  # Postfix
+                self.operand, self.chain = True, chain
+                self.chain_context('Expression')
+            else:
+                self.wait('Expression')
+
+        elif punctuator in ('?', '=>'):
+            if operand and chain not in (None, 'this'):
+                self.add('If' if punctuator == '?' else 'Expression', chain)
+
+        elif punctuator in BINARY_OPERATORS:
+            if operand:
+                self.operand, self.chain = True, chain
+                self.chain_context('Expression')
+                self.operand, self.chain = False, None
+            else:  # Unary
+                self.wait('Expression')
+
+        elif punctuator in UNARY_OPERATORS:
+            self.wait('Expression')
+
+        if punctuator == ',' and self.in_object():
+            self.property = None
+
+
+def get_features(input_file):
+    """
+        Features of a JS file, with the streaming tokenizer.
+
+        -------
+        Parameter:
+        - input_file: str
+            Path of the file to study (possibly packed).
+
+        -------
+        Returns:
+        - dict
+            Features (dict feature: number of occurrences), as features_extraction.count_features.
+        - int
+            Total number of features.
+    """
+
+    extractor = LexerFeatures()
+    with metrics.timer('lexer_seconds'):
+        with io.TextIOWrapper(corpus_pack.open_input(input_file), encoding='utf-8',
+                              errors='replace') as js_file:
+            for kind, text in tokenize(js_file):
+                extractor.feed(kind, text)
+    metrics.increment('lexer_files')
+    metrics.observe('features_emitted', extractor.total)
+    return extractor.features, extractor.total
+
+
+def compare_features(ast_features, lexer_features):
+    """ Coverage (share of the AST features, weighted by their number of occurrences, found by
+    the lexer) and precision (share of the lexer features which are AST features). """
+
+    common = sum(min(count, lexer_features.get(feature, 0))
+                 for feature, count in ast_features.items())
+    coverage = common / sum(ast_features.values()) if ast_features else 1
+    precision = common / sum(lexer_features.values()) if lexer_features else 1
+    return coverage, precision
+
+
+def worker_compare(my_queue, out_queue, features2int_dict):
+    """ Worker to extract the features of each file with both Esprima and the lexer. """
+
+    for file_path, label in workers_pool.iter_tasks(my_queue):
+        try:
+            start = timeit.default_timer()
+            ast = features_extraction.get_the_ast(file_path)
+            ast_features = features_extraction.count_features(ast) if ast is not None\
+                else (None, None)
+            ast_time = timeit.default_timer() - start
+
+            start = timeit.default_timer()
+            lexer_features = features_extraction.lexer_features(file_path)  # Values policy
+            lexer_time = timeit.default_timer() - start
+
+            result = {'file': file_path, 'label': label, 'parsed': ast is not None,
+                      'ast_time': ast_time, 'lexer_time': lexer_time}
+            if ast is not None:
+                result['coverage'], result['precision'] =\
+                    compare_features(ast_features[0], lexer_features[0])
+            if features2int_dict is not None:
+                nb_features = len(features2int_dict)
+                result['vectors'] = [features_space.features_dict_vector(
+                    features_dict, total, nb_features, features2int_dict)
+                                     if features_dict is not None else None
+                                     for features_dict, total in (ast_features,
+                                                                  lexer_features)]
+            out_queue.put(result)
+        except Exception as e:  # Handle exception occurring in the processes spawned
+            logging.error('Something went wrong with %s', file_path)
+            print(e)
+
+
+def compare(js_dirs, labels, model=None, features2int_dict=None):
+    """
+        Measures the coverage of the lexer features and (with a model) the accuracy of the
+        predictions made from them, against the full AST path.
+
+        -------
+        Parameters:
+        - js_dirs: list of str
+            Directories (or packs) containing the JS files.
+        - labels: list of str
+            Labels of the directories ('?' if unknown).
+        - model
+            Model to compare the predictions of, or None.
+        - features2int_dict: dict
+            Features selected, to build the model's vectors.
+
+        -------
+        Returns:
+        - dict
+            Summary of the comparison.
+    """
+
+    my_queue = Queue()
+    out_queue = Queue()
+    tasks = list()
+    for i, js_dir in enumerate(js_dirs):
+        tasks.extend(zip(*corpus_pack.list_files(js_dir, labels[i])))
+    workers_pool.put_tasks(my_queue, tasks, [file_path for file_path, _ in tasks])
+
+    pool = workers_pool.start_workers(worker_compare, (my_queue, out_queue,
+                                                       features2int_dict if model else None))
+    results = workers_pool.get_results(pool, out_queue)
+
+    parsed = [result for result in results if result['parsed']]
+    summary = {'files': len(results), 'parse_failures': len(results) - len(parsed),
+               'coverage': float(np.mean([result['coverage'] for result in parsed]))
+                           if parsed else None,
+               'precision': float(np.mean([result['precision'] for result in parsed]))
+                            if parsed else None,
+               'ast_time': sum(result['ast_time'] for result in results),
+               'lexer_time': sum(result['lexer_time'] for result in results)}
+
+    if model is not None and parsed:
+        ast_predicted = model.predict(sparse.vstack(
+            [result['vectors'][0] for result in parsed]))
+        lexer_predicted = model.predict(sparse.vstack(
+            [result['vectors'][1] for result in parsed]))
+        summary['agreement'] = float(np.mean(ast_predicted == lexer_predicted))
+        truth = np.array([result['label'] for result in parsed])
+        if '?' not in truth:
+            summary['ast_accuracy'] = float(np.mean(ast_predicted == truth))
+            summary['lexer_accuracy'] = float(np.mean(lexer_predicted == truth))
+        failed = [result for result in results if not result['parsed']]
+        if failed:  # Verdicts only given by the lexer
+            failed_predicted = model.predict(sparse.vstack([result['vectors'][1]
+                                                            for result in failed]))
+            summary['failures_predicted'] = dict((str(label), int(count)) for label, count
+                                                 in zip(*np.unique(failed_predicted,
+                                                                   return_counts=True)))
+
+    for key, value in summary.items():
+        print(key + ': ' + str(value))
+    return summary
+
+
+def parsing_commands():
+    """
+        Creation of an ArgumentParser object, holding all the information necessary to parse
+        the command line into Python data types.
+    """
+
+    parser = argparse.ArgumentParser(description='Compares the features of the streaming lexer '
+                                                 + 'with the features of the full AST path.')
+
+    parser.add_argument('--d', metavar='DIR', type=str, nargs='+', required=True,
+                        help='directories containing the JS files to compare on')
+    parser.add_argument('--l', metavar='LABEL', type=str, nargs='+',
+                        choices=['benign', 'malicious', '?'], help='labels of the JS directories')
+    parser.add_argument('--m', metavar='MODEL', type=str, nargs=1, default=[None],
+                        help='model to compare the predictions of')
+    utility.parsing_commands(parser)
+
+    return vars(parser.parse_args())
+
+
+def main_compare():
+    """ Main function, compares the lexer with the full AST path. """
+
+    args = parsing_commands()
+    utility.control_logger(args['v'][0])
+    cpu_budget.configure(args['cpus'][0])
+    utility.configure_extraction(args)
+    features_values.load_policy(os.path.join(args['analysis_path'][0], 'Features'))
+
+    labels = args['l'] or ['?'] * len(args['d'])
+    if len(labels) != len(args['d']):
+        logging.error('Please, indicate as many labels as the number %s of directories',
+                      str(len(args['d'])))
+        return None
+
+    model, features2int_dict = None, None
+    if args['m'][0] is not None:
+        model = pickle.load(open(args['m'][0], 'rb'))
+        features2int_dict = pickle.load(open(os.path.join(args['analysis_path'][0], 'Features',
+                                                          '_selected_features_'), 'rb'))
+    return compare(args['d'], labels, model, features2int_dict)
+
+
+if __name__ == "__main__":  # Executed only if run as a script
+    main_compare()
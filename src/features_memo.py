@@ -0,0 +1,327 @@
+# Copyright (C) 2019 Aurore Fass
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+    Memoization of the features of the top-level statements and function bodies, across the
+    files analyzed by a process: the same library code (jQuery, analytics snippets, bundler
+    runtimes) embedded in different files, or the unchanged functions of a new version of a
+    file, are counted once. The subtrees are identified by a hash of their source (range) or of
+    their structure (structure), and their features counts are kept in a bounded LRU cache.
+    Running this module checks that the features are the same with and without memoization.
+"""
+
+import re
+import logging
+import hashlib
+import argparse
+import timeit
+from collections import OrderedDict
+
+import corpus_pack
+import features_extraction
+import metrics
+import parser_backends
+import utility
+
+
+MEMO = None  # None (disabled), 'range' or 'structure'
+MEMO_FEATURES = 1 << 20  # Maximum number of (feature, occurrences) held by the cache
+MIN_LENGTH = 256  # Characters; the smaller subtrees are not memoized
+
+FUNCTIONS = ('FunctionDeclaration', 'FunctionExpression', 'ArrowFunctionExpression')
+NON_BMP_RE = re.compile('[\U00010000-\U0010ffff]')  # 2 UTF-16 code units in Esprima ranges
+
+_cache = OrderedDict()  # Digest: tuple of (feature, occurrences), least recently used first
+_cache_features = 0
+
+
+def configure(memo, memo_features=MEMO_FEATURES):
+    """ Sets the memoization mode and the size of the cache. """
+
+    global MEMO, MEMO_FEATURES
+    MEMO = memo
+    MEMO_FEATURES = memo_features or MEMO_FEATURES
+    clear()
+
+
+def clear():
+    global _cache_features
+    _cache.clear()
+    _cache_features = 0
+
+
+def get_source(input_file):
+    """ Content of input_file if it is needed to memoize its features, else None. """
+
+    if MEMO == 'range':
+        return corpus_pack.read_input(input_file)
+    return None
+
+
+def source_units(source):
+    """ Source of a file, indexable with the ranges of the Esprima AST: str, or UTF-16 bytes
+    and 2 bytes per unit for Node.js if the file has characters outside of the BMP. None if
+    the file is not valid UTF-8 (Node.js would replace the invalid bytes). """
+
+    try:
+        text = source.decode('utf-8')
+    except UnicodeDecodeError:
+        return None, None
+    if parser_backends.BACKEND == 'node' and NON_BMP_RE.search(text):
+        return text.encode('utf-16-le', errors='surrogatepass'), 2
+    return text, 1
+
+
+def is_memo_point(node, parent):
+    """ Top-level statement or function body big enough to be memoized. """
+
+    if parent.name != 'Program' and not (node.name == 'BlockStatement'
+                                         and parent.name in FUNCTIONS):
+        return False
+    node_range = node.attributes.get('range')
+    return isinstance(node_range, list) and node_range[1] - node_range[0] >= MIN_LENGTH
+
+
+def range_digest(node, text, unit):
+    """ Digest of the source of a subtree. """
+
+    start, end = node.attributes['range']
+    code = text[unit * start:unit * end]
+    if isinstance(code, str):
+        code = code.encode('utf-8', errors='surrogatepass')
+    return hashlib.blake2b(node.name.encode('ascii') + b'\0' + code, digest_size=16).digest()
+
+
+def structure_digest(node, digests):
+    """ Digest of the structure of a subtree: node types and attributes but the ranges, in
+    order. digests (node id: digest) holds the ones of the subtrees already hashed. """
+
+    if node.id in digests:
+        return digests[node.id]
+    attributes = node.attributes
+    if 'range' in attributes:
+        attributes = [item for item in attributes.items() if item[0] != 'range']
+    digest = hashlib.blake2b(repr((node.name, attributes)).encode('utf-8', 'surrogatepass'),
+                             digest_size=16)
+    for child in node.children:
+        digest.update(structure_digest(child, digests))
+    digests[node.id] = digest.digest()
+    return digests[node.id]
+
+
+def lookup(digest):
+    """ Features counts of a subtree (tuple), or None. """
+
+    items = _cache.get(digest)
+    if items is not None:
+        _cache.move_to_end(digest)
+    return items
+
+
+def store(digest, items):
+    """ Stores the features counts of a subtree, evicting the least recently used ones. """
+
+    global _cache_features
+    if len(items) > MEMO_FEATURES:
+        return
+    _cache[digest] = items
+    _cache_features += len(items)
+    while _cache_features > MEMO_FEATURES:
+        _, evicted = _cache.popitem(last=False)
+        _cache_features -= len(evicted)
+
+
+class Counter:
+    """
+    Class Counter: features counts of a file, and memoization statistics.
+    """
+
+    def __init__(self, text, unit):
+        self.text = text
+        self.unit = unit
+        self.digests = dict()  # Structure digests, by node id
+        self.hits = 0
+        self.misses = 0
+        self.reused = 0  # Features taken from the cache
+
+    def digest(self, node):
+        if self.text is not None:
+            return range_digest(node, self.text, self.unit)
+        return structure_digest(node, self.digests)
+
+    def build_features(self, ast, counts):
+        """ As features_extraction.build_features, counting the features in counts (dict
+        feature: number of occurrences), with the memoized subtrees counted once. """
+
+        for child in ast.children:
+            digest = self.digest(child) if is_memo_point(child, ast) else None
+            if digest is None:
+                add_feature(counts, features_extraction.node_feature(child))
+                self.build_features(child, counts)
+                continue
+
+            items = lookup(digest)
+            if items is not None:
+                self.hits += 1
+                for feature, occurrences in items:
+                    counts[feature] = counts.get(feature, 0) + occurrences
+                    self.reused += occurrences
+                continue
+
+            self.misses += 1
+            child_counts = dict()
+            add_feature(child_counts, features_extraction.node_feature(child))
+            self.build_features(child, child_counts)
+            store(digest, tuple(child_counts.items()))
+            for feature, occurrences in child_counts.items():
+                counts[feature] = counts.get(feature, 0) + occurrences
+
+
+def add_feature(counts, feature):
+    if feature is not None:
+        counts[feature] = counts.get(feature, 0) + 1
+
+
+def count_features(ast, source=None):
+    """
+        Features of an AST, the ones of the subtrees seen before being taken from the cache.
+
+        -------
+        Parameters:
+        - ast: Node
+            AST of the file.
+        - source: bytes
+            Content of the file, for MEMO = 'range'. Without it (or if it is not valid UTF-8),
+            the subtrees are identified by their structure.
+
+        -------
+        Returns:
+        - dict
+            Features (before the values policy) and their number of occurrences, as counted
+            by features_extraction.build_features.
+    """
+
+    text, unit = None, None
+    if MEMO == 'range' and source is not None:
+        text, unit = source_units(source)
+    counter = Counter(text, unit)
+    counts = dict()
+    counter.build_features(ast, counts)
+
+    metrics.increment('memo_hits', counter.hits)
+    metrics.increment('memo_misses', counter.misses)
+    if counts:
+        metrics.observe('memo_hit_ratio', counter.reused / sum(counts.values()))
+    return counts
+
+
+def check(files, memo='range'):
+    """
+        Checks that the features of the files are the same with and without memoization.
+
+        -------
+        Parameters:
+        - files: list
+            Paths of the JS files, in the order they are analyzed (the cache is kept from one
+            file to the next).
+        - memo: str
+            Memoization mode.
+
+        -------
+        Returns:
+        - list
+            Files whose features differ.
+    """
+
+    previous_memo = MEMO
+    configure(memo, MEMO_FEATURES)
+    mismatches = list()
+    times = {'plain': 0, 'memo': 0}
+    hits = misses = 0
+    try:
+        for input_file in files:
+            ast = features_extraction.get_the_ast(input_file)
+            if ast is None:
+                continue
+            start = timeit.default_timer()
+            expected = dict()
+            features_list = list()
+            features_extraction.build_features(ast, features_list)
+            for feature in features_list:
+                expected[feature] = expected.get(feature, 0) + 1
+            times['plain'] += timeit.default_timer() - start
+
+            text, unit = source_units(corpus_pack.read_input(input_file))\
+                if memo == 'range' else (None, None)
+            counter = Counter(text, unit)
+            counts = dict()
+            start = timeit.default_timer()
+            counter.build_features(ast, counts)
+            times['memo'] += timeit.default_timer() - start
+            hits += counter.hits
+            misses += counter.misses
+
+            if counts != expected or list(counts) != list(expected):
+                logging.error('Different features with memoization for %s', input_file)
+                mismatches.append(input_file)
+    finally:
+        configure(previous_memo, MEMO_FEATURES)
+
+    print('Memoization (' + memo + '): ' + str(len(mismatches)) + ' file(s) with different '
+          + 'features; hits ' + str(hits) + ', misses ' + str(misses)
+          + (' (hit rate ' + str(round(100 * hits / (hits + misses), 1)) + '%)'
+             if hits + misses else '')
+          + '; features built in ' + str(round(times['memo'], 2)) + 's vs '
+          + str(round(times['plain'], 2)) + 's')
+    return mismatches
+
+
+def parsing_commands():
+    """
+        Creation of an ArgumentParser object, holding all the information necessary to parse
+        the command line into Python data types.
+    """
+
+    parser = argparse.ArgumentParser(description='Checks that the features are the same with '
+                                                 + 'and without memoization.')
+
+    parser.add_argument('--d', metavar='DIR', type=str, nargs='+',
+                        help='directories containing the JS files to check')
+    parser.add_argument('--f', metavar='FILE', type=str, nargs='+', help='JS files to check')
+    parser.add_argument('--mode', metavar='MODE', type=str, nargs=1, default=['range'],
+                        choices=['range', 'structure'], help='memoization mode')
+    utility.parsing_commands(parser)
+
+    return vars(parser.parse_args())
+
+
+def main_check():
+    """ Main function, checks the memoization. """
+
+    args = parsing_commands()
+    utility.control_logger(args['v'][0])
+    utility.configure_extraction(args)
+    configure(None, args['memo_size'][0])
+
+    files = list(args['f'] or [])
+    for js_dir in args['d'] or []:
+        files.extend(corpus_pack.list_files(js_dir)[0])
+    if not files:
+        logging.error('Please, indicate the JS directories or files to check')
+        return
+    check(files, args['mode'][0])
+
+
+if __name__ == "__main__":  # Executed only if run as a script
+    main_check()
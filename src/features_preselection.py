@@ -20,14 +20,22 @@
 import os
 import pickle
 import logging
+import tempfile
 import timeit
-from multiprocessing import Process, Queue
-import queue  # For the exception queue.Empty which is not in the multiprocessing package
+from multiprocessing import Queue
 
+import checkpoint
+import corpus_pack
 import features_extraction
+import metrics
+import sketches
+import workers_pool
 import utility
 
 
+POPULARITY = 11  # Features seen in at most POPULARITY files are not analyzed by chi2
+
+
 def handle_features_1file(unique_features_dict, all_features_dict):
     """ Fills a dict with the encountered features + the number of files they have been seen in.
     Case one file. """
@@ -48,12 +56,18 @@ def handle_features_1dir(samples_dir, label, analysis_path):
 
     pickle_path = os.path.join(analysis_path, '_all_features_' + label)
 
+    log = checkpoint.open_log('preselection', samples_dir, label)
+    if log is not None and log.complete:  # Already counted in pickle_path
+        logging.info('%s was already handled', samples_dir)
+        log.close()
+        return
+
     if os.path.isfile(pickle_path):
         all_features_dict = pickle.load(open(pickle_path, 'rb'))
     else:
         all_features_dict = dict()
 
-    analyses = get_features_all_files_multiproc(samples_dir)
+    analyses = get_features_all_files_multiproc(samples_dir, log)
 
     start = timeit.default_timer()
 
@@ -66,11 +80,79 @@ def handle_features_1dir(samples_dir, label, analysis_path):
                 logging.exception('Something went wrong with %s', analysis.file_path)
 
     pickle.dump(all_features_dict, open(pickle_path, 'wb'))
+    if log is not None:
+        log.close(complete=True)
+    utility.micro_benchmark('Total elapsed time:', timeit.default_timer() - start)
+
+
+def handle_features_sketch(samples_dirs, label, analysis_path, sketch_width):
+    """
+        Two-pass, bounded-memory alternative to handle_features_1dir for all directories with the
+        same label: only the features seen in more than POPULARITY files (the only ones used by
+        features_selection) are stored, with their exact number of files.
+        1st pass: the number of files each feature is seen in is estimated with a count-min
+        sketch, and the features of each file are spooled to a temporary file;
+        2nd pass: the features whose estimate is above POPULARITY are counted exactly.
+
+        -------
+        Parameters:
+        - samples_dirs: list of str
+            Directories (or packs) containing the JS files.
+        - label: str
+            Label of the files.
+        - analysis_path: str
+            Folder to store _all_features_<label> in (overwritten).
+        - sketch_width: int
+            Number of counters per row of the sketch.
+    """
+
+    if not os.path.exists(analysis_path):
+        os.makedirs(analysis_path)
+
+    sketch = sketches.CountMinSketch(sketch_width)
+    nb_files = 0
+    with tempfile.TemporaryFile(dir=analysis_path) as spool:
+        for samples_dir in samples_dirs:
+            print('Currently handling ' + samples_dir)
+            log = checkpoint.open_log('preselection', samples_dir, label)
+            for analysis in iter_features_all_files_multiproc(samples_dir, log):
+                if analysis.features is not None:
+                    features = list(analysis.features)
+                    sketch.add(features)
+                    pickle.dump(features, spool)
+                    nb_files += 1
+            if log is not None:
+                log.close(complete=True)
+
+        start = timeit.default_timer()
+        candidates_dict = dict()
+        spool.seek(0)
+        for _ in range(nb_files):
+            features = pickle.load(spool)
+            for feature, estimate in zip(features, sketch.estimate(features)):
+                if feature in candidates_dict:
+                    candidates_dict[feature] += 1
+                elif estimate > POPULARITY:
+                    candidates_dict[feature] = 1
+
+    all_features_dict = dict((feature, count) for feature, count in candidates_dict.items()
+                             if count > POPULARITY)
+    pickle.dump(all_features_dict, open(os.path.join(analysis_path, '_all_features_' + label),
+                                        'wb'))
+    print(str(len(all_features_dict)) + ' popular features out of ' + str(len(candidates_dict))
+          + ' candidates, for ' + str(sketch.total) + ' (file, feature) pairs')
     utility.micro_benchmark('Total elapsed time:', timeit.default_timer() - start)
 
 
-def handle_features_all(js_dirs, labels, analysis_path):
-    """ handle_features_1dir for a list of directories; TO CALL. """
+def handle_features_all(js_dirs, labels, analysis_path, sketch_width=None):
+    """ handle_features_1dir for a list of directories (or, with sketch_width,
+    handle_features_sketch per label); TO CALL. """
+
+    if sketch_width is not None:
+        for label in sorted(set(labels), key=labels.index):
+            handle_features_sketch([js_dir for i, js_dir in enumerate(js_dirs)
+                                    if labels[i] == label], label, analysis_path, sketch_width)
+        return
 
     for i, _ in enumerate(js_dirs):
         print('Currently handling ' + js_dirs[i])
@@ -91,58 +173,44 @@ class Analysis:
 def worker_get_features(my_queue, out_queue, except_queue):
     """ Worker to get the features."""
 
-    while True:
+    for analysis in workers_pool.iter_tasks(my_queue):
         try:
-            analysis = my_queue.get(timeout=2)
-            try:
+            with metrics.timer('file_seconds'):
                 features_dict, _ = features_extraction.get_features(analysis.file_path)
-                analysis.set_features(features_dict)
-                out_queue.put(analysis)  # To share modified analysis object between processes
-            except Exception as e:  # Handle exception occurring in the processes spawned
-                logging.error('Something went wrong with %s', analysis.file_path)
-                print(e)
-                except_queue.put([analysis.file_path, e])
-        except queue.Empty:  # Empty queue exception
-            break
+            analysis.set_features(features_dict)
+            out_queue.put(analysis)  # To share modified analysis object between processes
+        except Exception as e:  # Handle exception occurring in the processes spawned
+            logging.error('Something went wrong with %s', analysis.file_path)
+            print(e)
+            except_queue.put([analysis.file_path, e])
+            metrics.increment('files_failed')
+
+
+def get_features_all_files_multiproc(samples_dir, log=None):
+    """ Gets the features of all files from samples_dir (except the ones already in the
+    checkpoint log, whose results are reused). """
+
+    return list(iter_features_all_files_multiproc(samples_dir, log))
 
 
-def get_features_all_files_multiproc(samples_dir):
-    """ Gets the features of all files from samples_dir."""
+def iter_features_all_files_multiproc(samples_dir, log=None):
+    """ Same as get_features_all_files_multiproc, but yields the analyses as they arrive. """
 
     start = timeit.default_timer()
 
     my_queue = Queue()
     out_queue = Queue()
     except_queue = Queue()
-    workers = list()
 
-    for sample in os.listdir(samples_dir):
-        sample_path = os.path.join(samples_dir, sample)
-        analysis = Analysis(file_path=sample_path)
-        my_queue.put(analysis)
+    files = [sample_path for sample_path in corpus_pack.list_files(samples_dir)[0]  # Or pack
+             if log is None or log.todo(sample_path)]
+    workers_pool.put_tasks(my_queue, [Analysis(file_path=sample_path) for sample_path in files],
+                           files)  # Largest first
 
-    for i in range(utility.NUM_WORKERS):
-        p = Process(target=worker_get_features, args=(my_queue, out_queue, except_queue))
-        p.start()
-        workers.append(p)
-
-    analyses = list()
-
-    while True:
-        try:
-            analysis = out_queue.get(timeout=0.01)
-            analyses.append(analysis)
-        except queue.Empty:
-            pass
-        all_exited = True
-        for w in workers:
-            if w.exitcode is None:
-                all_exited = False
-                break
-        if all_exited & out_queue.empty():
-            break
+    if log is not None:
+        yield from log.records.values()
+    pool = workers_pool.start_workers(worker_get_features, (my_queue, out_queue, except_queue))
+    yield from workers_pool.iter_results(pool, out_queue, log)
 
     utility.micro_benchmark('Total elapsed time for features production:',
                             timeit.default_timer() - start)
-
-    return analyses
@@ -20,13 +20,15 @@
 import os
 import pickle
 import logging
-from multiprocessing import Process, Queue
-import queue  # For the exception queue.Empty which is not in the multiprocessing package
+from multiprocessing import Queue
 import timeit
 from scipy.stats import chi2_contingency
 from scipy.stats import chi2 as _chi2
 
+import checkpoint
+import corpus_pack
 import features_preselection
+import workers_pool
 import utility
 
 
@@ -34,7 +36,8 @@ def get_popular_features(all_features_dict):
     """ Gets the features used more than one time. """
     popular_features = dict()
     for k, v in all_features_dict.items():
-        if v > 11:  # Tested with chi2, to ensure that feature and classification are dependent
+        # Tested with chi2, to ensure that feature and classification are dependent
+        if v > features_preselection.POPULARITY:
             popular_features[k] = v
     return popular_features
 
@@ -117,7 +120,8 @@ def analyze_features_all(all_features_dict1, all_features_dict2, samples_dir_lis
     analyzed_features_dict = initialize_analyzed_features_dict(all_features_dict1,
                                                                all_features_dict2)
 
-    analyses = get_features_all_files_multiproc(samples_dir_list, labels_list)
+    log = checkpoint.open_log('selection', samples_dir_list, labels_list)
+    analyses = get_features_all_files_multiproc(samples_dir_list, labels_list, log)
 
     start = timeit.default_timer()
 
@@ -128,6 +132,8 @@ def analyze_features_all(all_features_dict1, all_features_dict2, samples_dir_lis
             analyze_features(analyzed_features_dict, features_dict, label)
 
     pickle.dump(analyzed_features_dict, open(pickle_path, 'wb'))
+    if log is not None:
+        log.close(complete=True)
 
     utility.micro_benchmark('Total elapsed time:', timeit.default_timer() - start)
     return analyzed_features_dict
@@ -213,9 +219,10 @@ def store_features_all(js_dirs_validate, labels_validate, analysis_path,
                    analyzed_features_path, chi_confidence)
 
 
-def get_features_all_files_multiproc(samples_dir_list, labels_list):
+def get_features_all_files_multiproc(samples_dir_list, labels_list, log=None):
     """
-        Gets the features of all files from samples_dir_list.
+        Gets the features of all files from samples_dir_list (except the ones already in the
+        checkpoint log, whose results are reused).
     """
 
     start = timeit.default_timer()
@@ -223,37 +230,22 @@ def get_features_all_files_multiproc(samples_dir_list, labels_list):
     my_queue = Queue()
     out_queue = Queue()
     except_queue = Queue()
-    workers = list()
 
+    analyses = list()
     for i, _ in enumerate(samples_dir_list):
         samples_dir = samples_dir_list[i]
         label = labels_list[i]
-        for sample in os.listdir(samples_dir):
-            sample_path = os.path.join(samples_dir, sample)
-            analysis = features_preselection.Analysis(file_path=sample_path, label=label)
-            my_queue.put(analysis)
-
-    for i in range(utility.NUM_WORKERS):
-        p = Process(target=features_preselection.worker_get_features, args=(my_queue, out_queue,
-                                                                            except_queue))
-        p.start()
-        workers.append(p)
-
-    analyses = list()
-
-    while True:
-        try:
-            analysis = out_queue.get(timeout=0.01)
-            analyses.append(analysis)
-        except queue.Empty:
-            pass
-        all_exited = True
-        for w in workers:
-            if w.exitcode is None:
-                all_exited = False
-                break
-        if all_exited & out_queue.empty():
-            break
+        for sample_path in corpus_pack.list_files(samples_dir)[0]:  # Folder or pack
+            if log is None or log.todo(sample_path):
+                analyses.append(features_preselection.Analysis(file_path=sample_path,
+                                                               label=label))
+    workers_pool.put_tasks(my_queue, analyses, [analysis.file_path for analysis in analyses])
+
+    pool = workers_pool.start_workers(features_preselection.worker_get_features,
+                                      (my_queue, out_queue, except_queue))
+    analyses = workers_pool.get_results(pool, out_queue, log)
+    if log is not None:
+        analyses = list(log.records.values()) + analyses
 
     utility.micro_benchmark('Total elapsed time for features production:',
                             timeit.default_timer() - start)
@@ -0,0 +1,355 @@
+# Copyright (C) 2019 Aurore Fass
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+    Mergeable count shards, to split the features preselection and selection over several nodes.
+
+    A shard is a text file: a JSON header, then one line per feature, sorted by the JSON encoding
+    of the feature, with the corresponding counts (tab-separated). Two kinds of shards:
+        * 'df': number of files each feature appears in, for one label
+          (same content as _all_features_<label>);
+        * 'contingency': number of benign and malicious files each feature appears in
+          (from which _analyzed_features_ is computed).
+    Shards can be merged with a streaming k-way merge, and exported to the pickles used by
+    features_selection.select_features.
+"""
+
+import os
+import json
+import heapq
+import pickle
+import logging
+import argparse
+import itertools
+
+import cpu_budget
+import features_preselection
+import features_selection
+import features_values
+import utility
+
+
+SHARD_FORMAT = 'jsdetector-shard'
+SHARD_VERSION = 1
+LABELS = ['benign', 'malicious']
+
+
+def encode_feature(feature):
+    """ Canonical, sortable encoding of a feature (context, value). Booleans are encoded as ints,
+    as True == 1 and False == 0 are the same dict key in Python. """
+
+    context, value = feature
+    if isinstance(value, bool):
+        value = int(value)
+    return json.dumps([context, value], ensure_ascii=True)
+
+
+def decode_feature(key):
+    context, value = json.loads(key)
+    return context, value
+
+
+def write_shard(shard_path, kind, files, records, label=None, policy=None):
+    """
+        Writes a shard.
+
+        -------
+        Parameters:
+        - shard_path: str
+            Path of the shard.
+        - kind: str
+            'df' or 'contingency'.
+        - files: dict
+            Number of files analyzed, per label.
+        - records: iterable
+            (encoded feature, list of counts), sorted by encoded feature.
+        - label: str
+            Label of the files, for 'df' shards.
+        - policy: dict
+            Values policy the features were counted with (default: the current one).
+    """
+
+    header = {'format': SHARD_FORMAT, 'version': SHARD_VERSION, 'kind': kind, 'label': label,
+              'files': files, 'policy': policy or features_values.get_policy()}
+    with open(shard_path + '.tmp', 'w', encoding='ascii') as shard:
+        shard.write(json.dumps(header, sort_keys=True) + '\n')
+        for key, counts in records:
+            shard.write(key + '\t' + '\t'.join(str(count) for count in counts) + '\n')
+    os.replace(shard_path + '.tmp', shard_path)
+
+
+def read_header(shard_path):
+    with open(shard_path, encoding='ascii') as shard:
+        header = json.loads(shard.readline())
+    if header.get('format') != SHARD_FORMAT or header.get('version') != SHARD_VERSION:
+        raise ValueError('%s is not a version %s shard' % (shard_path, SHARD_VERSION))
+    return header
+
+
+def get_policy(headers):
+    """ Values policy shared by the shards of headers (full values for the shards without
+    one). """
+
+    policies = set(json.dumps(header.get('policy'), sort_keys=True) for header in headers)
+    if len(policies) != 1:
+        raise ValueError('Cannot combine shards counted with different values policies: %s'
+                         % policies)
+    return headers[0].get('policy') or {'values': 'full', 'max_length': None,
+                                         'number_buckets': False}
+
+
+def read_records(shard_path):
+    """ Iterates over the (encoded feature, list of counts) of a shard, without loading it. """
+
+    with open(shard_path, encoding='ascii') as shard:
+        shard.readline()  # Header
+        for line in shard:
+            key, *counts = line.rstrip('\n').split('\t')
+            yield key, [int(count) for count in counts]
+
+
+def sorted_records(counts_dict):
+    """ Records of a dict feature: counts, sorted and with the same features summed up. """
+
+    records = dict()
+    for feature, counts in counts_dict.items():
+        key = encode_feature(feature)
+        if key in records:
+            records[key] = [a + b for a, b in zip(records[key], counts)]
+        else:
+            records[key] = list(counts)
+    return sorted(records.items())
+
+
+def merge_records(shard_paths):
+    """ Streaming k-way merge of the records of shards of the same kind. """
+
+    merged = heapq.merge(*[read_records(shard_path) for shard_path in shard_paths],
+                         key=lambda record: record[0])
+    for key, group in itertools.groupby(merged, key=lambda record: record[0]):
+        counts = None
+        for _, record_counts in group:
+            counts = record_counts if counts is None\
+                else [a + b for a, b in zip(counts, record_counts)]
+        yield key, counts
+
+
+def merge_shards(shard_paths, merged_path):
+    """ Merges shards of the same kind (and label, for 'df' shards) into merged_path. """
+
+    headers = [read_header(shard_path) for shard_path in shard_paths]
+    kinds = set((header['kind'], header['label']) for header in headers)
+    if len(kinds) != 1:
+        raise ValueError('Cannot merge shards of different kinds or labels: %s' % kinds)
+    kind, label = kinds.pop()
+
+    files = dict()
+    for header in headers:
+        for file_label, nb_files in header['files'].items():
+            files[file_label] = files.get(file_label, 0) + nb_files
+
+    write_shard(merged_path, kind, files, merge_records(shard_paths), label=label,
+                policy=get_policy(headers))
+    logging.info('Merged %s shards into %s', str(len(shard_paths)), merged_path)
+
+
+def count_df(samples_dir, label, shard_path):
+    """ Node side: df shard of all files from samples_dir (cf. handle_features_1dir). """
+
+    analyses = features_preselection.get_features_all_files_multiproc(samples_dir)
+    all_features_dict = dict()
+    nb_files = 0
+    for analysis in analyses:
+        if analysis.features is not None:
+            features_preselection.handle_features_1file(analysis.features, all_features_dict)
+            nb_files += 1
+
+    write_shard(shard_path, 'df', {label: nb_files},
+                sorted_records(dict((feature, [count])
+                                    for feature, count in all_features_dict.items())),
+                label=label)
+
+
+def count_contingency(samples_dir_list, labels_list, shard_path):
+    """ Node side: contingency shard of all files from samples_dir_list
+    (cf. analyze_features_all, but for all features, as the popular ones are only known
+    once all df shards are merged). """
+
+    analyses = features_selection.get_features_all_files_multiproc(samples_dir_list, labels_list)
+    with_features_dict = dict()
+    files = dict((label, 0) for label in LABELS)
+    for analysis in analyses:
+        if analysis.features is None:
+            continue
+        if analysis.label not in LABELS:
+            logging.error("The label should be 'benign' or 'malicious, got %s", analysis.label)
+            continue
+        files[analysis.label] += 1
+        i = LABELS.index(analysis.label)
+        for feature in analysis.features:
+            if feature not in with_features_dict:
+                with_features_dict[feature] = [0, 0]
+            with_features_dict[feature][i] += 1
+
+    write_shard(shard_path, 'contingency', files, sorted_records(with_features_dict))
+
+
+def export_shards(shard_paths, analysis_path, chi_confidence=99.9):
+    """
+        Builds, from df and contingency shards, the same pickles as a single-node run:
+        _all_features_<label>, _analyzed_features_ and _selected_features_ in analysis_path.
+
+        -------
+        Parameters:
+        - shard_paths: list of str
+            df shards (benign and malicious) and contingency shards. Several shards of the same
+            kind are merged on the fly.
+        - analysis_path: str
+            Folder to store the pickles in.
+        - chi_confidence: float
+            Confidence of the chi2 test, in percent.
+    """
+
+    if not os.path.exists(analysis_path):
+        os.makedirs(analysis_path)
+
+    by_kind = dict()
+    headers = list()
+    for shard_path in shard_paths:
+        header = read_header(shard_path)
+        headers.append(header)
+        by_kind.setdefault((header['kind'], header['label']), list()).append(shard_path)
+    policy = get_policy(headers)
+    features_values.configure(policy['values'], policy['max_length'], policy['number_buckets'])
+    features_values.store_policy(analysis_path)
+
+    all_features_dicts = dict()
+    for label in LABELS:
+        all_features_dict = dict()
+        for key, counts in merge_records(by_kind.get(('df', label), [])):
+            feature = decode_feature(key)
+            all_features_dict[feature] = all_features_dict.get(feature, 0) + counts[0]
+        all_features_dicts[label] = all_features_dict
+        if ('df', label) in by_kind:
+            pickle.dump(all_features_dict,
+                        open(os.path.join(analysis_path, '_all_features_' + label), 'wb'))
+
+    if ('contingency', None) not in by_kind:
+        logging.warning('No contingency shard given, _analyzed_features_ not produced')
+        return None
+
+    files = dict((label, 0) for label in LABELS)
+    for shard_path in by_kind[('contingency', None)]:
+        for label, nb_files in read_header(shard_path)['files'].items():
+            files[label] += nb_files
+
+    # Same initialization as features_selection.initialize_analyzed_features_dict
+    analyzed_features_dict = features_selection.initialize_analyzed_features_dict(
+        all_features_dicts['benign'], all_features_dicts['malicious'])
+    for feature in analyzed_features_dict:
+        analyzed_features_dict[feature] = [0, files['benign'], 0, files['malicious']]
+
+    for key, (ben_with_f, mal_with_f) in merge_records(by_kind[('contingency', None)]):
+        feature = decode_feature(key)
+        if feature in analyzed_features_dict:
+            counts = analyzed_features_dict[feature]
+            counts[0] += ben_with_f
+            counts[1] -= ben_with_f
+            counts[2] += mal_with_f
+            counts[3] -= mal_with_f
+
+    pickle.dump(analyzed_features_dict,
+                open(os.path.join(analysis_path, '_analyzed_features_'), 'wb'))
+
+    selected_features_dict = features_selection.select_features(analyzed_features_dict,
+                                                                chi_confidence)
+    pickle.dump(selected_features_dict,
+                open(os.path.join(analysis_path, '_selected_features_'), 'wb'))
+    logging.info('Selected %s features out of %s', str(len(selected_features_dict)),
+                 str(len(analyzed_features_dict)))
+
+    return selected_features_dict
+
+
+def parsing_commands():
+    """
+        Creation of an ArgumentParser object, holding all the information necessary to parse
+        the command line into Python data types.
+    """
+
+    parser = argparse.ArgumentParser(description='Produces, merges and exports mergeable count '
+                                                 + 'shards for the features (pre)selection.')
+
+    mode = parser.add_mutually_exclusive_group(required=True)
+    mode.add_argument('--count', metavar='KIND', type=str, nargs=1,
+                      choices=['df', 'contingency'],
+                      help='counts the features of the JS directories --d into a shard: df '
+                           + '(1 directory, training set) or contingency (1 benign and 1 '
+                           + 'malicious directory, validation set)')
+    mode.add_argument('--merge', metavar='SHARD', type=str, nargs='+',
+                      help='merges shards of the same kind into the shard --o')
+    mode.add_argument('--export', metavar='SHARD', type=str, nargs='+',
+                      help='exports df and contingency shards into _all_features_<label>, '
+                           + '_analyzed_features_ and _selected_features_ in '
+                           + 'ANALYSIS_PATH/Features')
+    parser.add_argument('--d', metavar='DIR', type=str, nargs='+',
+                        help='directories containing the JS files to count the features of')
+    parser.add_argument('--l', metavar='LABEL', type=str, nargs='+', choices=LABELS,
+                        help='labels of the JS directories')
+    parser.add_argument('--o', metavar='SHARD', type=str, nargs=1,
+                        help='shard to produce')
+    parser.add_argument('--chi', metavar='CONFIDENCE', type=float, nargs=1, default=[99.9],
+                        help='confidence of the chi2 test in percent, for --export')
+    utility.parsing_commands(parser)
+
+    return vars(parser.parse_args())
+
+
+def main_shards():
+    """ Main function, produces, merges or exports shards. """
+
+    args = parsing_commands()
+    utility.control_logger(args['v'][0])
+    cpu_budget.configure(args['cpus'][0])
+    utility.configure_extraction(args)
+    features_values.configure(args['values'][0], args['max_value_length'][0],
+                              args['number_buckets'][0])
+
+    if args['export'] is not None:
+        export_shards(args['export'], os.path.join(args['analysis_path'][0], 'Features'),
+                      chi_confidence=args['chi'][0])
+
+    elif args['o'] is None:
+        logging.error('Please, indicate the shard to produce with --o')
+
+    elif args['merge'] is not None:
+        merge_shards(args['merge'], args['o'][0])
+
+    elif args['d'] is None or args['l'] is None or len(args['d']) != len(args['l']):
+        logging.error('Please, indicate the JS directories to count the features of, with as '
+                      + 'many labels')
+
+    elif args['count'][0] == 'df':
+        if len(args['d']) != 1:
+            logging.error('Please, indicate 1 directory for a df shard, got %s',
+                          str(len(args['d'])))
+        else:
+            count_df(args['d'][0], args['l'][0], args['o'][0])
+
+    else:
+        count_contingency(args['d'], args['l'], args['o'][0])
+
+
+if __name__ == "__main__":  # Executed only if run as a script
+    main_shards()
@@ -21,6 +21,9 @@ import numpy as np
 from scipy.sparse import csr_matrix
 
 import features_extraction
+import features_ids
+import metrics
+import vocabulary
 
 
 def features2int(features2int_dict, feature):
@@ -49,17 +52,89 @@ def features_vector(input_file, nb_features, features2int_dict):
     """ Builds a vector so that the probability of occurrences of a feature is stored at the
     corresponding position in the vector space. """
 
+    if features_ids.enabled(features2int_dict):  # Vocabulary walk, cf. features_ids.py
+        positions, total_features = features_ids.get_positions(input_file, features2int_dict)
+        if positions is not None:
+            with metrics.timer('features_vector_seconds'):
+                return positions_vector(positions, total_features, nb_features)
+        return None
+
     features_dict, total_features = features_extraction.get_features(input_file)
     if features_dict is not None:
-        features_vect = np.zeros(nb_features + 1)
-        for feature in features_dict:
+        with metrics.timer('features_vector_seconds'):
+            return features_dict_vector(features_dict, total_features, nb_features,
+                                        features2int_dict)
+    return None
+
+
+def features_dict_vector(features_dict, total_features, nb_features, features2int_dict):
+    """ Same as features_vector, but from already extracted features. features2int_dict may also
+    be a vocabulary.Vocabulary. """
+
+    if isinstance(features2int_dict, vocabulary.Vocabulary):
+        return vocabulary_vector(features_dict, total_features, nb_features, features2int_dict)
+
+    features_vect = np.zeros(nb_features + 1)
+    for feature in features_dict:
+        map_feature2int = features2int(features2int_dict, feature)
+        if map_feature2int is not None:
+            features_vect[map_feature2int] = features_dict[feature] / total_features
+            # Features appear only once in "features", so done only once per feature
+    csr = csr_matrix(features_vect)
+    if csr.nnz == 0:  # Empty matrix, no known features
+        features_vect[nb_features] = 1  # Because cannot concatenate empty CSR matrices
+        csr = csr_matrix(features_vect)
+    return csr
+
+
+def vocabulary_vector(features_dict, total_features, nb_features, features_vocabulary):
+    """ features_dict_vector with a vocabulary.Vocabulary: same CSR row, built from the
+    positions of all features at once. """
+
+    features = list(features_dict)
+    positions = features_vocabulary.lookup(features)
+    known = np.flatnonzero(positions >= 0)
+    if not len(known):  # Empty matrix, no known features
+        return csr_matrix((np.ones(1), np.array([nb_features], dtype=np.int32), [0, 1]),
+                          shape=(1, nb_features + 1))
+    order = known[np.argsort(positions[known])]
+    data = np.array([features_dict[features[i]] for i in order], dtype=np.float64)\
+        / total_features
+    return csr_matrix((data, positions[order].astype(np.int32), [0, len(order)]),
+                      shape=(1, nb_features + 1))
+
+
+def positions_vector(positions, total_features, nb_features):
+    """ vocabulary_vector from the positions of the known features, once per occurrence (cf.
+    features_ids.get_positions). """
+
+    if not len(positions):  # Empty matrix, no known features
+        return csr_matrix((np.ones(1), np.array([nb_features], dtype=np.int32), [0, 1]),
+                          shape=(1, nb_features + 1))
+    columns, occurrences = np.unique(positions, return_counts=True)
+    return csr_matrix((occurrences.astype(np.float64) / total_features,
+                       columns.astype(np.int32), [0, len(columns)]), shape=(1, nb_features + 1))
+
+
+def features_matrix(features_dicts, features2int_dict):
+    """ Builds directly the CSR matrix of already extracted features (one features dict per row),
+    with the same values as stacking their features_dict_vector. """
+
+    nb_features = len(features2int_dict)
+    data, indices, indptr = list(), list(), [0]
+    for features_dict in features_dicts:
+        total_features = sum(features_dict.values())
+        row = dict()
+        for feature, count in features_dict.items():
             map_feature2int = features2int(features2int_dict, feature)
             if map_feature2int is not None:
-                features_vect[map_feature2int] = features_dict[feature] / total_features
-                # Features appear only once in "features", so done only once per feature
-        csr = csr_matrix(features_vect)
-        if csr.nnz == 0:  # Empty matrix, no known features
-            features_vect[nb_features] = 1  # Because cannot concatenate empty CSR matrices
-            csr = csr_matrix(features_vect)
-        return csr
-    return None
+                row[map_feature2int] = count / total_features
+        if not row:  # Empty row, no known features
+            row[nb_features] = 1
+        for i in sorted(row):
+            indices.append(i)
+            data.append(row[i])
+        indptr.append(len(indices))
+    return csr_matrix((np.array(data, dtype=np.float64), np.array(indices, dtype=np.int32),
+                       np.array(indptr, dtype=np.int64)),
+                      shape=(len(features_dicts), nb_features + 1))
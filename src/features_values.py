@@ -0,0 +1,264 @@
+# Copyright (C) 2019 Aurore Fass
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+    Policy bounding the values of the (context, value) features: the long literals and
+    identifiers are truncated or hashed to a fixed-size digest, and the numeric literals may be
+    bucketed by order of magnitude. The policy used to build the features is stored with them
+    (_value_policy_), so that the classification uses the same one.
+    Running this module reports the number of features, the pickle sizes and the
+    cross-validated accuracy of each policy on a corpus.
+"""
+
+import os
+import math
+import pickle
+import hashlib
+import logging
+import argparse
+
+import numpy as np
+
+import cpu_budget
+import features_preselection
+import features_selection
+import features_space
+import sweep
+import utility
+
+
+VALUES = 'full'  # 'full', 'truncate' or 'hash' the values longer than MAX_LENGTH
+MAX_LENGTH = 64  # Characters
+NUMBER_BUCKETS = False  # Buckets the numbers by order of magnitude
+SMALL_NUMBER = 256  # Integers below it (e.g. char codes) are kept as they are
+
+POLICY_FILE = '_value_policy_'
+
+
+def configure(values, max_length=MAX_LENGTH, number_buckets=False):
+    """ Sets the policy used by bound_value. """
+
+    global VALUES, MAX_LENGTH, NUMBER_BUCKETS
+    VALUES = values
+    MAX_LENGTH = max_length or MAX_LENGTH
+    NUMBER_BUCKETS = number_buckets
+
+
+def get_policy():
+    return {'values': VALUES, 'max_length': MAX_LENGTH if VALUES != 'full' else None,
+            'number_buckets': NUMBER_BUCKETS}
+
+
+def enabled(policy=None):
+    """ Whether the current policy (or the one given) changes some values. """
+
+    if policy is not None:
+        return policy['values'] != 'full' or policy['number_buckets']
+    return VALUES != 'full' or NUMBER_BUCKETS
+
+
+def store_policy(features_path):
+    """ Stores the current policy with the features, in features_path. """
+
+    if not os.path.exists(features_path):
+        os.makedirs(features_path)
+    pickle.dump(get_policy(), open(os.path.join(features_path, POLICY_FILE), 'wb'))
+
+
+def read_policy(features_path):
+    """ Policy the features of features_path were built with (full values if none was
+    stored). """
+
+    policy_path = os.path.join(features_path, POLICY_FILE)
+    if os.path.isfile(policy_path):
+        return pickle.load(open(policy_path, 'rb'))
+    return {'values': 'full', 'max_length': None, 'number_buckets': False}
+
+
+def load_policy(features_path):
+    """ Configures the policy the features of features_path were built with. """
+
+    policy = read_policy(features_path)
+    configure(policy['values'], policy['max_length'], policy['number_buckets'])
+
+
+def bucket_number(value):
+    """ Order of magnitude of a number, e.g. 'int:1e4' for 12345 or 'float:-1e-2' for -0.05. """
+
+    if (abs(value) < SMALL_NUMBER and float(value).is_integer()) or not math.isfinite(value):
+        return value
+    kind = 'int' if float(value).is_integer() else 'float'
+    sign = '-' if value < 0 else ''
+    return kind + ':' + sign + '1e' + str(math.floor(math.log10(abs(value))))
+
+
+def bound_value(value, values=None, max_length=None, number_buckets=None):
+    """ Value of a feature under the current policy (or the one given). """
+
+    values = values or VALUES
+    if isinstance(value, str):
+        if values == 'full' or len(value) <= (max_length or MAX_LENGTH):
+            return value
+        if values == 'truncate':
+            return value[:max_length or MAX_LENGTH]
+        digest = hashlib.blake2b(value.encode('utf-8', errors='surrogatepass'), digest_size=8)
+        return 'hash:' + digest.hexdigest()  # Same digest for the same long value
+    if isinstance(value, (int, float)) and not isinstance(value, bool)\
+            and (NUMBER_BUCKETS if number_buckets is None else number_buckets):
+        return bucket_number(value)
+    return value
+
+
+def bound_features(features_dict, **policy):
+    """ Features dict (feature: number of occurrences) under the current policy (or the one
+    given), the occurrences of the features merged being summed up. """
+
+    bounded_dict = dict()
+    for (context, value), occurrences in features_dict.items():
+        feature = (context, bound_value(value, **policy))
+        bounded_dict[feature] = bounded_dict.get(feature, 0) + occurrences
+    return bounded_dict
+
+
+def compare(raw_features, policies, confidence=99.9, clf_choice='RF', estimators=100, folds=5):
+    """
+        Compares value policies on features extracted with full values.
+
+        -------
+        Parameters:
+        - raw_features: list
+            (file path, label, features dict) of the files, as given by sweep.get_raw_features.
+        - policies: list of dict
+            Arguments of bound_value.
+        - confidence: float
+            Confidence of the chi2 test used to select the features, in percent. The features
+            are selected on the whole corpus.
+        - clf_choice: str
+            Classifier.
+        - estimators: int
+            Number of trees, for RF.
+        - folds: int
+            Number of folds of the cross-validation.
+
+        -------
+        Returns:
+        - list of dict
+            Number of distinct features, pickle sizes and accuracy per policy.
+    """
+
+    labels = np.array([label for _, label, _ in raw_features])
+    results = list()
+    for policy in policies:
+        features_dicts = [bound_features(features_dict, **policy)
+                          for _, _, features_dict in raw_features]
+        all_features_dicts = {'benign': dict(), 'malicious': dict()}  # As _all_features_
+        for features_dict, label in zip(features_dicts, labels):  # Number of files per feature
+            features_preselection.handle_features_1file(features_dict, all_features_dicts[label])
+
+        analyzed_features_dict = features_selection.initialize_analyzed_features_dict(
+            all_features_dicts['benign'], all_features_dicts['malicious'])
+        for features_dict, label in zip(features_dicts, labels):
+            features_selection.analyze_features(analyzed_features_dict, features_dict, label)
+        features2int_dict = features_selection.select_features(analyzed_features_dict,
+                                                               confidence)
+        attributes = features_space.features_matrix(features_dicts, features2int_dict)
+
+        result = sweep.cross_validate(attributes, labels, clf_choice, estimators, folds)
+        result.update({
+            'policy': policy,
+            'features': len(set(all_features_dicts['benign'])
+                            | set(all_features_dicts['malicious'])),
+            'all_features_size': sum(len(pickle.dumps(all_features_dict))
+                                     for all_features_dict in all_features_dicts.values()),
+            'files_features_size': sum(len(pickle.dumps(features_dict))
+                                       for features_dict in features_dicts),
+            'selected_features': len(features2int_dict)})
+        results.append(result)
+
+    print('%28s %10s %16s %18s %9s %10s' % ('policy', 'features', '_all_features_ (B)',
+                                             'per-file dicts (B)', 'selected', 'accuracy'))
+    for result in results:
+        policy = result['policy']
+        name = policy['values'] + ('' if policy['values'] == 'full'
+                                   else '/' + str(policy['max_length']))\
+            + (' +buckets' if policy['number_buckets'] else '')
+        print('%28s %10d %16d %18d %9d %10.4f'
+              % (name, result['features'], result['all_features_size'],
+                 result['files_features_size'], result['selected_features'],
+                 result['accuracy']))
+    return results
+
+
+def parsing_commands():
+    """
+        Creation of an ArgumentParser object, holding all the information necessary to parse
+        the command line into Python data types.
+    """
+
+    parser = argparse.ArgumentParser(description='Compares the features values policies: '
+                                                 + 'number of features, pickle sizes and '
+                                                 + 'accuracy.')
+
+    parser.add_argument('--d', metavar='DIR', type=str, nargs='+',
+                        help='directories containing the JS files to compare the policies on')
+    parser.add_argument('--l', metavar='LABEL', type=str, nargs='+',
+                        choices=['benign', 'malicious'], help='labels of the JS directories')
+    parser.add_argument('--cache', metavar='FILE', type=str, nargs=1, default=[None],
+                        help='cache of the raw features (default: '
+                             + 'ANALYSIS_PATH/Sweep/_raw_features_)')
+    parser.add_argument('--lengths', metavar='CHARS', type=int, nargs='+', default=[16, 64, 256],
+                        help='maximum lengths of the values to compare')
+    parser.add_argument('--chi', metavar='CONFIDENCE', type=float, nargs=1, default=[99.9],
+                        help='confidence of the chi2 test, in percent')
+    parser.add_argument('--clf', metavar='CLASSIFIER', type=str, nargs=1, default=['RF'],
+                        choices=['RF', 'BNB', 'MNB'], help='classifier')
+    parser.add_argument('--k', metavar='FOLDS', type=int, nargs=1, default=[5],
+                        help='number of folds')
+    utility.parsing_commands(parser)
+
+    return vars(parser.parse_args())
+
+
+def main_compare():
+    """ Main function, compares the policies. """
+
+    args = parsing_commands()
+    utility.control_logger(args['v'][0])
+    cpu_budget.configure(args['cpus'][0])
+    utility.configure_extraction(args)
+    cache_path = args['cache'][0]\
+        or os.path.join(args['analysis_path'][0], 'Sweep', '_raw_features_')
+
+    if not os.path.isfile(cache_path) and (args['d'] is None or args['l'] is None
+                                           or len(args['d']) != len(args['l'])):
+        logging.error('Please, indicate the JS directories to compare the policies on, with as '
+                      + 'many labels')
+        return
+
+    raw_features = sweep.get_raw_features(args['d'], args['l'], cache_path)  # Full values
+    if raw_features is None:
+        return
+    policies = [{'values': 'full', 'max_length': None, 'number_buckets': False}]
+    for values in ['truncate', 'hash']:
+        for max_length in args['lengths']:
+            policies.append({'values': values, 'max_length': max_length,
+                             'number_buckets': False})
+    policies.append({'values': 'hash', 'max_length': min(args['lengths']),
+                     'number_buckets': True})
+    compare(raw_features, policies, confidence=args['chi'][0], clf_choice=args['clf'][0],
+            folds=args['k'][0])
+
+
+if __name__ == "__main__":  # Executed only if run as a script
+    main_compare()
@@ -24,16 +24,123 @@ var esprima = require("esprima");
 var fs = require("fs");
 
 
+// Kinds of the values of the columnar encoding, cf. ast_columnar.py
+var NO_VALUE = 0, STRING = 1, NUMBER = 2, TRUE = 3, FALSE = 4, NULL = 5;
+
+
+/**
+ * Columnar binary encoding of the nodes of an AST, in the order (depth-first, children in the
+ * order of the keys of their parent) and with the values of the Node objects built from its
+ * JSON by ast_generation.py, cf. ast_columnar.py for the layout.
+ *
+ * @param ast: Esprima AST.
+ * @returns {Buffer}
+ */
+function columnar(ast) {
+    var table = [], indexes = new Map();
+    var types = [], parents = [], ends = [], kinds = [], values = [];
+
+    function intern(string) {
+        var index = indexes.get(string);
+        if (index === undefined) {
+            index = table.length;
+            indexes.set(string, index);
+            table.push(string);
+        }
+        return index;
+    }
+
+    function isNode(value) {
+        return value !== null && typeof value === 'object' && !Array.isArray(value)
+            && value.type !== undefined;
+    }
+
+    function setValue(i, value) {
+        if (typeof value === 'string') {
+            kinds[i] = STRING;
+            values[i] = intern(value);
+        } else if (typeof value === 'number') {
+            if (isFinite(value)) {  // JSON text, so that Python gets the same int or float
+                kinds[i] = NUMBER;
+                values[i] = intern(JSON.stringify(value));
+            } else {  // null in JSON
+                kinds[i] = NULL;
+            }
+        } else if (typeof value === 'boolean') {
+            kinds[i] = value ? TRUE : FALSE;
+        } else if (value === null) {
+            kinds[i] = NULL;
+        }  // RegExp: {} in JSON, not a value
+    }
+
+    function visit(node, parent) {
+        var i = types.length;
+        types.push(intern(node.type));
+        parents.push(parent);
+        ends.push(0);
+        kinds.push(NO_VALUE);
+        values.push(-1);
+        if (node.type === 'Identifier') {
+            setValue(i, node.name);
+        } else if (node.type === 'Literal') {
+            setValue(i, node.value);
+        }
+        var keys = Object.keys(node);
+        for (var k = 0; k < keys.length; k++) {
+            var child = node[keys[k]];
+            if (Array.isArray(child)) {
+                for (var j = 0; j < child.length; j++) {
+                    if (isNode(child[j])) {
+                        visit(child[j], i);
+                    }
+                }
+            } else if (keys[k] !== 'range' && isNode(child)) {
+                visit(child, i);
+            }
+        }
+        ends[i] = types.length;
+    }
+
+    visit({type: ast.type, body: ast.body}, -1);  // Tokens and comments are not nodes
+
+    var nbNodes = types.length;
+    var offsets = new Uint32Array(table.length + 1);
+    for (var s = 0; s < table.length; s++) {
+        offsets[s + 1] = offsets[s] + table[s].length;  // UTF-16 code units
+    }
+    var header = Buffer.alloc(20);
+    header.write('JSDCOL01', 0, 'ascii');
+    header.writeUInt32LE(nbNodes, 8);
+    header.writeUInt32LE(table.length, 12);
+    header.writeUInt32LE(offsets[table.length], 16);
+    return Buffer.concat([header,
+        Buffer.from(Int32Array.from(types).buffer), Buffer.from(Int32Array.from(parents).buffer),
+        Buffer.from(Int32Array.from(ends).buffer), Buffer.from(Int32Array.from(values).buffer),
+        Buffer.from(offsets.buffer), Buffer.from(Uint8Array.from(kinds).buffer),
+        Buffer.from(table.join(''), 'utf16le')]);  // Lone surrogates kept
+}
+
+
 /**
  * Extraction of the AST of an input JS file using Esprima.
  *
- * @param js
- * @param json_path
+ * @param js: path of the JS file, or '-' to read it from stdin.
+ * @param json_path: path of the JSON file to store the AST in, '-' to write it to stdout, or '1'
+ * to print the node and token types to stdout.
+ * @param format: 'columnar' to write the AST to stdout in the columnar binary encoding, with
+ * json_path '-'.
  * @returns {*}
  */
-function js2ast(js, json_path) {
-    var text = fs.readFileSync(js).toString('utf-8');
-    var ast = esprima.parse(text, {range: true, tokens: true, comment: true}, function (node) {
+function js2ast(js, json_path, format) {
+    var text = fs.readFileSync(js === '-' ? 0 : js).toString('utf-8');
+    var ast;
+    if (json_path === '-') {
+        ast = esprima.parse(text, {range: true, tokens: true, comment: true});
+        process.stdout.write(format === 'columnar' ? columnar(ast) : JSON.stringify(ast));
+        return ast;
+    }
+
+    ast = esprima.parse(text, {range: true, tokens: true, comment: true}, function (node) {
         console.log(node.type);
     });
     console.log('##!!**##');
@@ -52,4 +159,4 @@ function js2ast(js, json_path) {
     }
 }
 
-js2ast(process.argv[2], process.argv[3]);
+js2ast(process.argv[2], process.argv[3], process.argv[4]);
@@ -18,8 +18,12 @@
 
 import argparse
 
+import checkpoint
+import cpu_budget
 import machine_learning
+import features_values
 import analysis
+import matrix_store
 
 from features_preselection import *
 from features_selection import *
@@ -122,6 +126,14 @@ def parsing_commands():
                         default=[500], help='number of trees in the forest')
     parser.add_argument('--clf', metavar='CLASSIFIER', type=str, nargs=1,
                         choices=['RF', 'BNB', 'MNB'], help='classifier choice')
+    parser.add_argument('--save_matrix', metavar='DIR', type=str, nargs=1, default=[None],
+                        help='folder to store the features matrix, names and labels in')
+    parser.add_argument('--load_matrix', metavar='DIR', type=str, nargs=1, default=[None],
+                        help='folder to load a features matrix from, instead of analyzing the '
+                             + 'JS folders')
+    parser.add_argument('--sketch', metavar='COUNTERS', type=int, nargs=1, default=[None],
+                        help='preselects the features in bounded memory with a count-min sketch '
+                             + 'of COUNTERS counters per row (e.g. 4194304), in 2 passes')
 
     utility.parsing_commands(parser)
 
@@ -130,12 +142,19 @@ def parsing_commands():
 
 arg_obj = parsing_commands()
 utility.control_logger(arg_obj['v'][0])
+cpu_budget.configure(arg_obj['cpus'][0])
+utility.configure_extraction(arg_obj)
+features_values.configure(arg_obj['values'][0], arg_obj['max_value_length'][0],
+                          arg_obj['number_buckets'][0])
+checkpoint.configure(arg_obj['checkpoint'][0], arg_obj['resume'][0], arg_obj['analysis_path'][0])
 
 
 def main_learn(js_dirs=arg_obj['d'], js_dirs_validate=arg_obj['vd'], labels_validate=arg_obj['vl'],
                labels_d=arg_obj['l'], model_dir=arg_obj['md'], model_name=arg_obj['mn'],
                print_score=arg_obj['ps'], print_res=arg_obj['pr'], estimators=arg_obj['nt'],
-               analysis_path=arg_obj['analysis_path'][0], clf_choice=arg_obj['clf']):
+               analysis_path=arg_obj['analysis_path'][0], clf_choice=arg_obj['clf'],
+               save_matrix=arg_obj['save_matrix'][0], load_matrix=arg_obj['load_matrix'][0],
+               sketch_width=arg_obj['sketch'][0]):
     """
         Main function, performs a static analysis (syntactic) of JavaScript files given as input
         to build a model to classify future JavaScript files.
@@ -164,11 +183,24 @@ def main_learn(js_dirs=arg_obj['d'], js_dirs_validate=arg_obj['vd'], labels_vali
             Folder to store the features' analysis results in.
         - clf: str
             Classifier choice.
+        - save_matrix: str
+            Folder to store the features matrix in, or None.
+        - load_matrix: str
+            Folder to load a features matrix from (instead of analyzing js_dirs), or None.
+        - sketch_width: int
+            Number of counters per row of the count-min sketch of the features preselection,
+            or None (exact counts).
         Default values are the ones given in the command lines or in the
         ArgumentParser object (function parsingCommands()).
     """
 
-    if js_dirs is None:
+    names = None
+
+    if load_matrix is not None:
+        names, attributes, labels = matrix_store.load_features_matrix(
+            load_matrix, os.path.join(analysis_path, 'Features'))
+
+    elif js_dirs is None:
         logging.error('Please, indicate the JS folders to be used to build a model from')
 
     elif labels_d is None:
@@ -188,7 +220,8 @@ def main_learn(js_dirs=arg_obj['d'], js_dirs_validate=arg_obj['vd'], labels_vali
         analysis_path = os.path.join(analysis_path, 'Features')
         features2int_dict_path = os.path.join(analysis_path, '_selected_features_')
 
-        handle_features_all(js_dirs, labels_d, analysis_path)
+        features_values.store_policy(analysis_path)
+        handle_features_all(js_dirs, labels_d, analysis_path, sketch_width=sketch_width)
         store_features_all(js_dirs_validate, labels_validate, analysis_path)
 
         names, attributes, labels =\
@@ -196,13 +229,17 @@ def main_learn(js_dirs=arg_obj['d'], js_dirs_validate=arg_obj['vd'], labels_vali
                                    js_files=None, labels_files=None,
                                    features2int_dict_path=features2int_dict_path)
 
-        if names:
-            classify(names, labels, attributes, model_dir=model_dir[0], model_name=model_name[0],
-                     print_score=print_score[0], print_res=print_res[0], estimators=estimators[0],
-                     clf_choice=clf_choice[0])
+        if names and save_matrix is not None:
+            matrix_store.save_features_matrix(save_matrix, names, attributes, labels,
+                                              analysis_path)
+
+    if names:
+        classify(names, labels, attributes, model_dir=model_dir[0], model_name=model_name[0],
+                 print_score=print_score[0], print_res=print_res[0], estimators=estimators[0],
+                 clf_choice=clf_choice[0])
 
-        else:
-            logging.warning('No file found for the analysis.')
+    elif names is not None:
+        logging.warning('No file found for the analysis.')
 
 
 if __name__ == "__main__":  # Executed only if run as a script
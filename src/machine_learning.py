@@ -23,6 +23,8 @@ from sklearn.naive_bayes import BernoulliNB
 from sklearn.naive_bayes import MultinomialNB
 from sklearn.metrics import confusion_matrix
 
+import cpu_budget
+
 
 def classifier_choice(clf_choice='MNB', estimators=500):
     """ Selecting the classifier to be used: Random Forest, Bernoulli Naive Bayes
@@ -30,7 +32,7 @@ def classifier_choice(clf_choice='MNB', estimators=500):
 
     if clf_choice == 'RF':
         return RandomForestClassifier(n_estimators=estimators, max_depth=50,
-                                      random_state=0, n_jobs=-1)
+                                      random_state=0, n_jobs=cpu_budget.n_jobs())
     elif clf_choice == 'BNB':
         return BernoulliNB()
     elif clf_choice == 'MNB':
@@ -57,6 +59,27 @@ def get_classification_results(names, labels_predicted):
     print('> Name: labelPredicted')
 
 
+def get_models_results(names, models, predictions):
+    """
+        Print in stdout the classification results of the files 'names' with several models.
+        Format: 'Name: labelPredicted1 labelPredicted2 ...', in the order of the models.
+
+        -------
+        Parameters:
+        - names: list
+            Contains the path of the files being analysed.
+        - models: list
+            Contains the names of the models.
+        - predictions: list
+            Contains the predicted labels of the files being analysed, one list per model.
+    """
+
+    for i, _ in enumerate(names):
+        print(str(names[i]) + ': ' + ' '.join(str(labels_predicted[i])
+                                              for labels_predicted in predictions))
+    print('> Name: labelPredicted (' + ', '.join(models) + ')')
+
+
 def get_score(labels, labels_predicted):
     """
         Print in stdout the accuracy results of our classification (i.e. detection accuracy,
@@ -0,0 +1,136 @@
+# Copyright (C) 2019 Aurore Fass
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+    Storage of the [names, CSR matrix, labels] returned by analysis.main_analysis, as a folder
+    containing the CSR component arrays (.npy, loaded memory-mapped) and the names and labels.
+"""
+
+import os
+import json
+import shutil
+import hashlib
+import logging
+import numpy as np
+from scipy.sparse import csr_matrix
+
+import features_values
+
+
+MATRIX_VERSION = 2
+
+
+def features_digest(features_path):
+    """ Digest of the features selected in features_path (ANALYSIS_PATH/Features) and of their
+    values policy, which give the columns of a matrix. """
+
+    digest = hashlib.blake2b(digest_size=16)
+    with open(os.path.join(features_path, '_selected_features_'), 'rb') as features_file:
+        for block in iter(lambda: features_file.read(1 << 20), b''):
+            digest.update(block)
+    digest.update(repr(features_values.read_policy(features_path)).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def save_features_matrix(matrix_path, names, attributes, labels, features_path):
+    """
+        Stores the result of analysis.main_analysis in the folder matrix_path.
+
+        -------
+        Parameters:
+        - matrix_path: str
+            Folder to store the matrix in (replaced if it already exists).
+        - names: list
+            Name of the files.
+        - attributes: csr_matrix
+            Features of the files.
+        - labels: list
+            Labels of the files.
+        - features_path: str
+            Folder of the features selected the matrix was built with (ANALYSIS_PATH/Features).
+    """
+
+    tmp_path = matrix_path.rstrip(os.sep) + '.tmp'
+    if os.path.exists(tmp_path):
+        shutil.rmtree(tmp_path)
+    os.makedirs(tmp_path)
+
+    attributes = csr_matrix(attributes)
+    np.save(os.path.join(tmp_path, 'data.npy'), attributes.data)
+    np.save(os.path.join(tmp_path, 'indices.npy'), attributes.indices)
+    np.save(os.path.join(tmp_path, 'indptr.npy'), attributes.indptr)
+    with open(os.path.join(tmp_path, 'names.json'), 'w') as json_file:
+        json.dump(list(names), json_file)
+    with open(os.path.join(tmp_path, 'labels.json'), 'w') as json_file:
+        json.dump([str(label) for label in labels], json_file)
+    with open(os.path.join(tmp_path, 'meta.json'), 'w') as json_file:
+        json.dump({'version': MATRIX_VERSION, 'shape': list(attributes.shape),
+                   'nnz': int(attributes.nnz), 'features': features_digest(features_path)},
+                  json_file)
+
+    if os.path.exists(matrix_path):
+        shutil.rmtree(matrix_path)
+    os.rename(tmp_path, matrix_path)
+    logging.info('The features matrix has been stored in %s', matrix_path)
+
+
+def check_features_matrix(matrix_path, features_path):
+    """ Raises a ValueError if the matrix stored in matrix_path was not built with the features
+    selected in features_path and their values policy. """
+
+    with open(os.path.join(matrix_path, 'meta.json')) as json_file:
+        meta = json.load(json_file)
+    if meta.get('features') != features_digest(features_path):
+        raise ValueError('%s was not built with the features selected in %s and their values '
+                         'policy' % (matrix_path, features_path))
+
+
+def load_features_matrix(matrix_path, features_path, mmap_mode='r'):
+    """
+        Loads a matrix stored with save_features_matrix. The CSR component arrays are memory-mapped
+        (unless mmap_mode is None), so that loading does not depend on the number of rows.
+
+        -------
+        Parameters:
+        - matrix_path: str
+            Folder the matrix was stored in.
+        - features_path: str
+            Folder of the features selected the matrix is used with (ANALYSIS_PATH/Features):
+            they must be the ones it was built with.
+        - mmap_mode: str
+            Mode of np.load, or None to load the arrays in memory.
+
+        -------
+        Returns:
+        - list
+            [names, csr_matrix, labels], as analysis.main_analysis.
+    """
+
+    with open(os.path.join(matrix_path, 'meta.json')) as json_file:
+        meta = json.load(json_file)
+    if meta.get('version') != MATRIX_VERSION:
+        raise ValueError('%s is not a version %s features matrix' % (matrix_path, MATRIX_VERSION))
+    check_features_matrix(matrix_path, features_path)
+
+    data = np.load(os.path.join(matrix_path, 'data.npy'), mmap_mode=mmap_mode)
+    indices = np.load(os.path.join(matrix_path, 'indices.npy'), mmap_mode=mmap_mode)
+    indptr = np.load(os.path.join(matrix_path, 'indptr.npy'), mmap_mode=mmap_mode)
+    attributes = csr_matrix((data, indices, indptr), shape=tuple(meta['shape']), copy=False)
+
+    with open(os.path.join(matrix_path, 'names.json')) as json_file:
+        names = json.load(json_file)
+    with open(os.path.join(matrix_path, 'labels.json')) as json_file:
+        labels = json.load(json_file)
+
+    return [names, attributes, labels]
@@ -0,0 +1,231 @@
+# Copyright (C) 2019 Aurore Fass
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+    Per-file metrics (stage durations, bytes read, AST nodes, features emitted) recorded in
+    every worker into histograms, aggregated in the main process and exported as JSON and in
+    the Prometheus text format.
+"""
+
+import os
+import json
+import logging
+import timeit
+from contextlib import contextmanager
+
+
+METRICS_PATH = None  # Folder to export the metrics in; None: metrics disabled
+METRICS_INTERVAL = 30  # Seconds between 2 exports (main process) or 2 flushes (workers)
+PREFIX = 'jsdetector_'
+
+INF = float('inf')
+BUCKETS = {
+    'seconds': [0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, INF],
+    'bytes': [1e2, 1e3, 1e4, 1e5, 1e6, 1e7, 1e8, INF],
+    'count': [1, 10, 100, 1e3, 1e4, 1e5, 1e6, INF],
+    'ratio': [0, 0.1, 0.25, 0.5, 0.75, 0.9, 0.99, 1, INF]
+}
+
+# Name: (unit, help)
+HISTOGRAMS = {
+    'node_parse_seconds': ('seconds', 'Time spent by Node.js/Esprima to parse a file'),
+    'python_parse_seconds': ('seconds', 'Time spent by esprima-python to parse a file'),
+    'json_decode_seconds': ('seconds', 'Time spent to decode the Esprima JSON AST of a file'),
+    'columnar_decode_seconds': ('seconds', 'Time spent to load the columnar AST of a file'),
+    'ast_to_ast_nodes_seconds': ('seconds', 'Time spent to convert an AST into Node objects'),
+    'build_features_seconds': ('seconds', 'Time spent to build the features of a file'),
+    'features_vector_seconds': ('seconds', 'Time spent to get the features vector of a file'),
+    'file_seconds': ('seconds', 'Total time spent on a file by a worker'),
+    'bytes_read': ('bytes', 'Size of the files analyzed'),
+    'ast_nodes': ('count', 'Number of AST nodes per file'),
+    'features_emitted': ('count', 'Number of features per file'),
+    'lexer_seconds': ('seconds', 'Time spent by the streaming lexer on a file'),
+    'watch_latency_seconds': ('seconds', 'Time between the last write of a file and its verdict'),
+    'memo_hit_ratio': ('ratio', 'Share of the features of a file taken from the memoization '
+                               + 'cache'),
+}
+
+_histograms = dict()
+_counters = dict()
+_queue = None  # Queue to send the metrics to the main process, in workers
+_last_flush = timeit.default_timer()
+
+
+class Histogram:
+    """
+    Class Histogram: cumulative histogram, as in the Prometheus text format.
+    """
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.sum += value
+        self.count += 1
+
+    def merge(self, other):
+        for i, count in enumerate(other.counts):
+            self.counts[i] += count
+        self.sum += other.sum
+        self.count += other.count
+
+    def to_dict(self):
+        return {'buckets': [str(bound) for bound in self.buckets], 'counts': self.counts,
+                'sum': self.sum, 'count': self.count}
+
+
+def configure(metrics_path, metrics_interval=METRICS_INTERVAL):
+    """ Enables the metrics, which will be exported in metrics_path. """
+
+    global METRICS_PATH, METRICS_INTERVAL
+    METRICS_PATH = metrics_path
+    METRICS_INTERVAL = metrics_interval
+
+
+def enabled():
+    return METRICS_PATH is not None
+
+
+def get_histogram(name):
+    if name not in _histograms:
+        _histograms[name] = Histogram(BUCKETS[HISTOGRAMS[name][0]])
+    return _histograms[name]
+
+
+def observe(name, value):
+    """ Records value in the histogram name. """
+
+    if METRICS_PATH is not None:
+        get_histogram(name).observe(value)
+        maybe_flush()
+
+
+def increment(name, value=1):
+    """ Increments the counter name. """
+
+    if METRICS_PATH is not None:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+@contextmanager
+def timer(name):
+    """ Records the time spent in the with block in the histogram name. """
+
+    if METRICS_PATH is None:
+        yield
+    else:
+        start = timeit.default_timer()
+        try:
+            yield
+        finally:
+            observe(name, timeit.default_timer() - start)
+
+
+def attach(metrics_queue):
+    """ In a worker: the metrics recorded will be sent to the main process through
+    metrics_queue. """
+
+    global _queue
+    _queue = metrics_queue
+    _histograms.clear()  # Do not send again the metrics inherited from the main process
+    _counters.clear()
+
+
+def maybe_flush():
+    if _queue is not None and timeit.default_timer() - _last_flush > METRICS_INTERVAL:
+        flush()
+
+
+def flush():
+    """ In a worker: sends the metrics recorded since the last flush to the main process. """
+
+    global _last_flush
+    _last_flush = timeit.default_timer()
+    if _queue is not None and (_histograms or _counters):
+        _queue.put([dict(_histograms), dict(_counters)])
+        _histograms.clear()
+        _counters.clear()
+
+
+def merge(delta):
+    """ In the main process: adds the metrics sent by a worker. """
+
+    histograms, counters = delta
+    for name, histogram in histograms.items():
+        get_histogram(name).merge(histogram)
+    for name, value in counters.items():
+        _counters[name] = _counters.get(name, 0) + value
+
+
+def collect(metrics_queue):
+    """ In the main process: merges all the metrics currently in metrics_queue. """
+
+    while True:
+        try:
+            merge(metrics_queue.get_nowait())
+        except Exception:  # queue.Empty, or a worker which died while sending its metrics
+            break
+
+
+def prometheus_text():
+    """ Metrics in the Prometheus text format. """
+
+    lines = list()
+    for name in sorted(_histograms):
+        histogram = _histograms[name]
+        metric = PREFIX + name
+        lines.append('# HELP ' + metric + ' ' + HISTOGRAMS[name][1])
+        lines.append('# TYPE ' + metric + ' histogram')
+        cumulative = 0
+        for i, bound in enumerate(histogram.buckets):
+            cumulative += histogram.counts[i]
+            le = '+Inf' if bound == INF else repr(float(bound))
+            lines.append(metric + '_bucket{le="' + le + '"} ' + str(cumulative))
+        lines.append(metric + '_sum ' + repr(float(histogram.sum)))
+        lines.append(metric + '_count ' + str(histogram.count))
+    for name in sorted(_counters):
+        metric = PREFIX + name + '_total'
+        lines.append('# TYPE ' + metric + ' counter')
+        lines.append(metric + ' ' + str(_counters[name]))
+    return '\n'.join(lines) + '\n'
+
+
+def export():
+    """ In the main process: writes the aggregated metrics in METRICS_PATH, in JSON
+    (metrics.json) and in the Prometheus text format (metrics.prom). """
+
+    if METRICS_PATH is None:
+        return
+    if not os.path.exists(METRICS_PATH):
+        os.makedirs(METRICS_PATH)
+
+    json_path = os.path.join(METRICS_PATH, 'metrics.json')
+    prom_path = os.path.join(METRICS_PATH, 'metrics.prom')
+    with open(json_path + '.tmp', 'w') as json_file:
+        json.dump({'histograms': dict((name, histogram.to_dict())
+                                      for name, histogram in _histograms.items()),
+                   'counters': _counters}, json_file, indent=2)
+    with open(prom_path + '.tmp', 'w') as prom_file:
+        prom_file.write(prometheus_text())
+    # Atomic replacement, so that a scraper never reads a partial file
+    os.replace(json_path + '.tmp', json_path)
+    os.replace(prom_path + '.tmp', prom_path)
+    logging.info('Exported the metrics in %s', METRICS_PATH)
@@ -0,0 +1,253 @@
+# Copyright (C) 2019 Aurore Fass
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+    Parser backends producing the Esprima AST used by ast_generation.get_extended_ast:
+    - node: Esprima run by Node.js (js_ast.js) in a subprocess;
+    - python: esprima-python (pip install esprima), a port of Esprima run in-process.
+    Running this module checks that both backends give the same features on a reference corpus,
+    and benchmarks them by file size.
+"""
+
+import json
+import math
+import decimal
+import logging
+import argparse
+import timeit
+import numpy as np
+
+import ast_generation
+import corpus_pack
+import features_extraction
+import utility
+
+try:
+    import esprima
+except ImportError:  # The python backend is optional
+    esprima = None
+
+
+BACKEND = 'node'  # Backend used by ast_generation.get_extended_ast
+ESPRIMA_OPTIONS = {'range': True, 'tokens': True, 'comment': True}  # Same as js_ast.js
+
+
+class NodeBackend:
+    """
+    Class NodeBackend: Esprima through Node.js, the AST being read from its stdout.
+    """
+
+    name = 'node'
+
+    @staticmethod
+    def available():
+        return True
+
+    @staticmethod
+    def parse(input_file, source=None):
+        """ Esprima AST (dict) of input_file, or None if it could not be parsed. """
+
+        produce_ast = ast_generation.produce_esprima_ast(input_file, '-', source)
+        if produce_ast.returncode == 0:
+            return json.loads(produce_ast.stdout)
+        return None
+
+
+class PythonBackend:
+    """
+    Class PythonBackend: esprima-python, in the current process.
+    """
+
+    name = 'python'
+
+    @staticmethod
+    def available():
+        return esprima is not None
+
+    @staticmethod
+    def parse(input_file, source=None):
+        """ Esprima AST (dict) of input_file, or None if it could not be parsed. """
+
+        if source is None:
+            source = corpus_pack.read_input(input_file)
+        try:
+            ast = esprima.parseScript(source.decode('utf-8', errors='replace'), ESPRIMA_OPTIONS)
+        except esprima.Error as error_message:
+            logging.debug('%s: %s', input_file, str(error_message))
+            return None
+        return to_json(ast.toDict())
+
+
+BACKENDS = {'node': NodeBackend, 'python': PythonBackend}
+
+
+def to_json(value):
+    """ Converts the AST given by esprima-python as Node.js would through JSON.stringify:
+    regex values become {}, numbers are rounded to doubles, the integral ones below 1e21 becoming
+    int, and the value of the null literals (dropped by toDict, as all None values) is
+    restored. """
+
+    if isinstance(value, dict):
+        if value.get('type') == 'Literal':
+            if 'regex' in value:  # The RegExp value may be None if Python cannot compile it
+                value = dict(value, value=dict())
+            elif 'value' not in value:  # null
+                value = dict([('type', 'Literal'), ('value', None)] + list(value.items()))
+        return dict((key, to_json(child)) for key, child in value.items())
+    if isinstance(value, list):
+        return [to_json(child) for child in value]
+    if isinstance(value, int) and not isinstance(value, bool):  # JS numbers are doubles
+        try:
+            value = float(value)
+        except OverflowError:  # Infinity, which JSON.stringify gives as null
+            return None
+    if isinstance(value, float):
+        if not math.isfinite(value):  # JSON.stringify gives null
+            return None
+        if value.is_integer() and abs(value) < 1e21:  # With the shortest digits, as in JS
+            return int(decimal.Decimal(repr(value)))
+        return value
+    if value is None or isinstance(value, (str, bool)):
+        return value
+    return dict()  # RegExp objects are serialized as {}
+
+
+def configure(backend):
+    """ Selects the backend used by ast_generation.get_extended_ast. """
+
+    global BACKEND
+    if not BACKENDS[backend].available():
+        logging.error('The %s parser backend is not available (pip install esprima), using node',
+                      backend)
+        backend = 'node'
+    BACKEND = backend
+
+
+def parse(input_file, source=None, backend=None):
+    """ Esprima AST (dict) of input_file with the backend given (default: BACKEND), or None if
+    it could not be parsed. """
+
+    return BACKENDS[backend or BACKEND].parse(input_file, source)
+
+
+def get_features(input_file, backend):
+    """ Features of input_file (as features_extraction.get_features) with the backend given. """
+
+    esprima_ast = parse(input_file, backend=backend)
+    if esprima_ast is None:
+        return None
+    ast = ast_generation.esprima_to_extended_ast(esprima_ast).get_ast()
+    ast_nodes = ast_generation.ast_to_ast_nodes(ast, ast_nodes=ast_generation.Node('Program'))
+    return features_extraction.count_features(ast_nodes)[0]
+
+
+def conformance(files, backends=('node', 'python')):
+    """
+        Checks that the backends give the same features for each file.
+
+        -------
+        Parameters:
+        - files: list of str
+            Files of the reference corpus.
+        - backends: tuple of str
+            Backends to compare, the first one being the reference.
+
+        -------
+        Returns:
+        - list
+            Files for which the features differ.
+        - list
+            Files parsed by some of the backends only (e.g. syntax supported by one version of
+            Esprima only).
+    """
+
+    different, parsed_by_some = list(), list()
+    for file_path in files:
+        features_dicts = [get_features(file_path, backend) for backend in backends]
+        if any(features_dict is None for features_dict in features_dicts):
+            if any(features_dict is not None for features_dict in features_dicts):
+                parsed_by_some.append(file_path)
+        elif any(features_dict != features_dicts[0] for features_dict in features_dicts[1:]):
+            different.append(file_path)
+
+    print(str(len(files) - len(different) - len(parsed_by_some)) + '/' + str(len(files))
+          + ' files with identical features')
+    for file_path in different:
+        print('Different features: ' + file_path)
+    for file_path in parsed_by_some:
+        print('Parsed by some backends only: ' + file_path)
+    return different, parsed_by_some
+
+
+def benchmark(files, backends=('node', 'python'), size_buckets=(1 << 10, 1 << 14, 1 << 17)):
+    """ Mean parse time (AST production, without the features) per backend and file size. """
+
+    bounds = [0] + list(size_buckets) + [float('inf')]
+    times = dict()
+    for file_path in files:
+        size = corpus_pack.get_size(file_path)
+        bucket = next(i for i in range(len(bounds) - 1) if bounds[i] <= size < bounds[i + 1])
+        for backend in backends:
+            start = timeit.default_timer()
+            parse(file_path, backend=backend)
+            times.setdefault((bucket, backend), list()).append(timeit.default_timer() - start)
+
+    print('%22s %6s' % ('size (B)', 'files') + ''.join('%14s' % (backend + ' (ms)')
+                                                      for backend in backends))
+    for i in range(len(bounds) - 1):
+        if (i, backends[0]) in times:
+            print('%22s %6d' % ('[' + str(bounds[i]) + ', ' + str(bounds[i + 1]) + ')',
+                                len(times[(i, backends[0])]))
+                  + ''.join('%14.2f' % (1000 * np.mean(times[(i, backend)]))
+                            for backend in backends))
+    return times
+
+
+def parsing_commands():
+    """
+        Creation of an ArgumentParser object, holding all the information necessary to parse
+        the command line into Python data types.
+    """
+
+    parser = argparse.ArgumentParser(description='Conformance and benchmark of the parser '
+                                                 + 'backends.')
+
+    parser.add_argument('--d', metavar='DIR', type=str, nargs='+', required=True,
+                        help='directories (or packs) containing the reference JS files')
+    parser.add_argument('--benchmark', metavar='BOOL', type=bool, nargs=1, default=[False],
+                        help='benchmarks the backends by file size, after the conformance check')
+    utility.parsing_commands(parser)
+
+    return vars(parser.parse_args())
+
+
+def main_conformance():
+    """ Main function, checks (and benchmarks) the parser backends. """
+
+    args = parsing_commands()
+    utility.control_logger(args['v'][0])
+    utility.configure_extraction(args)
+    if not PythonBackend.available():
+        logging.error('The python parser backend is not available (pip install esprima)')
+        return
+
+    files = [file_path for js_dir in args['d']
+             for file_path in sorted(corpus_pack.list_files(js_dir)[0])]
+    conformance(files)
+    if args['benchmark'][0]:
+        benchmark(files)
+
+
+if __name__ == "__main__":  # Executed only if run as a script
+    main_conformance()
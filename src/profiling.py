@@ -0,0 +1,155 @@
+# Copyright (C) 2019 Aurore Fass
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+    Opt-in profiling of the worker processes, with cProfile (cpu) or tracemalloc (mem).
+    Each worker dumps its own stats, which are then merged into one report.
+"""
+
+import os
+import io
+import time
+import glob
+import pstats
+import logging
+import cProfile
+import tracemalloc
+
+
+PROFILE = None  # 'cpu', 'mem' or None (no profiling)
+PROFILE_PATH = None  # Folder to store the per-worker stats and the report in
+TOP = 40  # Number of functions / allocation sites in the report
+
+_profiler = None
+_peak_snapshot = None
+_peak_size = 0
+
+
+def configure(profile, profile_path):
+    """ Enables the profiling of the workers; the stats of the current run will be stored in a
+    new subfolder of profile_path. """
+
+    global PROFILE, PROFILE_PATH
+    PROFILE = profile
+    if profile is not None:
+        PROFILE_PATH = os.path.join(profile_path,
+                                    time.strftime('%Y%m%d-%H%M%S') + '-' + str(os.getpid()))
+        if not os.path.exists(PROFILE_PATH):
+            os.makedirs(PROFILE_PATH)
+        logging.info('The %s profiles will be stored in %s', profile, PROFILE_PATH)
+
+
+def start():
+    """ In a worker: starts the profiling. """
+
+    global _profiler, _peak_snapshot, _peak_size
+    if PROFILE == 'cpu':
+        _profiler = cProfile.Profile()
+        _profiler.enable()
+    elif PROFILE == 'mem':
+        _peak_snapshot = None
+        _peak_size = 0
+        tracemalloc.start()
+
+
+def sample():
+    """ In a worker, case mem: keeps a snapshot of the allocations if the memory currently
+    traced is the highest seen so far. To be called where the memory usage peaks for a file. """
+
+    global _peak_snapshot, _peak_size
+    if tracemalloc.is_tracing():
+        size, _ = tracemalloc.get_traced_memory()
+        if size > _peak_size:
+            _peak_size = size
+            _peak_snapshot = tracemalloc.take_snapshot()
+
+
+def stop(worker_name):
+    """ In a worker: stops the profiling and dumps the stats in PROFILE_PATH. """
+
+    global _profiler
+    if PROFILE is None:
+        return
+    dump_path = os.path.join(PROFILE_PATH, worker_name + '-' + str(os.getpid()))
+    if PROFILE == 'cpu' and _profiler is not None:
+        _profiler.disable()
+        _profiler.dump_stats(dump_path + '.prof')
+        _profiler = None
+    elif PROFILE == 'mem' and tracemalloc.is_tracing():
+        sample()
+        if _peak_snapshot is not None:
+            _peak_snapshot.dump(dump_path + '.snapshot')
+        tracemalloc.stop()
+
+
+def cpu_report(prof_files):
+    """ Merges the cProfile stats of all workers; top functions by cumulative and own time. """
+
+    stream = io.StringIO()
+    stats = pstats.Stats(*prof_files, stream=stream)
+    stream.write('CPU profile of ' + str(len(prof_files)) + ' workers\n\n')
+    stats.sort_stats('cumulative').print_stats(TOP)
+    stats.sort_stats('tottime').print_stats(TOP)
+    return stream.getvalue()
+
+
+def mem_report(snapshot_files):
+    """ Merges the tracemalloc snapshots (taken at the memory peak) of all workers; top
+    allocation sites. """
+
+    sites = dict()
+    lines = ['Memory profile of ' + str(len(snapshot_files)) + ' workers (at their peak)', '']
+    for snapshot_file in sorted(snapshot_files):
+        snapshot = tracemalloc.Snapshot.load(snapshot_file).filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap>')))
+        statistics = snapshot.statistics('lineno')
+        lines.append('%-60s %12.1f KiB' % (os.path.basename(snapshot_file),
+                                           sum(stat.size for stat in statistics) / 1024))
+        for stat in statistics:
+            frame = stat.traceback[0]
+            site = (frame.filename, frame.lineno)
+            size, count = sites.get(site, (0, 0))
+            sites[site] = (size + stat.size, count + stat.count)
+
+    lines.extend(['', 'Top allocation sites (summed over the workers):'])
+    top_sites = sorted(sites.items(), key=lambda site: site[1][0], reverse=True)[:TOP]
+    for (filename, lineno), (size, count) in top_sites:
+        lines.append('%12.1f KiB %10d blocks  %s:%s' % (size / 1024, count, filename, lineno))
+    return '\n'.join(lines) + '\n'
+
+
+def report():
+    """ In the main process: merges the stats dumped so far by the workers into
+    PROFILE_PATH/report.txt. """
+
+    if PROFILE is None:
+        return None
+
+    if PROFILE == 'cpu':
+        dumps = glob.glob(os.path.join(PROFILE_PATH, '*.prof'))
+        text = cpu_report(dumps) if dumps else None
+    else:
+        dumps = glob.glob(os.path.join(PROFILE_PATH, '*.snapshot'))
+        text = mem_report(dumps) if dumps else None
+
+    if text is None:
+        logging.warning('No profile found in %s', PROFILE_PATH)
+        return None
+
+    report_path = os.path.join(PROFILE_PATH, 'report.txt')
+    with open(report_path, 'w') as report_file:
+        report_file.write(text)
+    logging.info('The profiling report has been stored in %s', report_path)
+    return report_path
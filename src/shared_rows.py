@@ -0,0 +1,210 @@
+# Copyright (C) 2019 Aurore Fass
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+    Transfer of the features vectors (CSR rows) from the workers to the main process through
+    memory-mapped chunk files (in /dev/shm, i.e. shared memory, if available): each worker
+    appends the indices and values of its rows to its own chunk, and only sends a small
+    descriptor (file id, chunk, offset, number of values) through its queue. The main process
+    then assembles the CSR matrix directly from the chunks, at once or block by block as the
+    descriptors arrive (cf. MatrixBuilder).
+"""
+
+import os
+import shutil
+import tempfile
+import numpy as np
+from scipy.sparse import csr_matrix
+
+
+SHM_PATH = '/dev/shm'
+INDICES_DTYPE = np.int32
+DATA_DTYPE = np.float64
+CHUNK_BYTES = 1 << 26  # Size after which a worker starts a new chunk
+
+
+def create_chunk_dir():
+    """ Temporary folder for the chunks, in shared memory if possible. """
+
+    return tempfile.mkdtemp(prefix='jsdetector-rows-',
+                            dir=SHM_PATH if os.path.isdir(SHM_PATH) else None)
+
+
+def remove_chunk_dir(chunk_dir):
+    shutil.rmtree(chunk_dir, ignore_errors=True)
+
+
+class RowWriter:
+    """
+    Class RowWriter: appends CSR rows to the chunk of a worker.
+    """
+
+    def __init__(self, chunk_dir, chunk_bytes=None):
+        self.chunk_dir = chunk_dir
+        self.chunk_bytes = chunk_bytes or CHUNK_BYTES
+        self.nb_chunks = 0
+        self.chunk = self.indices_file = self.data_file = None
+        self.offset = 0
+        self.rotate()
+
+    def rotate(self):
+        """ Starts a new chunk: the previous one is complete, and can be removed once read. """
+
+        if self.chunk is not None:
+            self.close()
+        self.chunk = 'chunk-' + str(os.getpid()) + '-' + str(self.nb_chunks)
+        self.nb_chunks += 1
+        base_path = os.path.join(self.chunk_dir, self.chunk)
+        # Unbuffered, so that a row is readable as soon as its descriptor is sent
+        self.indices_file = open(base_path + '.indices', 'ab', buffering=0)
+        self.data_file = open(base_path + '.data', 'ab', buffering=0)
+        self.offset = 0
+
+    def write(self, file_id, row):
+        """ Appends the CSR row (1 x n matrix) of file_id; returns its descriptor. """
+
+        self.indices_file.write(row.indices.astype(INDICES_DTYPE, copy=False).tobytes())
+        self.data_file.write(row.data.astype(DATA_DTYPE, copy=False).tobytes())
+        descriptor = (file_id, self.chunk, self.offset, row.nnz)
+        self.offset += row.nnz
+        if self.offset * (np.dtype(INDICES_DTYPE).itemsize + np.dtype(DATA_DTYPE).itemsize)\
+                >= self.chunk_bytes:
+            self.rotate()
+        return descriptor
+
+    def close(self):
+        self.indices_file.close()
+        self.data_file.close()
+
+
+def remove_chunk(chunk_dir, chunk):
+    base_path = os.path.join(chunk_dir, chunk)
+    for extension in ['.indices', '.data']:
+        if os.path.isfile(base_path + extension):
+            os.remove(base_path + extension)
+
+
+def chunk_order(chunk):
+    """ Sort key of a chunk: (pid of its worker, number of the chunk), so that the chunks of a
+    worker are in the order they were written (chunk-p-10 after chunk-p-2). """
+
+    return tuple(int(number) for number in chunk.split('-')[1:])
+
+
+def open_chunk(chunk_dir, chunk):
+    """ Memory-mapped (indices, data) of a chunk. """
+
+    base_path = os.path.join(chunk_dir, chunk)
+    if os.path.getsize(base_path + '.indices') == 0:
+        return np.zeros(0, dtype=INDICES_DTYPE), np.zeros(0, dtype=DATA_DTYPE)
+    return np.memmap(base_path + '.indices', dtype=INDICES_DTYPE, mode='r'),\
+        np.memmap(base_path + '.data', dtype=DATA_DTYPE, mode='r')
+
+
+def read_row(chunk_dir, descriptor, nb_columns):
+    """ CSR row of a descriptor (copied out of the chunk). """
+
+    _, chunk, offset, nnz = descriptor
+    indices, data = open_chunk(chunk_dir, chunk)
+    return csr_matrix((np.array(data[offset:offset + nnz]),
+                       np.array(indices[offset:offset + nnz]), [0, nnz]),
+                      shape=(1, nb_columns))
+
+
+def assemble(chunk_dir, descriptors, nb_columns):
+    """
+        Assembles the rows of the descriptors into a CSR matrix.
+
+        -------
+        Parameters:
+        - chunk_dir: str
+            Folder of the chunks.
+        - descriptors: list
+            (file id, chunk, offset, number of values) of the rows; the rows of each chunk
+            must be consecutive in it (e.g. all the rows written since the previous block).
+        - nb_columns: int
+            Number of columns of the matrix.
+
+        -------
+        Returns:
+        - list
+            File ids, in the order of the rows of the matrix.
+        - csr_matrix
+            Rows, in the order they were written in each chunk, chunk after chunk (in the order
+            of chunk_order): each chunk is copied once into the matrix, without going through
+            each row.
+    """
+
+    by_chunk = dict()
+    for descriptor in descriptors:
+        by_chunk.setdefault(descriptor[1], list()).append(descriptor)
+
+    file_ids, nnzs, indices_list, data_list = list(), list(), list(), list()
+    for chunk in sorted(by_chunk, key=chunk_order):
+        chunk_descriptors = sorted(by_chunk[chunk], key=lambda descriptor: descriptor[2])
+        indices, data = open_chunk(chunk_dir, chunk)
+        start = chunk_descriptors[0][2]
+        end = chunk_descriptors[-1][2] + chunk_descriptors[-1][3]
+        indices_list.append(indices[start:end])
+        data_list.append(data[start:end])
+        for file_id, _, _, nnz in chunk_descriptors:
+            file_ids.append(file_id)
+            nnzs.append(nnz)
+
+    indptr = np.zeros(len(nnzs) + 1, dtype=np.int64)
+    np.cumsum(nnzs, out=indptr[1:])
+    if indptr[-1] < np.iinfo(INDICES_DTYPE).max:
+        indptr = indptr.astype(INDICES_DTYPE)
+    matrix = csr_matrix((np.concatenate(data_list) if data_list else np.zeros(0),
+                         np.concatenate(indices_list) if indices_list
+                         else np.zeros(0, dtype=INDICES_DTYPE), indptr),
+                        shape=(len(nnzs), nb_columns))
+    return file_ids, matrix
+
+
+class MatrixBuilder:
+    """
+    Class MatrixBuilder: assembles the rows into CSR blocks as their descriptors arrive, while
+    the workers go on writing. The chunks read up to their end are removed, so that the shared
+    memory holds only the rows not assembled yet (and the chunks being written).
+    """
+
+    def __init__(self, chunk_dir, nb_columns):
+        self.chunk_dir = chunk_dir
+        self.nb_columns = nb_columns
+        self.descriptors = list()  # Rows not assembled yet
+        self.chunks = dict()  # Worker: chunk it writes to
+        self.complete = set()  # Chunks rotated by their worker, to remove after the next block
+
+    def add(self, descriptor):
+        """ Adds the row of a descriptor; returns the number of rows not assembled yet. """
+
+        chunk = descriptor[1]
+        worker = chunk.rsplit('-', 1)[0]
+        if self.chunks.get(worker, chunk) != chunk:  # The rows of a worker arrive in order
+            self.complete.add(self.chunks[worker])
+        self.chunks[worker] = chunk
+        self.descriptors.append(descriptor)
+        return len(self.descriptors)
+
+    def flush(self):
+        """ Assembles the rows added since the previous block; returns their file ids and
+        CSR block (cf. assemble). """
+
+        file_ids, block = assemble(self.chunk_dir, self.descriptors, self.nb_columns)
+        self.descriptors = list()
+        for chunk in self.complete:
+            remove_chunk(self.chunk_dir, chunk)
+        self.complete = set()
+        return file_ids, block
@@ -0,0 +1,113 @@
+# Copyright (C) 2019 Aurore Fass
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+    Probabilistic data structures with a bounded memory, to count the features of huge corpora.
+"""
+
+import zlib
+import numpy as np
+
+
+# Odd 64-bit multipliers and offsets of the hash functions of the rows
+MULTIPLIERS = np.array([0x9E3779B97F4A7C15, 0xC2B2AE3D27D4EB4F, 0x165667B19E3779F9,
+                        0xD6E8FEB86659FD93, 0xFF51AFD7ED558CCD, 0xC4CEB9FE1A85EC53,
+                        0x2545F4914F6CDD1D, 0x94D049BB133111EB], dtype=np.uint64)
+OFFSETS = np.array([0x7F4A7C15, 0x27D4EB4F, 0x9E3779F9, 0x6659FD93,
+                    0xED558CCD, 0x1A85EC53, 0x4F6CDD1D, 0x133111EB], dtype=np.uint64)
+
+
+def hash_items(items):
+    """ 64-bit hashes of the items (the same within a process only). """
+
+    return np.fromiter((hash(item) for item in items), dtype=np.int64,
+                       count=len(items)).view(np.uint64)
+
+
+class CountMinSketch:
+    """
+    Class CountMinSketch: approximate counts, which are never under-estimated. With a width
+    w and a depth d, an item is over-counted by more than e * N / w (N: total count) with a
+    probability of at most exp(-d).
+    """
+
+    def __init__(self, width, depth=4):
+        self.width = width
+        self.depth = min(depth, len(MULTIPLIERS))
+        self.table = np.zeros((self.depth, width), dtype=np.uint32)
+        self.total = 0
+
+    def indexes(self, items):
+        """ Counter of each item, per row. """
+
+        hashes = hash_items(items)
+        return [((hashes * MULTIPLIERS[i] + OFFSETS[i]) >> np.uint64(32)) % np.uint64(self.width)
+                for i in range(self.depth)]
+
+    def add(self, items):
+        """ Counts each of the items once. """
+
+        items = list(items)
+        for row, indexes in zip(self.table, self.indexes(items)):
+            np.add.at(row, indexes, 1)
+        self.total += len(items)
+
+    def estimate(self, items):
+        """ Estimated counts of the items (numpy array). """
+
+        items = list(items)
+        if not items:
+            return np.zeros(0, dtype=np.uint32)
+        return np.min([row[indexes] for row, indexes in zip(self.table, self.indexes(items))],
+                      axis=0)
+
+
+class BloomFilter:
+    """
+    Class BloomFilter: set of byte strings, without false negatives. With m bits, k hash
+    functions and n items, an item not added is found with a probability of about
+    (1 - exp(-k * n / m)) ** k. The hash functions (crc32 and adler32) are stable across
+    processes, so that the filter can be stored.
+    """
+
+    def __init__(self, nb_bits, nb_hashes=4, bits=None):
+        self.nb_bits = max(8, nb_bits)
+        self.nb_hashes = nb_hashes
+        self.bits = np.zeros((self.nb_bits + 7) // 8, dtype=np.uint8) if bits is None else bits
+        self.view = memoryview(self.bits)  # Faster than numpy to test one bit
+
+    @staticmethod
+    def sized(nb_items, bits_per_item=12):
+        """ Filter for nb_items: about 1% of false positives with 12 bits per item. """
+
+        return BloomFilter(max(1, nb_items) * bits_per_item)
+
+    def positions(self, key):
+        first = zlib.crc32(key)
+        second = zlib.adler32(key) | 1
+        return [(first + i * second) % self.nb_bits for i in range(self.nb_hashes)]
+
+    def add(self, key):
+        for position in self.positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, key):
+        first = zlib.crc32(key)
+        second = zlib.adler32(key) | 1
+        view = self.view
+        for i in range(self.nb_hashes):
+            position = (first + i * second) % self.nb_bits
+            if not view[position >> 3] & (1 << (position & 7)):
+                return False  # Most unknown features stop at the first bit
+        return True
@@ -0,0 +1,291 @@
+# Copyright (C) 2019 Aurore Fass
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+    Cross-validation and hyperparameter sweeps (chi2 confidence, classifier, number of trees)
+    over cached features: the JS files are parsed only once.
+"""
+
+import os
+import json
+import pickle
+import logging
+import argparse
+import itertools
+import timeit
+from multiprocessing import Queue
+import queue  # For the exception queue.Empty which is not in the multiprocessing package
+import numpy as np
+from sklearn.model_selection import StratifiedKFold
+
+import content_index
+import cpu_budget
+import features_selection
+import features_space
+import features_values
+import machine_learning
+import workers_pool
+import utility
+
+
+def get_raw_features(js_dirs, labels, cache_path):
+    """
+        Extracts the raw features (dict feature: number of occurrences, with the full values) of
+        all files from js_dirs, or loads them from cache_path if they were already extracted
+        from the same directories, with the same labels and extraction settings.
+
+        -------
+        Parameters:
+        - js_dirs: list of str
+            Directories (or packs) containing the JS files, or None to use the cache whatever
+            the directories it was extracted from.
+        - labels: list of str
+            Labels of the directories.
+        - cache_path: str
+            Path of the cache.
+
+        -------
+        Returns:
+        - list
+            (file path, label, features dict) of the files that could be parsed, or None if
+            they are neither cached nor given.
+    """
+
+    previous_policy = features_values.get_policy()
+    features_values.configure('full')  # Raw features, bounded by the callers
+    key = {'dirs': [os.path.abspath(js_dir) for js_dir in js_dirs] if js_dirs else None,
+           'labels': labels, 'settings': content_index.extraction_settings(),
+           'policy': features_values.get_policy()}
+    try:
+        if os.path.isfile(cache_path):
+            cache = pickle.load(open(cache_path, 'rb'))
+            cached_key = cache['key'] if isinstance(cache, dict) else None  # Else: no key stored
+            if js_dirs is None and cached_key is not None:
+                key.update(dirs=cached_key['dirs'], labels=cached_key['labels'])
+            if cached_key == key:
+                logging.info('Loading the cached features from %s', cache_path)
+                return cache['raw_features']
+            logging.info('The features cached in %s were extracted from other files or with '
+                         + 'other settings', cache_path)
+        if js_dirs is None:
+            logging.error('Please, indicate the JS directories to extract the features from')
+            return None
+
+        analyses = features_selection.get_features_all_files_multiproc(js_dirs, labels)
+    finally:
+        features_values.configure(previous_policy['values'], previous_policy['max_length'],
+                                  previous_policy['number_buckets'])
+    raw_features = [(analysis.file_path, analysis.label, analysis.features)
+                    for analysis in analyses if analysis.features is not None]
+
+    cache_dir = os.path.dirname(cache_path)
+    if cache_dir and not os.path.exists(cache_dir):
+        os.makedirs(cache_dir)
+    pickle.dump({'key': key, 'raw_features': raw_features}, open(cache_path, 'wb'))
+    logging.info('The raw features have been cached in %s', cache_path)
+    return raw_features
+
+
+def bound_raw_features(raw_features):
+    """ Raw features (output of get_raw_features) under the current values policy. """
+
+    if not features_values.enabled():
+        return raw_features
+    return [(file_path, label, features_values.bound_features(features_dict))
+            for file_path, label, features_dict in raw_features]
+
+
+def cross_validate(attributes, labels, clf_choice, estimators, folds):
+    """ k-fold cross-validation of one classifier configuration. """
+
+    accuracies, fit_times, predict_times, model_sizes = list(), list(), list(), list()
+    k_fold = StratifiedKFold(n_splits=folds, shuffle=True, random_state=0)
+
+    for train, test in k_fold.split(np.zeros(len(labels)), labels):
+        clf = machine_learning.classifier_choice(clf_choice=clf_choice, estimators=estimators)
+        if clf_choice == 'RF':
+            clf.set_params(n_jobs=1)  # The configurations are already run in parallel
+
+        start = timeit.default_timer()
+        clf.fit(attributes[train], labels[train])
+        fit_times.append(timeit.default_timer() - start)
+
+        start = timeit.default_timer()
+        labels_predicted = clf.predict(attributes[test])
+        predict_times.append(timeit.default_timer() - start)
+
+        accuracies.append(float(np.mean(labels_predicted == labels[test])))
+        model_sizes.append(len(pickle.dumps(clf)))
+
+    return {'accuracy': float(np.mean(accuracies)), 'accuracy_std': float(np.std(accuracies)),
+            'fit_time': float(np.mean(fit_times)), 'predict_time': float(np.mean(predict_times)),
+            'model_size': int(np.mean(model_sizes))}
+
+
+def worker_sweep(my_queue, out_queue, matrices, labels, folds):
+    """ Worker to cross-validate the configurations. """
+
+    while True:
+        try:
+            confidence, clf_choice, estimators = my_queue.get(timeout=2)
+            try:
+                result = cross_validate(matrices[confidence], labels, clf_choice, estimators,
+                                        folds)
+                result.update({'confidence': confidence, 'classifier': clf_choice,
+                               'estimators': estimators if clf_choice == 'RF' else None,
+                               'features': matrices[confidence].shape[1] - 1})
+                out_queue.put(result)
+            except Exception as e:  # Handle exception occurring in the processes spawned
+                logging.error('Something went wrong with %s %s %s', confidence, clf_choice,
+                              estimators)
+                print(e)
+        except queue.Empty:  # Empty queue exception
+            break
+
+
+def sweep(raw_features, analyzed_features_dict, confidences, clf_choices, estimators_list,
+          folds=5):
+    """
+        Cross-validates all combinations of chi2 confidences and classifier configurations.
+
+        -------
+        Parameters:
+        - raw_features: list
+            Output of get_raw_features.
+        - analyzed_features_dict: dict
+            Content of _analyzed_features_, to select the features from.
+        - confidences: list of float
+            Confidences of the chi2 test, in percent.
+        - clf_choices: list of str
+            Classifiers: 'RF', 'MNB' and/or 'BNB'.
+        - estimators_list: list of int
+            Numbers of trees, for RF.
+        - folds: int
+            Number of folds.
+
+        -------
+        Returns:
+        - list of dict
+            Accuracy, training and prediction times and model size per configuration.
+    """
+
+    labels = np.array([label for _, label, _ in raw_features])
+    features_dicts = [features_dict for _, _, features_dict in raw_features]
+
+    matrices = dict()
+    for confidence in confidences:
+        features2int_dict = features_selection.select_features(analyzed_features_dict,
+                                                               confidence)
+        matrices[confidence] = features_space.features_matrix(features_dicts, features2int_dict)
+        logging.info('%s features selected with a confidence of %s%%',
+                     str(len(features2int_dict)), str(confidence))
+
+    my_queue = Queue()
+    out_queue = Queue()
+    for confidence, clf_choice in itertools.product(confidences, clf_choices):
+        for estimators in (estimators_list if clf_choice == 'RF' else [None]):
+            my_queue.put((confidence, clf_choice, estimators))
+
+    pool = workers_pool.start_workers(worker_sweep, (my_queue, out_queue, matrices, labels,
+                                                     folds))
+    results = workers_pool.get_results(pool, out_queue)
+
+    return sorted(results, key=lambda result: result['accuracy'], reverse=True)
+
+
+def print_results(results):
+    print('%10s %8s %6s %9s %10s %10s %10s %12s' % ('confidence', 'features', 'clf', 'trees',
+                                                    'accuracy', 'fit (s)', 'predict (s)',
+                                                    'size (B)'))
+    for result in results:
+        print('%10s %8d %6s %9s %10.4f %10.3f %10.3f %12d'
+              % (result['confidence'], result['features'], result['classifier'],
+                 result['estimators'], result['accuracy'], result['fit_time'],
+                 result['predict_time'], result['model_size']))
+
+
+def parsing_commands():
+    """
+        Creation of an ArgumentParser object, holding all the information necessary to parse
+        the command line into Python data types.
+    """
+
+    parser = argparse.ArgumentParser(description='k-fold cross-validation of several chi2 '
+                                                 + 'confidences and classifiers, on features '
+                                                 + 'extracted only once.')
+
+    parser.add_argument('--d', metavar='DIR', type=str, nargs='+',
+                        help='directories containing the JS files to cross-validate on')
+    parser.add_argument('--l', metavar='LABEL', type=str, nargs='+',
+                        choices=['benign', 'malicious'], help='labels of the JS directories')
+    parser.add_argument('--cache', metavar='FILE', type=str, nargs=1, default=[None],
+                        help='cache of the raw features (default: '
+                             + 'ANALYSIS_PATH/Sweep/_raw_features_)')
+    parser.add_argument('--af', metavar='FILE', type=str, nargs=1, default=[None],
+                        help='_analyzed_features_ to select the features from (default: '
+                             + 'ANALYSIS_PATH/Features/_analyzed_features_)')
+    parser.add_argument('--chi', metavar='CONFIDENCE', type=float, nargs='+',
+                        default=[99, 99.9, 99.99], help='confidences of the chi2 test, in percent')
+    parser.add_argument('--clf', metavar='CLASSIFIER', type=str, nargs='+',
+                        default=['RF', 'MNB', 'BNB'], choices=['RF', 'BNB', 'MNB'],
+                        help='classifiers')
+    parser.add_argument('--nt', metavar='NB_TREES', type=int, nargs='+', default=[100, 500],
+                        help='numbers of trees, for RF')
+    parser.add_argument('--k', metavar='FOLDS', type=int, nargs=1, default=[5],
+                        help='number of folds')
+    parser.add_argument('--o', metavar='FILE', type=str, nargs=1, default=[None],
+                        help='JSON file to store the results in')
+    utility.parsing_commands(parser)
+
+    return vars(parser.parse_args())
+
+
+def main_sweep():
+    """ Main function, runs the sweep. """
+
+    args = parsing_commands()
+    utility.control_logger(args['v'][0])
+    cpu_budget.configure(args['cpus'][0])
+    utility.configure_extraction(args)
+    analysis_path = args['analysis_path'][0]
+
+    cache_path = args['cache'][0] or os.path.join(analysis_path, 'Sweep', '_raw_features_')
+    analyzed_features_path = args['af'][0]\
+        or os.path.join(analysis_path, 'Features', '_analyzed_features_')
+
+    if not os.path.isfile(cache_path) and (args['d'] is None or args['l'] is None
+                                           or len(args['d']) != len(args['l'])):
+        logging.error('Please, indicate the JS directories to cross-validate on, with as many '
+                      + 'labels')
+        return
+
+    raw_features = get_raw_features(args['d'], args['l'], cache_path)
+    if raw_features is None:
+        return
+    # Values policy the analyzed features (and the models) were built with
+    features_values.load_policy(os.path.join(analysis_path, 'Features'))
+    raw_features = bound_raw_features(raw_features)
+    analyzed_features_dict = pickle.load(open(analyzed_features_path, 'rb'))
+
+    results = sweep(raw_features, analyzed_features_dict, args['chi'], args['clf'], args['nt'],
+                    folds=args['k'][0])
+    print_results(results)
+
+    if args['o'][0] is not None:
+        with open(args['o'][0], 'w') as json_file:
+            json.dump(results, json_file, indent=2)
+
+
+if __name__ == "__main__":  # Executed only if run as a script
+    main_sweep()
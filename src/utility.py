@@ -19,6 +19,7 @@
 import os
 import timeit
 import logging
+import importlib
 import sys
 
 SRC_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
@@ -73,10 +74,94 @@ def parsing_commands(parser):
     parser.add_argument('--analysis_path', metavar='DIR', type=str, nargs=1,
                         default=[os.path.join(SRC_PATH, 'Analysis')],
                         help='folder to store the features\' analysis results in')
+    parser.add_argument('--metrics', metavar='DIR', type=str, nargs=1, default=[None],
+                        help='folder to export per-stage metrics in (JSON and Prometheus format)')
+    parser.add_argument('--metrics_interval', metavar='SECONDS', type=int, nargs=1, default=[30],
+                        help='interval between 2 exports of the metrics during the run')
+    parser.add_argument('--profile', metavar='PROFILE', type=str, nargs=1, default=[None],
+                        choices=['cpu', 'mem'],
+                        help='profiles the workers with cProfile (cpu) or tracemalloc (mem); '
+                             + 'the stats are stored in ANALYSIS_PATH/Profile')
+    parser.add_argument('--checkpoint', metavar='DIR', type=str, nargs=1, default=[None],
+                        help='folder to log the per-file results in, to resume an interrupted '
+                             + 'run')
+    parser.add_argument('--resume', metavar='BOOL', type=bool, nargs=1, default=[False],
+                        help='skips the files already analyzed in the checkpoint logs and reuses '
+                             + 'their results (default folder: ANALYSIS_PATH/Checkpoint)')
+    parser.add_argument('--parser', metavar='BACKEND', type=str, nargs=1, default=['node'],
+                        choices=['node', 'python'],
+                        help='parser backend: Esprima through Node.js (node) or in-process '
+                             + 'esprima-python (python)')
+    parser.add_argument('--lexer_fallback', metavar='BOOL', type=bool, nargs=1, default=[False],
+                        help='approximates with a streaming lexer the features of the files '
+                             + 'Esprima cannot parse')
+    parser.add_argument('--lexer_threshold', metavar='BYTES', type=int, nargs=1, default=[None],
+                        help='files bigger than BYTES are analyzed with the streaming lexer '
+                             + 'instead of Esprima')
+    parser.add_argument('--start_method', metavar='METHOD', type=str, nargs=1, default=[None],
+                        choices=['fork', 'spawn', 'forkserver'],
+                        help='start method of the worker processes (default: the platform\'s '
+                             + 'one)')
+    parser.add_argument('--values', metavar='POLICY', type=str, nargs=1, default=['full'],
+                        choices=['full', 'truncate', 'hash'],
+                        help='features values longer than --max_value_length: kept (full), '
+                             + 'truncated or hashed to a fixed-size digest (learner.py; the '
+                             + 'classification uses the policy stored with the features)')
+    parser.add_argument('--max_value_length', metavar='CHARS', type=int, nargs=1, default=[64],
+                        help='maximum length of the features values, for --values')
+    parser.add_argument('--number_buckets', metavar='BOOL', type=bool, nargs=1, default=[False],
+                        help='buckets the numeric literals by order of magnitude')
+    parser.add_argument('--cpus', metavar='CPUS', type=int, nargs=1, default=[None],
+                        help='CPU budget: number of worker processes (and Node.js children), '
+                             + 'scikit-learn jobs and BLAS threads (default: NUM_WORKERS '
+                             + 'workers, and all the CPUs for scikit-learn and BLAS)')
+    parser.add_argument('--memo', metavar='MODE', type=str, nargs=1, default=[None],
+                        choices=['range', 'structure'],
+                        help='memoizes the features of the top-level statements and function '
+                             + 'bodies, identified by their source (range) or their structure')
+    parser.add_argument('--memo_size', metavar='FEATURES', type=int, nargs=1, default=[1 << 20],
+                        help='maximum number of features counts held by the memoization cache '
+                             + 'of each worker')
+    parser.add_argument('--ast_format', metavar='FORMAT', type=str, nargs=1, default=['json'],
+                        choices=['json', 'columnar'],
+                        help='encoding of the ASTs produced by Node.js: JSON, or columnar '
+                             + 'binary arrays the features are computed from with NumPy')
+    parser.add_argument('--vocabulary_walk', metavar='MODE', type=str, nargs=1, default=[None],
+                        choices=['bloom', 'exact'],
+                        help='maps the features to the selected ones while walking the ASTs, '
+                             + 'dropping the unknown ones (bloom: most of them rejected by a '
+                             + 'Bloom filter first; exact: all of them looked up)')
 
     return parser
 
 
+def configure_extraction(args):
+    """
+        Configures the features extraction (parser backend, streaming lexer, memoization,
+        vocabulary walk, AST format), the worker processes, the metrics and the profiling from
+        the options registered by parsing_commands. To be called by every main extracting
+        features, so that these options are honoured by all the CLIs.
+
+        -------
+        Parameter:
+        - args: dict
+            Parsed command line, as returned by vars(parser.parse_args()).
+    """
+
+    # Imported here, as these modules import utility
+    importlib.import_module('workers_pool').set_start_method(args['start_method'][0])
+    importlib.import_module('metrics').configure(args['metrics'][0], args['metrics_interval'][0])
+    importlib.import_module('profiling').configure(args['profile'][0],
+                                                   os.path.join(args['analysis_path'][0],
+                                                                'Profile'))
+    importlib.import_module('features_lexer').configure(args['lexer_fallback'][0],
+                                                        args['lexer_threshold'][0])
+    importlib.import_module('parser_backends').configure(args['parser'][0])
+    importlib.import_module('features_memo').configure(args['memo'][0], args['memo_size'][0])
+    importlib.import_module('features_ids').configure(args['vocabulary_walk'][0])
+    importlib.import_module('ast_columnar').configure(args['ast_format'][0])
+
+
 def control_logger(logging_level):
     """
         Builds a logger object.
@@ -0,0 +1,177 @@
+# Copyright (C) 2019 Aurore Fass
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+    Read-only, memory-mapped vocabulary of the selected features (features2int_dict), shared by
+    the worker processes through the page cache: the features are stored as sorted 64-bit
+    hashes, with their position in the vector space. It does not depend on the start method of
+    the workers, and their memory does not grow with the size of the vocabulary. A Bloom filter
+    of the features follows, to reject most of the unknown features with a cheap test (cf.
+    features_ids.py); the vocabularies without it remain readable.
+"""
+
+import os
+import json
+import hashlib
+import numpy as np
+
+import sketches
+
+
+MAGIC = b'JSDVOCAB'
+HEADER_SIZE = 16  # MAGIC + number of features (uint64)
+BLOOM_HEADER_SIZE = 16  # Number of bits and of hash functions of the Bloom filter (uint64)
+
+_vocabulary = None  # Vocabulary attached to, in a worker
+_vocabularies = None  # Vocabularies attached to with attach_all
+
+
+def feature_hash(feature):
+    """ 64-bit hash of a feature (context, value), stable across processes. Values equal as dict
+    keys (e.g. True, 1 and 1.0) get the same hash. """
+
+    context, value = feature
+    if isinstance(value, bool):
+        value = int(value)
+    elif isinstance(value, float) and value.is_integer():
+        value = int(value)
+    key = json.dumps([context, value], ensure_ascii=True).encode('ascii')
+    return int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), 'little')
+
+
+def feature_key(context, value):
+    """ Key of a feature (context, value) in the Bloom filter: bytes, cheaper to compute than
+    feature_hash. Features equal as dict keys get the same key, and the other ones different
+    keys. """
+
+    if isinstance(value, str):
+        return (context + '\0s' + value).encode('utf-8', errors='surrogatepass')
+    if isinstance(value, bool):
+        value = int(value)
+    elif isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return (context + '\0n' + repr(value)).encode('utf-8', errors='surrogatepass')
+
+
+def build(features2int_dict, vocabulary_path):
+    """ Writes the vocabulary of features2int_dict in vocabulary_path. """
+
+    keys = np.array([feature_hash(feature) for feature in features2int_dict], dtype=np.uint64)
+    columns = np.array(list(features2int_dict.values()), dtype=np.int32)
+    order = np.argsort(keys, kind='stable')
+    if len(keys) > 1 and np.any(keys[order][1:] == keys[order][:-1]):
+        raise ValueError('Hash collision in the vocabulary %s' % vocabulary_path)
+
+    with open(vocabulary_path + '.tmp', 'wb') as vocabulary_file:
+        vocabulary_file.write(MAGIC + np.uint64(len(keys)).tobytes())
+        vocabulary_file.write(keys[order].tobytes())
+        vocabulary_file.write(columns[order].tobytes())
+        bloom = sketches.BloomFilter.sized(len(keys))
+        for context, value in features2int_dict:
+            bloom.add(feature_key(context, value))
+        vocabulary_file.write(np.array([bloom.nb_bits, bloom.nb_hashes], dtype=np.uint64)
+                              .tobytes())
+        vocabulary_file.write(bloom.bits.tobytes())
+    os.replace(vocabulary_path + '.tmp', vocabulary_path)
+
+
+def get_vocabulary_path(features2int_dict_path, features2int_dict):
+    """ Vocabulary of the features stored in features2int_dict_path, (re)built next to it if it
+    is missing, older or without Bloom filter. """
+
+    vocabulary_path = features2int_dict_path + '.vocab'
+    if not os.path.isfile(vocabulary_path)\
+            or os.path.getmtime(vocabulary_path) < os.path.getmtime(features2int_dict_path)\
+            or os.path.getsize(vocabulary_path) <= HEADER_SIZE + 12 * len(features2int_dict):
+        build(features2int_dict, vocabulary_path)
+    return vocabulary_path
+
+
+class Vocabulary:
+    """
+    Class Vocabulary: memory-mapped vocabulary.
+    """
+
+    def __init__(self, vocabulary_path):
+        with open(vocabulary_path, 'rb') as vocabulary_file:
+            header = vocabulary_file.read(HEADER_SIZE)
+        if header[:len(MAGIC)] != MAGIC:
+            raise ValueError('%s is not a vocabulary' % vocabulary_path)
+        self.size = int(np.frombuffer(header[len(MAGIC):], dtype=np.uint64)[0])
+        if self.size:
+            self.keys = np.memmap(vocabulary_path, dtype=np.uint64, mode='r',
+                                  offset=HEADER_SIZE, shape=(self.size, ))
+            self.columns = np.memmap(vocabulary_path, dtype=np.int32, mode='r',
+                                     offset=HEADER_SIZE + 8 * self.size, shape=(self.size, ))
+        else:
+            self.keys = np.zeros(0, dtype=np.uint64)
+            self.columns = np.zeros(0, dtype=np.int32)
+
+        self.bloom = None  # Vocabularies built before the Bloom filters
+        bloom_offset = HEADER_SIZE + 12 * self.size
+        if os.path.getsize(vocabulary_path) >= bloom_offset + BLOOM_HEADER_SIZE:
+            nb_bits, nb_hashes = np.fromfile(vocabulary_path, dtype=np.uint64, count=2,
+                                             offset=bloom_offset)
+            bits = np.memmap(vocabulary_path, dtype=np.uint8, mode='r',
+                             offset=bloom_offset + BLOOM_HEADER_SIZE,
+                             shape=((int(nb_bits) + 7) // 8, ))
+            self.bloom = sketches.BloomFilter(int(nb_bits), int(nb_hashes), bits)
+
+    def __len__(self):
+        return self.size
+
+    def lookup(self, features):
+        """ Positions of the features in the vector space (-1 for the unknown ones). """
+
+        if not features or not self.size:
+            return np.full(len(features), -1, dtype=np.int32)
+        hashes = np.fromiter((feature_hash(feature) for feature in features), dtype=np.uint64,
+                             count=len(features))
+        positions = np.minimum(np.searchsorted(self.keys, hashes), self.size - 1)
+        return np.where(self.keys[positions] == hashes, self.columns[positions], -1)
+
+    def position(self, feature):
+        """ Position of one feature in the vector space (-1 if it is unknown). """
+
+        if not self.size:
+            return -1
+        key = np.uint64(feature_hash(feature))
+        index = min(int(np.searchsorted(self.keys, key)), self.size - 1)
+        return int(self.columns[index]) if self.keys[index] == key else -1
+
+
+def attach(vocabulary_path):
+    """ Worker initializer: maps the vocabulary of vocabulary_path. """
+
+    global _vocabulary
+    _vocabulary = Vocabulary(vocabulary_path)
+
+
+def attach_all(vocabulary_paths):
+    """ Worker initializer: maps several vocabularies. """
+
+    global _vocabularies
+    _vocabularies = [Vocabulary(vocabulary_path) for vocabulary_path in vocabulary_paths]
+
+
+def get_vocabulary():
+    """ Vocabulary attached to by the worker. """
+
+    return _vocabulary
+
+
+def get_vocabularies():
+    """ Vocabularies attached to by the worker with attach_all. """
+
+    return _vocabularies
@@ -0,0 +1,363 @@
+# Copyright (C) 2019 Aurore Fass
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+    Watch mode: classifies the JS files as they land in a spool directory. The model, the
+    features selected and the worker processes are loaded once; new or changed files are
+    detected with a stat index, polled (or woken up by inotify, if inotify_simple is installed).
+"""
+
+import os
+import json
+import time
+import pickle
+import logging
+import argparse
+import timeit
+from multiprocessing import Queue
+import queue  # For the exception queue.Empty which is not in the multiprocessing package
+from scipy import sparse
+
+import content_index
+import cpu_budget
+import features_space
+import features_values
+import metrics
+import profiling
+import vocabulary
+import workers_pool
+import utility
+
+try:
+    import inotify_simple
+except ImportError:  # Polling only
+    inotify_simple = None
+
+
+IGNORED_SUFFIXES = ('.json', '.tmp', '.part')  # Temporary files, e.g. Esprima JSON ASTs
+MAX_ATTEMPTS = 2  # A file analyzed by workers which died this many times gets no verdict
+
+
+def scan(spool_dir, index, settle):
+    """
+        Detects the new or changed files of spool_dir.
+
+        -------
+        Parameters:
+        - spool_dir: str
+            Directory to watch.
+        - index: dict
+            file path: (mtime_ns, size) of the files already queued; updated.
+        - settle: float
+            Files modified less than settle seconds ago may still be being written, and are
+            left for the next scan.
+
+        -------
+        Returns:
+        - list
+            (file path, mtime) of the files to classify.
+    """
+
+    changed = list()
+    now = time.time()
+    present = set()
+    for entry in os.scandir(spool_dir):
+        if entry.name.startswith('.') or entry.name.endswith(IGNORED_SUFFIXES):
+            continue
+        try:
+            if not entry.is_file():
+                continue
+            stat = entry.stat()
+        except OSError:  # Deleted or renamed since the directory was listed
+            continue
+        present.add(entry.path)
+        signature = (stat.st_mtime_ns, stat.st_size)
+        if index.get(entry.path) != signature and now - stat.st_mtime >= settle:
+            index[entry.path] = signature
+            changed.append((entry.path, stat.st_mtime))
+    for file_path in set(index) - present:  # Deleted files
+        del index[file_path]
+    return changed
+
+
+def worker_watch(my_queue, out_queue):
+    """ Persistent worker: computes the features vector of each file queued, until None, with
+    the vocabulary attached to by its initializer. It puts (pid, task, False, None) in
+    out_queue when it starts a file, so that the file is queued again if the worker dies, and
+    (pid, task, True, features) when it is done. """
+
+    features_vocabulary = vocabulary.get_vocabulary()
+    nb_features = len(features_vocabulary)
+    while True:
+        try:
+            task = my_queue.get()
+        except KeyboardInterrupt:  # Ctrl-C, the main process stops the watch
+            break
+        if task is None:
+            break
+        file_path, mtime = task
+        out_queue.put((os.getpid(), task, False, None))
+        try:
+            with metrics.timer('file_seconds'):
+                features = features_space.features_vector(file_path, nb_features,
+                                                          features_vocabulary)
+        except Exception as e:  # Handle exception occurring in the processes spawned
+            logging.error('Something went wrong with %s', file_path)
+            print(e)
+            metrics.increment('files_failed')
+            features = None
+        out_queue.put((os.getpid(), task, True, features))
+
+
+def classify_results(results, model, results_file, known=(), index=None):
+    """ Classifies the features vectors computed, prints and stores the verdicts, with the
+    ones of the known files ((file path, mtime, verdict)). The new verdicts are recorded in
+    the content index, if any. """
+
+    parsed = [result for result in results if result[2] is not None]
+    predictions = dict((file_path, verdict) for file_path, _, verdict in known)
+    if parsed:
+        labels = model.predict(sparse.vstack([features for _, _, features in parsed]))
+        predictions.update((file_path, str(label))
+                           for (file_path, _, _), label in zip(parsed, labels))
+    if index is not None:
+        index.record([file_path for file_path, _, _ in results],
+                     [predictions.get(file_path) for file_path, _, _ in results])
+
+    now = time.time()
+    for file_path, mtime, _ in list(results) + list(known):
+        prediction = predictions.get(file_path)
+        latency = now - mtime
+        metrics.observe('watch_latency_seconds', latency)
+        print(file_path + ': ' + str(prediction))
+        if results_file is not None:
+            results_file.write(json.dumps({'file': file_path, 'prediction': prediction,
+                                           'latency': round(latency, 3), 'time': now}) + '\n')
+    if results_file is not None:
+        results_file.flush()
+
+
+def save_index(index, index_path, pending):
+    """ Stores the stat index, without the files whose verdicts are pending, so that a
+    restarted watcher classifies them. """
+
+    pickle.dump(dict((file_path, signature) for file_path, signature in index.items()
+                     if file_path not in pending), open(index_path + '.tmp', 'wb'))
+    os.replace(index_path + '.tmp', index_path)
+
+
+def watch(spool_dir, model, vocabulary_path, interval=1, settle=0.5, results_path=None,
+          index_path=None, nb_workers=None, content_index_db=None):
+    """
+        Watches spool_dir and classifies its new or changed files, until interrupted.
+
+        -------
+        Parameters:
+        - spool_dir: str
+            Directory to watch.
+        - model
+            Model to classify the files with.
+        - vocabulary_path: str
+            Vocabulary of the features selected, the model was built with.
+        - interval: float
+            Seconds between 2 scans (maximum, with inotify).
+        - settle: float
+            Minimum age, in seconds, of the files to classify (so that they are complete).
+        - results_path: str
+            File to append the verdicts to (JSON lines), or None.
+        - index_path: str
+            File to store the stat index in, so that a restarted watcher does not classify
+            again the files already done (the files queued are stored once their verdict is
+            given); or None.
+        - nb_workers: int
+            Number of worker processes. Default: utility.NUM_WORKERS.
+        - content_index_db: ContentIndex
+            Known-content index: the files found in it are not analyzed, and the new verdicts
+            are recorded in it; or None.
+    """
+
+    index = dict()
+    if index_path is not None and os.path.isfile(index_path):
+        index = pickle.load(open(index_path, 'rb'))
+
+    my_queue = Queue()
+    out_queue = Queue()
+    pool = workers_pool.start_workers(worker_watch, (my_queue, out_queue), nb_workers=nb_workers,
+                                      initializer=vocabulary.attach,
+                                      initargs=(vocabulary_path, ))
+    started = dict()  # pid: task of the file a worker is analyzing
+    dead = set()  # pids of the workers which died (their last messages may come later)
+    attempts = dict()  # file path: number of workers which died analyzing it
+    pending = dict()  # file path: number of times it is queued, without a verdict yet
+    results_file = open(results_path, 'a') if results_path is not None else None
+
+    inotify = None
+    if inotify_simple is not None:
+        inotify = inotify_simple.INotify()
+        inotify.add_watch(spool_dir, inotify_simple.flags.CLOSE_WRITE
+                          | inotify_simple.flags.MOVED_TO | inotify_simple.flags.CREATE)
+    logging.info('Watching %s (%s)', spool_dir, 'inotify' if inotify else 'polling')
+
+    nb_pending = 0
+    last_export = timeit.default_timer()
+    try:
+        while True:
+            changed = scan(spool_dir, index, settle)
+            known = list()
+            for file_path, mtime in changed:
+                verdict = None
+                if content_index_db is not None:
+                    try:
+                        verdict = content_index_db.lookup(file_path)
+                    except OSError:  # Removed meanwhile
+                        pass
+                if verdict is not None:  # Neither parsed nor classified
+                    known.append((file_path, mtime, verdict))
+                else:
+                    my_queue.put((file_path, mtime))
+                    pending[file_path] = pending.get(file_path, 0) + 1
+                    nb_pending += 1
+
+            results = list()
+            while nb_pending:  # Results available, without waiting
+                try:
+                    pid, task, done, features = out_queue.get_nowait()
+                except queue.Empty:
+                    break
+                if not done:
+                    started[pid] = task
+                    continue
+                started.pop(pid, None)
+                results.append(task + (features, ))
+            dead.update(workers_pool.restart_workers(pool, worker_watch, (my_queue, out_queue),
+                                                     initializer=vocabulary.attach,
+                                                     initargs=(vocabulary_path, )))
+            for pid in [pid for pid in started if pid in dead]:
+                file_path, _ = task = started.pop(pid)
+                attempts[file_path] = attempts.get(file_path, 0) + 1
+                if attempts[file_path] < MAX_ATTEMPTS:
+                    my_queue.put(task)
+                else:
+                    logging.error('%s given up, after %s workers died analyzing it', file_path,
+                                  str(attempts[file_path]))
+                    results.append(task + (None, ))
+            for file_path, _, _ in results:
+                nb_pending -= 1
+                attempts.pop(file_path, None)
+                pending[file_path] -= 1
+                if not pending[file_path]:
+                    del pending[file_path]
+            if results or known:
+                classify_results(results, model, results_file, known, content_index_db)
+            if (changed or results) and index_path is not None:
+                save_index(index, index_path, pending)
+
+            if metrics.enabled():
+                metrics.collect(pool.metrics_queue)
+                if timeit.default_timer() - last_export > metrics.METRICS_INTERVAL:
+                    metrics.export()
+                    last_export = timeit.default_timer()
+
+            wait = interval if not nb_pending else min(interval, 0.05)
+            if inotify is not None and not nb_pending:
+                if inotify.read(timeout=int(1000 * interval)):
+                    time.sleep(settle)  # The files may still be being written
+            else:
+                time.sleep(wait)
+
+    except KeyboardInterrupt:
+        logging.info('Stopping the watch')
+
+    finally:
+        for _ in pool.workers:
+            my_queue.put(None)
+        for worker in pool.workers:
+            worker.join()
+        if results_file is not None:
+            results_file.close()
+        if content_index_db is not None:
+            content_index_db.close()
+        if metrics.enabled():
+            metrics.collect(pool.metrics_queue)
+            metrics.export()
+        profiling.report()
+
+
+def parsing_commands():
+    """
+        Creation of an ArgumentParser object, holding all the information necessary to parse
+        the command line into Python data types.
+    """
+
+    parser = argparse.ArgumentParser(description='Watches a spool directory and classifies its '
+                                                 + 'JS files as they land.')
+
+    parser.add_argument('--w', metavar='DIR', type=str, nargs=1, required=True,
+                        help='spool directory to watch')
+    parser.add_argument('--m', metavar='MODEL', type=str, nargs=1, required=True,
+                        help='path of the model used to classify the new JS inputs')
+    parser.add_argument('--interval', metavar='SECONDS', type=float, nargs=1, default=[1],
+                        help='interval between 2 scans of the spool directory')
+    parser.add_argument('--settle', metavar='SECONDS', type=float, nargs=1, default=[0.5],
+                        help='minimum age of the files to classify, so that they are complete')
+    parser.add_argument('--o', metavar='FILE', type=str, nargs=1, default=[None],
+                        help='file to append the verdicts to (JSON lines)')
+    parser.add_argument('--index', metavar='FILE', type=str, nargs=1, default=[None],
+                        help='file to store the index of the files already classified in')
+    parser.add_argument('--workers', metavar='INT', type=int, nargs=1, default=[None],
+                        help='number of worker processes (default: NUM_WORKERS, or --cpus - 1 '
+                             + 'as the main process classifies the files meanwhile)')
+    parser.add_argument('--content_index', metavar='DB', type=str, nargs=1, default=[None],
+                        help='known-content index (SQLite): the files already classified with '
+                             + 'the same model, or pinned, are not analyzed again')
+    parser.add_argument('--normalized_hash', metavar='BOOL', type=bool, nargs=1, default=[False],
+                        help='also looks up the files in the content index by the hash of '
+                             + 'their tokens, ignoring whitespaces and comments')
+    utility.parsing_commands(parser)
+
+    return vars(parser.parse_args())
+
+
+def main_watch():
+    """ Main function, watches the spool directory. """
+
+    args = parsing_commands()
+    utility.control_logger(args['v'][0])
+    cpu_budget.configure(args['cpus'][0])
+    utility.configure_extraction(args)
+
+    features_values.load_policy(os.path.join(args['analysis_path'][0], 'Features'))
+    model = pickle.load(open(args['m'][0], 'rb'))
+    nb_workers = args['workers'][0]
+    if cpu_budget.CPUS is not None:  # The model runs while the workers extract features
+        cpu_budget.limit_model(model, 1)
+        nb_workers = nb_workers or max(1, cpu_budget.CPUS - 1)
+    features2int_dict_path = os.path.join(args['analysis_path'][0], 'Features',
+                                          '_selected_features_')
+    vocabulary_path = vocabulary.get_vocabulary_path(
+        features2int_dict_path, pickle.load(open(features2int_dict_path, 'rb')))
+    content_index_db = None
+    if args['content_index'][0] is not None:
+        content_index_db = content_index.ContentIndex(
+            args['content_index'][0],
+            content_index.model_fingerprint(args['m'], os.path.join(args['analysis_path'][0],
+                                                                    'Features')),
+            args['normalized_hash'][0])
+    watch(args['w'][0], model, vocabulary_path, interval=args['interval'][0],
+          settle=args['settle'][0], results_path=args['o'][0], index_path=args['index'][0],
+          nb_workers=nb_workers, content_index_db=content_index_db)
+
+
+if __name__ == "__main__":  # Executed only if run as a script
+    main_watch()
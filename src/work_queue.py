@@ -0,0 +1,343 @@
+# Copyright (C) 2019 Aurore Fass
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+    Distributed features extraction over a shared filesystem: a coordinator splits the JS files
+    into batches stored in a sqlite job table; workers on any number of hosts lease batches,
+    write their features next to the job table, and re-lease the batches whose lease expired.
+"""
+
+import os
+import json
+import time
+import pickle
+import socket
+import sqlite3
+import logging
+import argparse
+import timeit
+from multiprocessing import Queue
+
+import corpus_pack
+import cpu_budget
+import features_extraction
+import features_preselection
+import features_shards
+import features_values
+import workers_pool
+import utility
+
+
+DB_NAME = 'jobs.sqlite'
+RESULTS_DIR = 'results'
+MAX_ATTEMPTS = 3  # A batch leased MAX_ATTEMPTS times without being done is marked as failed
+
+
+def connect(queue_dir):
+    """ Connection to the job table. The journal is kept in DELETE mode, as WAL does not work
+    over NFS. """
+
+    connection = sqlite3.connect(os.path.join(queue_dir, DB_NAME), timeout=120,
+                                 isolation_level=None)
+    connection.execute('PRAGMA journal_mode=DELETE')
+    return connection
+
+
+def init_queue(queue_dir, js_dirs, labels, batch_size):
+    """
+        Coordinator: creates the job table, with the files from js_dirs split into batches.
+
+        -------
+        Parameters:
+        - queue_dir: str
+            Folder (on the shared volume) to store the job table and the results in.
+        - js_dirs: list of str
+            Directories containing the JS files to be analyzed.
+        - labels: list of str
+            Labels of the directories.
+        - batch_size: int
+            Number of files per batch.
+
+        -------
+        Returns:
+        - int
+            Number of batches created; None if the job table already has batches (the files
+            would be analyzed twice).
+    """
+
+    if not os.path.exists(os.path.join(queue_dir, RESULTS_DIR)):
+        os.makedirs(os.path.join(queue_dir, RESULTS_DIR))
+
+    connection = connect(queue_dir)
+    connection.execute('CREATE TABLE IF NOT EXISTS tasks (id INTEGER PRIMARY KEY, label TEXT, '
+                       + 'files TEXT, state TEXT, owner TEXT, lease_expiry REAL, '
+                       + 'attempts INTEGER DEFAULT 0)')
+    connection.execute('BEGIN IMMEDIATE')
+    if connection.execute('SELECT COUNT(*) FROM tasks').fetchone()[0]:
+        connection.execute('ROLLBACK')
+        connection.close()
+        logging.error('The job table of %s already has batches; please, use another folder',
+                      queue_dir)
+        return None
+    nb_tasks = 0
+    for i, js_dir in enumerate(js_dirs):
+        batch = list()
+        for file_path in sorted(corpus_pack.list_files(os.path.abspath(js_dir))[0]):
+            batch.append(file_path)
+            if len(batch) == batch_size:
+                connection.execute("INSERT INTO tasks (label, files, state) VALUES "
+                                   + "(?, ?, 'pending')", (labels[i], json.dumps(batch)))
+                nb_tasks += 1
+                batch = list()
+        if batch:
+            connection.execute("INSERT INTO tasks (label, files, state) VALUES (?, ?, 'pending')",
+                               (labels[i], json.dumps(batch)))
+            nb_tasks += 1
+    connection.execute('COMMIT')
+    connection.close()
+    features_values.store_policy(queue_dir)  # Used by all workers, cf. work
+    logging.info('Created %s tasks in %s', str(nb_tasks), queue_dir)
+    return nb_tasks
+
+
+def lease_task(connection, owner, lease):
+    """ Leases the next pending batch, or a batch whose lease expired. Returns
+    (id, label, files) or None if there is nothing left to do. """
+
+    now = time.time()
+    connection.execute('BEGIN IMMEDIATE')  # Write lock on the job table
+    try:
+        connection.execute("UPDATE tasks SET state = 'failed' WHERE state = 'leased' AND "
+                           + "lease_expiry < ? AND attempts >= ?", (now, MAX_ATTEMPTS))
+        row = connection.execute("SELECT id, label, files FROM tasks WHERE state = 'pending' OR "
+                                 + "(state = 'leased' AND lease_expiry < ?) ORDER BY id LIMIT 1",
+                                 (now,)).fetchone()
+        if row is not None:
+            connection.execute("UPDATE tasks SET state = 'leased', owner = ?, lease_expiry = ?, "
+                               + "attempts = attempts + 1 WHERE id = ?", (owner, now + lease,
+                                                                         row[0]))
+        connection.execute('COMMIT')
+    except sqlite3.Error:
+        connection.execute('ROLLBACK')
+        raise
+    if row is None:
+        return None
+    return row[0], row[1], json.loads(row[2])
+
+
+def next_expiry(connection):
+    """ Earliest lease expiry of the batches leased (by any host), or None if there are none. """
+
+    return connection.execute("SELECT MIN(lease_expiry) FROM tasks WHERE state = 'leased'")\
+        .fetchone()[0]
+
+
+def renew_lease(connection, task_id, owner, lease):
+    """ Extends the lease of a batch; returns False if the lease was lost. """
+
+    cursor = connection.execute("UPDATE tasks SET lease_expiry = ? WHERE id = ? AND owner = ? "
+                                + "AND state = 'leased'", (time.time() + lease, task_id, owner))
+    return cursor.rowcount == 1
+
+
+def complete_task(connection, task_id, owner):
+    cursor = connection.execute("UPDATE tasks SET state = 'done' WHERE id = ? AND owner = ? "
+                                + "AND state = 'leased'", (task_id, owner))
+    return cursor.rowcount == 1
+
+
+def worker_work_queue(queue_dir, lease, out_queue):
+    """ Worker: leases batches until there is none left, and stores their features in
+    queue_dir/results/<task id>. While other workers (on any host) hold batches, it waits for
+    their leases to expire, to take them over if their worker died. """
+
+    owner = socket.gethostname() + ':' + str(os.getpid())
+    connection = connect(queue_dir)
+
+    while True:
+        task = lease_task(connection, owner, lease)
+        if task is None:
+            expiry = next_expiry(connection)
+            if expiry is None:  # All the batches are done or failed
+                break
+            time.sleep(min(max(expiry - time.time(), 0) + 1, lease))
+            continue
+        task_id, label, files = task
+        results = list()
+        for file_path in files:
+            try:
+                features_dict, _ = features_extraction.get_features(file_path)
+            except Exception as e:  # Same handling as features_preselection.worker_get_features
+                logging.error('Something went wrong with %s', file_path)
+                print(e)
+                features_dict = None
+            results.append((file_path, label, features_dict))
+            if not renew_lease(connection, task_id, owner, lease):
+                logging.warning('Lost the lease of the task %s', str(task_id))
+                break
+        else:
+            result_path = os.path.join(queue_dir, RESULTS_DIR, str(task_id))
+            pickle.dump(results, open(result_path + '.' + owner + '.tmp', 'wb'))
+            os.replace(result_path + '.' + owner + '.tmp', result_path)  # Atomic
+            if complete_task(connection, task_id, owner):
+                out_queue.put([task_id, len(files)])
+
+    connection.close()
+
+
+def work(queue_dir, lease, nb_workers):
+    """ Runs nb_workers local worker processes on the job table of queue_dir. """
+
+    features_values.load_policy(queue_dir)
+    start = timeit.default_timer()
+    out_queue = Queue()
+    pool = workers_pool.start_workers(worker_work_queue, (queue_dir, lease, out_queue),
+                                      nb_workers=nb_workers)
+    done = workers_pool.get_results(pool, out_queue)
+
+    elapsed_time = timeit.default_timer() - start
+    nb_files = sum(nb for _, nb in done)
+    print('Processed ' + str(len(done)) + ' batches, ' + str(nb_files) + ' files in '
+          + str(round(elapsed_time, 2)) + 's (' + str(round(nb_files / elapsed_time, 2))
+          + ' files/s)')
+
+
+def status(queue_dir):
+    """ Number of batches per state. """
+
+    connection = connect(queue_dir)
+    rows = connection.execute('SELECT state, COUNT(*) FROM tasks GROUP BY state').fetchall()
+    connection.close()
+    for state, count in rows:
+        print(state + ': ' + str(count))
+    return dict(rows)
+
+
+def iterate_results(queue_dir):
+    """ Iterates over the (file path, label, features dict) of the batches done. """
+
+    connection = connect(queue_dir)
+    task_ids = [row[0] for row in connection.execute("SELECT id FROM tasks WHERE state = 'done' "
+                                                     + "ORDER BY id")]
+    connection.close()
+    for task_id in task_ids:
+        for result in pickle.load(open(os.path.join(queue_dir, RESULTS_DIR, str(task_id)), 'rb')):
+            yield result
+
+
+def collect(queue_dir, shard_dir):
+    """ Coordinator: counts the features of the batches done into a df shard per label and a
+    contingency shard (cf. features_shards), to be exported for the features selection. """
+
+    if not os.path.exists(shard_dir):
+        os.makedirs(shard_dir)
+    features_values.load_policy(queue_dir)  # Stored in the shards
+
+    all_features_dicts = dict()
+    with_features_dict = dict()
+    files = dict((label, 0) for label in features_shards.LABELS)
+    for _, label, features_dict in iterate_results(queue_dir):
+        if features_dict is None:
+            continue
+        features_preselection.handle_features_1file(features_dict,
+                                                    all_features_dicts.setdefault(label, dict()))
+        files[label] = files.get(label, 0) + 1
+        if label in features_shards.LABELS:
+            i = features_shards.LABELS.index(label)
+            for feature in features_dict:
+                if feature not in with_features_dict:
+                    with_features_dict[feature] = [0, 0]
+                with_features_dict[feature][i] += 1
+
+    for label, all_features_dict in all_features_dicts.items():
+        features_shards.write_shard(
+            os.path.join(shard_dir, 'df-' + label + '.shard'), 'df', {label: files[label]},
+            features_shards.sorted_records(dict((feature, [count]) for feature, count
+                                                in all_features_dict.items())), label=label)
+    features_shards.write_shard(
+        os.path.join(shard_dir, 'contingency.shard'), 'contingency',
+        dict((label, files[label]) for label in features_shards.LABELS),
+        features_shards.sorted_records(with_features_dict))
+    logging.info('Stored the shards in %s', shard_dir)
+
+
+def parsing_commands():
+    """
+        Creation of an ArgumentParser object, holding all the information necessary to parse
+        the command line into Python data types.
+    """
+
+    parser = argparse.ArgumentParser(description='Distributed features extraction over a '
+                                                 + 'shared filesystem work queue.')
+
+    mode = parser.add_mutually_exclusive_group(required=True)
+    mode.add_argument('--init', metavar='QUEUE-DIR', type=str, nargs=1,
+                      help='coordinator: creates the job table in QUEUE-DIR, with the files of '
+                           + 'the directories --d')
+    mode.add_argument('--work', metavar='QUEUE-DIR', type=str, nargs=1,
+                      help='worker: processes the batches of the job table in QUEUE-DIR')
+    mode.add_argument('--status', metavar='QUEUE-DIR', type=str, nargs=1,
+                      help='prints the number of batches per state')
+    mode.add_argument('--collect', metavar='QUEUE-DIR', type=str, nargs=1,
+                      help='coordinator: counts the features of the batches done into shards')
+    parser.add_argument('--d', metavar='DIR', type=str, nargs='+',
+                        help='directories containing the JS files to be analyzed')
+    parser.add_argument('--l', metavar='LABEL', type=str, nargs='+',
+                        choices=['benign', 'malicious', '?'], help='labels of the JS directories')
+    parser.add_argument('--batch', metavar='INT', type=int, nargs=1, default=[100],
+                        help='number of files per batch')
+    parser.add_argument('--lease', metavar='SECONDS', type=int, nargs=1, default=[600],
+                        help='lease duration of a batch, renewed after each file')
+    parser.add_argument('--workers', metavar='INT', type=int, nargs=1, default=[None],
+                        help='number of local worker processes (default: NUM_WORKERS, or '
+                             + '--cpus)')
+    parser.add_argument('--o', metavar='DIR', type=str, nargs=1,
+                        help='folder to store the shards in, for --collect')
+    utility.parsing_commands(parser)
+
+    return vars(parser.parse_args())
+
+
+def main_work_queue():
+    """ Main function, runs the coordinator or the worker mode. """
+
+    args = parsing_commands()
+    utility.control_logger(args['v'][0])
+    cpu_budget.configure(args['cpus'][0])
+    utility.configure_extraction(args)
+    features_values.configure(args['values'][0], args['max_value_length'][0],
+                              args['number_buckets'][0])
+
+    if args['init'] is not None:
+        if args['d'] is None or args['l'] is None or len(args['d']) != len(args['l']):
+            logging.error('Please, indicate the JS directories to be analyzed, with as many '
+                          + 'labels')
+        else:
+            init_queue(args['init'][0], args['d'], args['l'], args['batch'][0])
+
+    elif args['work'] is not None:
+        work(args['work'][0], args['lease'][0], args['workers'][0])
+
+    elif args['status'] is not None:
+        status(args['status'][0])
+
+    elif args['o'] is None:
+        logging.error('Please, indicate the folder to store the shards in with --o')
+
+    else:
+        collect(args['collect'][0], args['o'][0])
+
+
+if __name__ == "__main__":  # Executed only if run as a script
+    main_work_queue()
@@ -0,0 +1,300 @@
+# Copyright (C) 2019 Aurore Fass
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+    Starting of the worker processes and collection of their results, shared by the
+    features extraction pools.
+"""
+
+import sys
+import timeit
+import logging
+import importlib
+import multiprocessing
+from multiprocessing import Process, Queue
+import queue  # For the exception queue.Empty which is not in the multiprocessing package
+
+import corpus_pack
+import cpu_budget
+import metrics
+import profiling
+import utility
+
+
+BATCH_BYTES = 1 << 16  # Files costing less than that are dispatched in batches of BATCH_BYTES
+FILE_BYTES = 1 << 14  # Fixed cost of a file (e.g. Node.js start-up), in equivalent bytes
+
+# Module globals set by the command line options, which the workers need whatever the start
+# method (with spawn or forkserver, they do not inherit the ones of the main process)
+CONFIGURATION = {
+    'utility': ('NUM_WORKERS', ),
+    'metrics': ('METRICS_PATH', 'METRICS_INTERVAL'),
+    'profiling': ('PROFILE', 'PROFILE_PATH'),
+    'parser_backends': ('BACKEND', ),
+    'features_lexer': ('FALLBACK', 'SIZE_THRESHOLD'),
+    'features_values': ('VALUES', 'MAX_LENGTH', 'NUMBER_BUCKETS'),
+    'features_memo': ('MEMO', 'MEMO_FEATURES'),
+    'features_ids': ('WALK', ),
+    'ast_columnar': ('AST_FORMAT', ),
+    'cpu_budget': ('CPUS', ),
+}
+
+
+def set_start_method(start_method):
+    """ Start method of the workers (default: the platform's one); to call before creating any
+    queue. """
+
+    if start_method is not None:
+        multiprocessing.set_start_method(start_method, force=True)
+
+
+def config_snapshot():
+    """ Values of the CONFIGURATION globals of the modules loaded. """
+
+    return dict((name, dict((attribute, getattr(sys.modules[name], attribute))
+                            for attribute in attributes))
+                for name, attributes in CONFIGURATION.items() if name in sys.modules)
+
+
+def restore_config(config):
+    """ In a worker: sets the CONFIGURATION globals given by config_snapshot. """
+
+    for name, values in config.items():
+        module = importlib.import_module(name)
+        for attribute, value in values.items():
+            setattr(module, attribute, value)
+
+
+class Pool:
+    """
+    Class Pool: worker processes getting their tasks from my_queue and putting their results
+    in out_queue.
+    """
+
+    def __init__(self):
+        self.workers = list()
+        self.metrics_queue = Queue()
+        self.stats_queue = Queue()  # (busy time, number of tasks) of each worker
+        self.start = timeit.default_timer()
+
+
+_busy_time = 0  # In a worker: time spent on the tasks given by iter_tasks
+_nb_tasks = 0
+
+
+def schedule(tasks, sizes):
+    """
+        Largest-first dispatching: sorts the tasks by decreasing size, the small ones being
+        grouped into batches, so that the biggest files do not end up alone at the end of the
+        run and the long tail of small files costs few queue operations.
+
+        -------
+        Parameters:
+        - tasks: list
+            Tasks (e.g. Analysis objects).
+        - sizes: list of int
+            Size of the file of each task, in bytes.
+
+        -------
+        Returns:
+        - list
+            Batches (lists) of tasks.
+    """
+
+    batches = list()
+    batch, batch_bytes = list(), 0
+    for size, task in sorted(zip(sizes, tasks), key=lambda size_task: size_task[0],
+                             reverse=True):
+        if size + FILE_BYTES >= BATCH_BYTES:
+            batches.append([task])
+            continue
+        batch.append(task)
+        batch_bytes += size + FILE_BYTES
+        if batch_bytes >= BATCH_BYTES:
+            batches.append(batch)
+            batch, batch_bytes = list(), 0
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def put_tasks(my_queue, tasks, files=None):
+    """ Puts the tasks in my_queue, to be read with iter_tasks: largest-first and batched
+    (cf. schedule) if the file of each task is given, else one by one, in order. """
+
+    if files is None:
+        batches = [[task] for task in tasks]
+    else:
+        batches = schedule(tasks, [corpus_pack.get_size(file_path) for file_path in files])
+    for batch in batches:
+        my_queue.put(batch)
+
+
+def iter_tasks(my_queue):
+    """ In a worker: yields the tasks put in my_queue by put_tasks, until it is empty, and
+    measures the time spent on them. """
+
+    global _busy_time, _nb_tasks
+    while True:
+        try:
+            batch = my_queue.get(timeout=2)
+        except queue.Empty:  # Empty queue exception
+            break
+        for task in batch:
+            start = timeit.default_timer()
+            yield task
+            _busy_time += timeit.default_timer() - start
+            _nb_tasks += 1
+
+
+def worker_main(worker, args, metrics_queue, stats_queue, config, initializer=None,
+                initargs=()):
+    """ Entry point of the worker processes: runs initializer(*initargs), then worker(*args). """
+
+    restore_config(config)
+    cpu_budget.limit_worker()
+    metrics.attach(metrics_queue)
+    if initializer is not None:
+        initializer(*initargs)
+    profiling.start()
+    try:
+        worker(*args)
+    finally:
+        metrics.increment('worker_busy_seconds', _busy_time)
+        metrics.flush()
+        profiling.stop(worker.__name__)
+        stats_queue.put((_busy_time, _nb_tasks))
+
+
+def report_utilization(pool, makespan):
+    """ Logs the share of the makespan each worker spent on tasks (given by iter_tasks). """
+
+    stats = list()
+    for _ in pool.workers:
+        try:
+            stats.append(pool.stats_queue.get(timeout=1))
+        except queue.Empty:  # Worker killed
+            break
+    if not stats or not sum(nb_tasks for _, nb_tasks in stats) or makespan <= 0:
+        return
+    utilizations = [busy_time / makespan for busy_time, _ in stats]
+    logging.info('Makespan %ss, workers utilization: %s (tasks: %s)', str(round(makespan, 2)),
+                 ' '.join(str(round(100 * utilization)) + '%' for utilization in utilizations),
+                 ' '.join(str(nb_tasks) for _, nb_tasks in stats))
+
+
+def start_workers(worker, args, nb_workers=None, initializer=None, initargs=()):
+    """
+        Starts nb_workers processes running worker(*args).
+
+        -------
+        Parameters:
+        - worker: function
+            Worker, at module level.
+        - args: tuple
+            Arguments of the worker, typically (my_queue, out_queue, except_queue).
+        - nb_workers: int
+            Number of processes. Default: utility.NUM_WORKERS.
+        - initializer: function
+            Function, at module level, run by each worker before worker, e.g. to attach to
+            shared data (cf. vocabulary.attach), or None.
+        - initargs: tuple
+            Arguments of initializer.
+
+        -------
+        Returns:
+        - Pool
+    """
+
+    pool = Pool()
+    config = config_snapshot()
+    for _ in range(nb_workers or utility.NUM_WORKERS):
+        pool.workers.append(start_worker(pool, worker, args, config, initializer, initargs))
+    return pool
+
+
+def start_worker(pool, worker, args, config, initializer=None, initargs=()):
+    """ Starts one process of pool running worker(*args), cf. start_workers. """
+
+    p = Process(target=worker_main, args=(worker, args, pool.metrics_queue, pool.stats_queue,
+                                          config, initializer, initargs))
+    p.start()
+    return p
+
+
+def restart_workers(pool, worker, args, initializer=None, initargs=()):
+    """ Replaces the workers of pool which exited (e.g. killed for lack of memory) with new
+    ones, for the persistent workers which only exit when told to. Returns the pids of the
+    workers replaced. """
+
+    replaced = list()
+    config = config_snapshot()
+    for i, w in enumerate(pool.workers):
+        if w.exitcode is not None:
+            logging.error('Worker %s exited with code %s, restarted', str(w.pid),
+                          str(w.exitcode))
+            replaced.append(w.pid)
+            pool.workers[i] = start_worker(pool, worker, args, config, initializer, initargs)
+    return replaced
+
+
+def stop_workers(pool):
+    """ Terminates the workers of pool still running, e.g. when their results are no longer
+    read (they could be waiting on a bounded out_queue). """
+
+    for w in pool.workers:
+        if w.exitcode is None:
+            w.terminate()
+            w.join()
+
+
+def get_results(pool, out_queue, log=None):
+    """ Collects the results put in out_queue until all the workers of pool have exited.
+    The results are also appended to the checkpoint log, if any. """
+
+    return list(iter_results(pool, out_queue, log))
+
+
+def iter_results(pool, out_queue, log=None):
+    """ Same as get_results, but yields the results as they arrive, without keeping them. """
+
+    last_export = timeit.default_timer()
+
+    while True:
+        try:
+            result = out_queue.get(timeout=0.01)
+            if log is not None:
+                log.append(result)
+            yield result
+        except queue.Empty:
+            pass
+        if metrics.enabled():
+            metrics.collect(pool.metrics_queue)  # So that no worker blocks on a full pipe
+            if timeit.default_timer() - last_export > metrics.METRICS_INTERVAL:
+                metrics.export()
+                last_export = timeit.default_timer()
+        all_exited = True
+        for w in pool.workers:
+            if w.exitcode is None:
+                all_exited = False
+                break
+        if all_exited & out_queue.empty():
+            break
+
+    report_utilization(pool, timeit.default_timer() - pool.start)
+
+    if metrics.enabled():
+        metrics.collect(pool.metrics_queue)
+        metrics.export()
+    profiling.report()